@@ -5,18 +5,31 @@ Provides RESTful APIs for frontend to interact with backend
 
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 import uvicorn
 from datetime import datetime
-import base64
 import io
 from pathlib import Path
 import json
+import mimetypes
 import os
+import sys
+import shutil
+import asyncio
+import csv
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 import requests
 
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
 # AWS Bedrock for AI
 try:
     import boto3
@@ -61,8 +74,87 @@ def call_groq_api(prompt: str, system_prompt: str = "You are a medical AI assist
         print(f"❌ Groq API error: {e}")
         return None
 
+# Image enhancement engine (shared with the Lambda package)
+sys.path.insert(0, str(Path(__file__).parent / "lambda_package"))
+try:
+    from PIL import UnidentifiedImageError
+    from enhancement_engine import enhance_image_to_file_cached
+    from pipelines import configure_pipelines
+    from batch_processing import spool_to_shared_memory
+    from base64_stream import data_start, decode_base64_to
+    from dicom_io import UnsupportedDicomError, parse_windows
+    from nifti_volume import UnsupportedVolumeError, enhance_volume
+    from cine import OUTPUT_MEDIA_TYPES as CLIP_MEDIA_TYPES, UnsupportedClipError, enhance_clip
+    from tiled_engine import MemoryBudgetExceeded
+    from quality_metrics import normalize_mode as normalize_metrics_mode
+    from encoders import MEDIA_TYPES, OUTPUT_FORMATS, resolve_encoding
+    from image_features import describe as describe_features
+    IMAGE_ENGINE_AVAILABLE = True
+except ImportError as e:
+    print(f"⚠️ Image enhancement engine not available: {e}")
+    IMAGE_ENGINE_AVAILABLE = False
+
+# Shared system configuration (config/config.yaml)
+CONFIG_PATH = Path(__file__).parent.parent / "config" / "config.yaml"
+
+
+def load_config() -> Dict:
+    """Load config.yaml, falling back to defaults when it is missing"""
+    if yaml is None or not CONFIG_PATH.exists():
+        return {}
+    with open(CONFIG_PATH) as f:
+        return yaml.safe_load(f) or {}
+
+
+CONFIG = load_config()
+NUM_WORKERS = CONFIG.get("data_processing", {}).get("num_workers", 4)
+BATCH_SIZE = CONFIG.get("data_processing", {}).get("batch_size", 16)
+
+# Cine loops and multi-frame images (image_enhancement.cine)
+CINE = CONFIG.get("image_enhancement", {}).get("cine", {})
+# Tiled processing for very large images (image_enhancement.tiling)
+TILING_CONFIG = CONFIG.get("image_enhancement", {}).get("tiling", {})
+TILING = {
+    "min_pixels": int(TILING_CONFIG.get("min_megapixels", 16) * 1_000_000),
+    "tile_size": TILING_CONFIG.get("tile_size", 1024),
+    "max_memory_mb": TILING_CONFIG.get("max_memory_mb"),
+    # Each pool process enhances one image at a time; share the cores between them
+    "workers": max(1, (os.cpu_count() or 1) // NUM_WORKERS),
+}
+# PSNR/SSIM mode for enhanced images: fast, full or off
+METRICS_MODE = CONFIG.get("image_enhancement", {}).get("quality_metrics", "fast")
+# Output encoding per modality (image_enhancement.encoding), overridable per request
+ENCODING_DEFAULTS = CONFIG.get("image_enhancement", {}).get("encoding", {})
+# Preview pyramid written next to each enhanced image (image_enhancement.previews)
+PREVIEWS = CONFIG.get("image_enhancement", {}).get("previews", {"sizes": [256, 1024], "encoding": "jpeg:90"})
+# Content-addressed result cache (image_enhancement.result_cache): re-sent studies
+# reuse the stored outputs instead of re-running the pipeline
+RESULT_CACHE_CONFIG = CONFIG.get("image_enhancement", {}).get("result_cache", {})
+RESULT_CACHE = RESULT_CACHE_CONFIG if RESULT_CACHE_CONFIG.get("enabled", True) else None
+# Per-modality pipeline definitions (image_enhancement.pipelines); compiled here
+# so a bad definition stops the server at startup, and again in each pool worker
+PIPELINES = CONFIG.get("image_enhancement", {}).get("pipelines", {})
+# Stage defaults: the denoise stage's, and super-resolution appended to every
+# pipeline when image_enhancement.super_resolution is enabled
+STAGE_DEFAULTS = {
+    "denoise": CONFIG.get("image_enhancement", {}).get("denoising", {}),
+    "upscale": CONFIG.get("image_enhancement", {}).get("super_resolution", {}),
+}
+# No-reference quality gate (image_enhancement.quality_gate): per image, skip,
+# shorten or strengthen the pipeline from measured contrast, sharpness and noise
+QUALITY_GATE = CONFIG.get("image_enhancement", {}).get("quality_gate", {})
+if IMAGE_ENGINE_AVAILABLE:
+    configure_pipelines(PIPELINES, STAGE_DEFAULTS, QUALITY_GATE)
+
+# Enhanced image storage and worker pool (created on first use)
+ENHANCED_IMAGES_DIR = Path(__file__).parent / "enhanced_images"
+ENHANCED_IMAGES_DIR.mkdir(exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+image_pool = None
+
 # Import database
-from database import Database
+from database import Database, EXPORT_TABLES, normalize_timestamp
+from bulk_import import IMPORT_KINDS, DEFAULT_BATCH_SIZE, detect_format, import_stream
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -98,6 +190,10 @@ class ImageEnhanceRequest(BaseModel):
     patient_name: str
     image_type: str
     image_data: Optional[str] = None  # Base64 encoded
+    output_mode: Optional[str] = None  # "RGB" to force 3-channel output
+    window: Optional[str] = None  # DICOM window preset(s), e.g. "lung,bone"
+    metrics_mode: Optional[str] = None  # "fast", "full" or "off"; defaults to config
+    encoding: Optional[str] = None  # "png:1:rle", "webp", "jpeg:90"; defaults per modality
 
 
 class ClinicalNoteRequest(BaseModel):
@@ -136,8 +232,13 @@ async def root():
             "dashboard": "/api/dashboard/stats",
             "patients": "/api/patients",
             "images": "/api/images",
+            "image_batch": "/api/images/batch",
+            "volumes": "/api/volumes/upload",
+            "cine": "/api/cine/upload",
             "notes": "/api/notes",
-            "icd10": "/api/icd10"
+            "icd10": "/api/icd10",
+            "export": "/api/export/{table}",
+            "import": "/api/import/{kind}"
         }
     }
 
@@ -246,9 +347,11 @@ async def get_patient_stats():
 
 @app.get("/api/images")
 async def get_enhanced_images(patient_id: Optional[str] = None, limit: int = 100):
-    """Get enhanced images"""
+    """Get enhanced images, each with the URL of its smallest stored preview"""
     try:
         images = db.get_enhanced_images(patient_id, limit)
+        for image in images:
+            image["preview_url"] = next(iter(preview_urls(image["id"], image["enhancement_metrics"]).values()))
         return {
             "success": True,
             "data": images,
@@ -258,21 +361,31 @@ async def get_enhanced_images(patient_id: Optional[str] = None, limit: int = 100
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/images/enhance")
-async def enhance_image(request: ImageEnhanceRequest):
+def generate_image_analysis(patient_id: str, patient_name: str, image_type: str,
+                            features: Optional[Dict] = None) -> str:
     """
-    Enhance medical image using Groq AI (Primary) + AWS Bedrock (Backup)
+    Generate the AI enhancement report using Groq (Primary) + AWS Bedrock (Backup)
+    features is the image_features summary the enhancement pass computed, so the
+    report describes the actual study without decoding it again
     """
-    try:
-        # Call Groq Cloud API for AI enhancement analysis (REAL GenAI)
-        prompt = f"""As an expert medical AI radiologist, analyze this {request.image_type} medical image and provide detailed enhancement recommendations.
+    measured = ""
+    if features:
+        measured = f"""
+Measured image features (computed from the pixels during enhancement):
+{describe_features(features)}
 
-Patient: {request.patient_name} (ID: {request.patient_id})
-Image Type: {request.image_type}
+Base the quality assessment and the adjustments on these measurements.
+"""
+    
+    # Call Groq Cloud API for AI enhancement analysis (REAL GenAI)
+    prompt = f"""As an expert medical AI radiologist, analyze this {image_type} medical image and provide detailed enhancement recommendations.
 
+Patient: {patient_name} (ID: {patient_id})
+Image Type: {image_type}
+{measured}
 Provide a professional medical image enhancement report including:
 1. **Image Quality Assessment** (score 0-100)
-2. **Key Areas Needing Enhancement** (be specific to {request.image_type})
+2. **Key Areas Needing Enhancement** (be specific to {image_type})
 3. **Recommended Technical Adjustments**:
    - Contrast adjustment (%)
    - Brightness/Exposure (%)
@@ -283,59 +396,518 @@ Provide a professional medical image enhancement report including:
 
 Format as a clear, professional radiology report. Be concise but thorough."""
 
-        system_prompt = "You are an expert medical imaging AI assistant specializing in radiology and diagnostic image enhancement. Provide technical, accurate medical insights."
+    system_prompt = "You are an expert medical imaging AI assistant specializing in radiology and diagnostic image enhancement. Provide technical, accurate medical insights."
+    
+    ai_analysis = call_groq_api(prompt, system_prompt)
+    
+    # Fallback to Bedrock if Groq fails
+    if not ai_analysis and BEDROCK_AVAILABLE:
+        try:
+            body = json.dumps({
+                "inputText": prompt,
+                "textGenerationConfig": {
+                    "maxTokenCount": 1000,
+                    "temperature": 0.4,
+                    "topP": 0.9
+                }
+            })
+            
+            response = bedrock_runtime.invoke_model(
+                modelId='amazon.titan-text-express-v1',
+                body=body
+            )
+            
+            response_body = json.loads(response['body'].read())
+            ai_analysis = response_body.get('results', [{}])[0].get('outputText', '')
+            print(f"✅ Bedrock AI (Backup) used")
+        except Exception as be:
+            print(f"⚠️ Bedrock also failed: {be}")
+    
+    if not ai_analysis:
+        ai_analysis = f"AI Enhancement Analysis for {image_type}:\n\nImage Quality: 85/100\nRecommendations: Standard medical image enhancement applied with optimized contrast and sharpness for diagnostic clarity."
+        if features:
+            ai_analysis += f"\n\nMeasured image features:\n{describe_features(features)}"
+    
+    return ai_analysis
+
+
+def get_image_pool() -> ProcessPoolExecutor:
+    """Process pool for CPU-bound pixel work, sized by data_processing.num_workers"""
+    global image_pool
+    if image_pool is None:
+        image_pool = ProcessPoolExecutor(max_workers=NUM_WORKERS, initializer=configure_pipelines,
+                                         initargs=(PIPELINES, STAGE_DEFAULTS, QUALITY_GATE))
+    return image_pool
+
+
+@app.on_event("shutdown")
+def shutdown_image_pool():
+    """Stop enhancement worker processes with the server"""
+    if image_pool is not None:
+        image_pool.shutdown(cancel_futures=True)
+
+
+def enhancement_options(image_type: str, output_mode: Optional[str], window: Optional[str],
+                        metrics_mode: Optional[str], encoding: Optional[str] = None):
+    """
+    Validate request options: (output_mode, window list, metrics mode, encoding);
+    400 on bad values
+    """
+    output_mode = "RGB" if (output_mode or "").upper() == "RGB" else None
+    try:
+        return (
+            output_mode,
+            parse_windows(window),
+            normalize_metrics_mode(metrics_mode or METRICS_MODE),
+            resolve_encoding(encoding, image_type, ENCODING_DEFAULTS)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def enhanced_image_filename(image_type: str, encoding: Dict, suffix: str = "") -> str:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    extension = OUTPUT_FORMATS[encoding["format"]][1]
+    return f"enhanced_{image_type.lower().replace(' ', '_')}_{timestamp}{suffix}{extension}"
+
+
+async def run_enhancement(fn, source_args: tuple, image_type: str, enhanced_filename: str,
+                          original_filename: str, options: tuple) -> Dict:
+    """
+    Run an engine entry point (enhance_image_to_file_cached) in a pool worker:
+    fn(*source_args, image_type, output path, output_mode, windows, tiling,
+    metrics_mode, encoding, previews, result cache). Engine errors are mapped to HTTP errors
+    """
+    output_mode, windows, metrics_mode, encoding = options
+    # CPU-bound PIL work runs outside the event loop and the server's GIL
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            get_image_pool(),
+            fn,
+            *source_args,
+            image_type,
+            str(ENHANCED_IMAGES_DIR / enhanced_filename),
+            output_mode,
+            windows,
+            TILING,
+            metrics_mode,
+            encoding,
+            PREVIEWS,
+            RESULT_CACHE
+        )
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=415, detail=f"Unsupported image format: {original_filename}")
+    except UnsupportedDicomError as e:
+        raise HTTPException(status_code=415, detail=f"Unsupported DICOM file {original_filename}: {e}")
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+def preview_urls(image_id: int, metrics: Optional[Dict]) -> Dict[str, str]:
+    """Download URL per stored preview size, smallest first, then the full image"""
+    sizes = sorted(int(size) for size in (metrics or {}).get("previews", {}))
+    urls = {str(size): f"/api/images/{image_id}/enhanced?size={size}" for size in sizes}
+    urls["full"] = f"/api/images/{image_id}/enhanced"
+    return urls
+
+
+def store_enhanced_image(patient_id: str, patient_name: str, image_type: str,
+                         original_filename: str, enhanced_filename: str,
+                         metrics: Dict, ai_analysis: str) -> Dict:
+    """Record an enhanced image in the database; returns the response data"""
+    metrics.update({
+        "enhancement_type": f"{image_type} modality pipeline + Groq AI",
+        "ai_analysis": ai_analysis,
+        "ai_model": "Groq Llama 3.1 70B"
+    })
+    
+    image_id = db.add_enhanced_image(
+        patient_id=patient_id,
+        patient_name=patient_name,
+        original_filename=original_filename,
+        enhanced_filename=enhanced_filename,
+        image_type=image_type,
+        metrics=metrics
+    )
+    
+    return {
+        "image_id": image_id,
+        "original_filename": original_filename,
+        "enhanced_filename": enhanced_filename,
+        "enhanced_url": f"/api/images/{image_id}/enhanced",
+        "preview_urls": preview_urls(image_id, metrics),
+        "metrics": metrics,
+        "ai_powered": True,
+        "ai_provider": "Groq Cloud API"
+    }
+
+
+async def process_and_store_image(source, patient_id: str, patient_name: str,
+                                  image_type: str, original_filename: Optional[str] = None,
+                                  output_mode: Optional[str] = None,
+                                  window: Optional[str] = None,
+                                  metrics_mode: Optional[str] = None,
+                                  encoding: Optional[str] = None) -> Dict:
+    """
+    Run the modality pipeline on the image in a worker process, save the enhanced
+    image and record it in the database. source is raw bytes or a file path.
+    Grayscale studies stay single-channel unless output_mode is "RGB".
+    DICOM input renders each requested window preset from a single decode.
+    metrics_mode selects fast (sampled) or full-resolution PSNR/SSIM.
+    encoding picks the output format (PNG level/strategy, lossless WebP, JPEG).
+    """
+    options = enhancement_options(image_type, output_mode, window, metrics_mode, encoding)
+    enhanced_filename = enhanced_image_filename(image_type, options[3])
+    original_filename = original_filename or \
+        "original_" + os.path.splitext(enhanced_filename)[0][len("enhanced_"):]
+    
+    metrics = await run_enhancement(enhance_image_to_file_cached, (source,), image_type,
+                                    enhanced_filename, original_filename, options)
+    
+    ai_analysis = await run_in_threadpool(generate_image_analysis, patient_id, patient_name, image_type,
+                                          metrics.get("features"))
+    
+    return {
+        "success": True,
+        "data": store_enhanced_image(patient_id, patient_name, image_type, original_filename,
+                                     enhanced_filename, metrics, ai_analysis),
+        "message": "Image enhanced successfully with Groq AI"
+    }
+
+
+@app.post("/api/images/enhance")
+async def enhance_image(request: ImageEnhanceRequest):
+    """
+    Enhance medical image with the modality pipeline + Groq AI (Primary) / AWS Bedrock (Backup)
+    The base64 is decoded in chunks straight into a temporary file whose path goes
+    to the worker process, so neither the decoded bytes nor an ASCII copy of the
+    string is held in memory or pickled.
+    """
+    if not IMAGE_ENGINE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Image enhancement engine not available")
+    if not request.image_data:
+        raise HTTPException(status_code=400, detail="image_data is required")
+    
+    spool_path = None
+    try:
+        # Accept both raw base64 and data URLs (data:image/png;base64,...)
+        with tempfile.NamedTemporaryFile(delete=False) as spool:
+            spool_path = spool.name
+            try:
+                await run_in_threadpool(decode_base64_to, request.image_data, spool,
+                                        data_start(request.image_data))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="image_data is not valid base64")
         
-        ai_analysis = call_groq_api(prompt, system_prompt)
+        return await process_and_store_image(
+            spool_path,
+            request.patient_id,
+            request.patient_name,
+            request.image_type,
+            output_mode=request.output_mode,
+            window=request.window,
+            metrics_mode=request.metrics_mode,
+            encoding=request.encoding
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if spool_path:
+            os.unlink(spool_path)
+
+
+@app.post("/api/images/upload")
+async def upload_and_enhance_image(
+    patient_id: str = Form(...),
+    patient_name: str = Form(...),
+    image_type: str = Form(...),
+    file: UploadFile = File(...),
+    output_mode: Optional[str] = Form(None),
+    window: Optional[str] = Form(None),
+    metrics_mode: Optional[str] = Form(None),
+    encoding: Optional[str] = Form(None)
+):
+    """
+    Enhance a medical image sent as multipart/form-data.
+    The upload is copied in chunks to a temporary file whose path is handed to
+    the worker process, avoiding the base64 inflation and decode copies of
+    /api/images/enhance.
+    """
+    if not IMAGE_ENGINE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Image enhancement engine not available")
+    
+    spool_path = None
+    try:
+        suffix = Path(file.filename or "").suffix
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as spool:
+            spool_path = spool.name
+            await run_in_threadpool(shutil.copyfileobj, file.file, spool, UPLOAD_CHUNK_SIZE)
         
-        # Fallback to Bedrock if Groq fails
-        if not ai_analysis and BEDROCK_AVAILABLE:
-            try:
-                body = json.dumps({
-                    "inputText": prompt,
-                    "textGenerationConfig": {
-                        "maxTokenCount": 1000,
-                        "temperature": 0.4,
-                        "topP": 0.9
-                    }
-                })
-                
-                response = bedrock_runtime.invoke_model(
-                    modelId='amazon.titan-text-express-v1',
-                    body=body
-                )
-                
-                response_body = json.loads(response['body'].read())
-                ai_analysis = response_body.get('results', [{}])[0].get('outputText', '')
-                print(f"✅ Bedrock AI (Backup) used")
-            except Exception as be:
-                print(f"⚠️ Bedrock also failed: {be}")
+        result = await process_and_store_image(
+            spool_path,
+            patient_id,
+            patient_name,
+            image_type,
+            original_filename=file.filename,
+            output_mode=output_mode,
+            window=window,
+            metrics_mode=metrics_mode,
+            encoding=encoding
+        )
+        result["data"]["metrics"]["upload_bytes"] = file.size
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await file.close()
+        if spool_path:
+            os.unlink(spool_path)
+
+
+@app.post("/api/images/batch")
+async def enhance_image_batch(
+    patient_id: str = Form(...),
+    patient_name: str = Form(...),
+    image_type: str = Form(...),
+    files: List[UploadFile] = File(...),
+    output_mode: Optional[str] = Form(None),
+    window: Optional[str] = Form(None),
+    metrics_mode: Optional[str] = Form(None),
+    encoding: Optional[str] = Form(None)
+):
+    """
+    Enhance up to data_processing.batch_size images of one study in a single request.
+    Each upload is copied to a file in shared memory (/dev/shm) that a pool worker
+    opens by path, so decoding, enhancement and PNG encoding all run in the
+    workers and no image data is pickled. Results stream back as NDJSON, one line
+    per image in the order they finish, followed by a summary line. If the stream
+    ends early (the client disconnects), unfinished images are cancelled and
+    their spool files removed.
+    """
+    if not IMAGE_ENGINE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Image enhancement engine not available")
+    if len(files) > BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_SIZE} images per batch")
+    options = enhancement_options(image_type, output_mode, window, metrics_mode, encoding)
+    
+    spool_paths = []
+    try:
+        for file in files:
+            suffix = Path(file.filename or "").suffix
+            spool_paths.append(await run_in_threadpool(spool_to_shared_memory, file.file, suffix))
+    except BaseException:
+        for path in spool_paths:
+            os.unlink(path)
+        raise
+    finally:
+        for file in files:
+            await file.close()
+    
+    started = datetime.now()
+    # Spool files not yet removed. A task cancelled before it starts never reaches
+    # enhance_one's finally, so stream_results removes whatever is left here
+    unreleased = set(spool_paths)
+    
+    def release(spool_path: str):
+        if spool_path in unreleased:
+            unreleased.discard(spool_path)
+            os.unlink(spool_path)
+    
+    async def enhance_one(index: int, filename: str, spool_path: str) -> Dict:
+        enhanced_filename = enhanced_image_filename(image_type, options[3], f"_{index}")
+        try:
+            metrics = await run_enhancement(enhance_image_to_file_cached, (spool_path,), image_type,
+                                            enhanced_filename, filename, options)
+        except HTTPException as e:
+            return {"index": index, "filename": filename, "success": False,
+                    "status_code": e.status_code, "error": e.detail}
+        except Exception as e:
+            return {"index": index, "filename": filename, "success": False,
+                    "status_code": 500, "error": str(e)}
+        finally:
+            release(spool_path)
         
-        if not ai_analysis:
-            ai_analysis = f"AI Enhancement Analysis for {request.image_type}:\n\nImage Quality: 85/100\nRecommendations: Standard medical image enhancement applied with optimized contrast and sharpness for diagnostic clarity."
+        # Each image gets its own report, written from that image's features
+        ai_analysis = await run_in_threadpool(generate_image_analysis, patient_id, patient_name, image_type,
+                                              metrics.get("features"))
+        data = store_enhanced_image(patient_id, patient_name, image_type, filename, enhanced_filename,
+                                    metrics, ai_analysis)
+        return {"index": index, "filename": filename, "success": True, "data": data}
+    
+    tasks = [
+        asyncio.ensure_future(enhance_one(index, file.filename or f"image_{index}", path))
+        for index, (file, path) in enumerate(zip(files, spool_paths))
+    ]
+    
+    async def stream_results():
+        succeeded = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                succeeded += result["success"]
+                yield json.dumps(result, default=str) + "\n"
+        finally:
+            # The client went away or the stream was cancelled: stop the remaining
+            # images and remove their spool files
+            for task in tasks:
+                task.cancel()
+            for path in list(unreleased):
+                release(path)
+        elapsed = (datetime.now() - started).total_seconds()
+        yield json.dumps({
+            "done": True,
+            "images": len(tasks),
+            "succeeded": succeeded,
+            "processing_time": round(elapsed, 3),
+            "images_per_second": round(len(tasks) / elapsed, 2) if elapsed else None
+        }) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+@app.post("/api/volumes/upload")
+async def upload_and_enhance_volume(
+    patient_id: str = Form(...),
+    patient_name: str = Form(...),
+    image_type: str = Form(...),
+    file: UploadFile = File(...),
+    window: Optional[str] = Form(None)
+):
+    """
+    Enhance a NIfTI volume (.nii or .nii.gz) slice by slice.
+    Uncompressed volumes are memory-mapped by the workers and .nii.gz is
+    decompressed as a stream; enhanced slices are written to the output volume
+    as they finish, so memory stays bounded by a few slices per worker.
+    """
+    if not IMAGE_ENGINE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Image enhancement engine not available")
+    
+    filename = file.filename or ""
+    suffix = ".nii.gz" if filename.endswith(".nii.gz") else Path(filename).suffix
+    if suffix not in (".nii", ".nii.gz"):
+        raise HTTPException(status_code=415, detail="Volumes must be .nii or .nii.gz")
+    try:
+        windows = parse_windows(window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    enhanced_filename = f"enhanced_{image_type.lower().replace(' ', '_')}_{timestamp}{suffix}"
+    spool_path = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as spool:
+            spool_path = spool.name
+            await run_in_threadpool(shutil.copyfileobj, file.file, spool, UPLOAD_CHUNK_SIZE)
+        
+        # The volume pipeline fans its slice chunks out to the shared process pool
+        metrics = await run_in_threadpool(
+            enhance_volume,
+            spool_path,
+            str(ENHANCED_IMAGES_DIR / enhanced_filename),
+            image_type,
+            windows,
+            NUM_WORKERS,
+            executor=get_image_pool()
+        )
+        metrics["upload_bytes"] = file.size
+        metrics["enhancement_type"] = f"{image_type} modality pipeline (volume)"
+        
+        image_id = db.add_enhanced_image(
+            patient_id=patient_id,
+            patient_name=patient_name,
+            original_filename=filename,
+            enhanced_filename=enhanced_filename,
+            image_type=image_type,
+            metrics=metrics
+        )
         
-        # Simulate enhancement metrics with AI-powered values
-        metrics = {
-            "psnr": 32.8,
-            "ssim": 0.94,
-            "quality_score": 95,
-            "enhancement_type": "Groq AI + Bedrock Enhanced",
-            "processing_time": 1.8,
-            "ai_analysis": ai_analysis,
-            "ai_model": "Groq Llama 3.1 70B" if ai_analysis else "Fallback"
+        return {
+            "success": True,
+            "data": {
+                "image_id": image_id,
+                "original_filename": filename,
+                "enhanced_filename": enhanced_filename,
+                "enhanced_url": f"/api/images/{image_id}/enhanced",
+                "metrics": metrics
+            },
+            "message": f"Volume enhanced ({metrics['slices']} slices)"
         }
+    except UnsupportedVolumeError as e:
+        raise HTTPException(status_code=415, detail=f"Unsupported volume {filename}: {e}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await file.close()
+        if spool_path:
+            os.unlink(spool_path)
+
+
+@app.post("/api/cine/upload")
+async def upload_and_enhance_clip(
+    patient_id: str = Form(...),
+    patient_name: str = Form(...),
+    image_type: str = Form(...),
+    file: UploadFile = File(...),
+    window: Optional[str] = Form(None),
+    output: Optional[str] = Form(None)
+):
+    """
+    Enhance a cine loop or multi-frame image (multi-frame DICOM, multi-page TIFF,
+    animated GIF/PNG/WebP) frame by frame on the worker pool.
+    Tone LUTs and noise estimates are computed once per clip from sample frames,
+    so frames do not flicker. output: "tiff" (multi-page TIFF) or "frames" (ZIP
+    of encoded frames); defaults to image_enhancement.cine.output.
+    """
+    if not IMAGE_ENGINE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Image enhancement engine not available")
+    
+    filename = file.filename or ""
+    output = (output or CINE.get("output", "tiff")).lower()
+    if output not in ("tiff", "frames"):
+        raise HTTPException(status_code=400, detail="output must be 'tiff' or 'frames'")
+    try:
+        windows = parse_windows(window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    suffix = ".zip" if output == "frames" else ".tif"
+    enhanced_filename = f"enhanced_{image_type.lower().replace(' ', '_')}_{timestamp}{suffix}"
+    spool_path = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix=Path(filename).suffix, delete=False) as spool:
+            spool_path = spool.name
+            await run_in_threadpool(shutil.copyfileobj, file.file, spool, UPLOAD_CHUNK_SIZE)
         
-        # Generate filenames
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        original_filename = f"original_{request.image_type.lower()}_{timestamp}.dcm"
-        enhanced_filename = f"enhanced_{request.image_type.lower()}_{timestamp}.png"
+        # Frame chunks fan out to the shared process pool; DICOM and TIFF workers read their own frames
+        metrics = await run_in_threadpool(
+            enhance_clip,
+            spool_path,
+            str(ENHANCED_IMAGES_DIR / enhanced_filename),
+            image_type,
+            windows,
+            NUM_WORKERS,
+            CINE.get("chunk_frames", 4),
+            get_image_pool(),
+            CINE.get("frame_encoding", "png:1"),
+            CINE.get("sample_frames", 8)
+        )
+        metrics["upload_bytes"] = file.size
+        metrics["enhancement_type"] = f"{image_type} modality pipeline (cine)"
         
-        # Store in database
         image_id = db.add_enhanced_image(
-            patient_id=request.patient_id,
-            patient_name=request.patient_name,
-            original_filename=original_filename,
+            patient_id=patient_id,
+            patient_name=patient_name,
+            original_filename=filename,
             enhanced_filename=enhanced_filename,
-            image_type=request.image_type,
+            image_type=image_type,
             metrics=metrics
         )
         
@@ -343,16 +915,58 @@ Format as a clear, professional radiology report. Be concise but thorough."""
             "success": True,
             "data": {
                 "image_id": image_id,
-                "original_filename": original_filename,
+                "original_filename": filename,
                 "enhanced_filename": enhanced_filename,
-                "metrics": metrics,
-                "ai_powered": True,
-                "ai_provider": "Groq Cloud API"
+                "enhanced_url": f"/api/images/{image_id}/enhanced",
+                "metrics": metrics
             },
-            "message": "Image enhanced successfully with Groq AI"
+            "message": f"Clip enhanced ({metrics['frames']} frames)"
         }
+    except (UnsupportedClipError, UnsupportedDicomError) as e:
+        raise HTTPException(status_code=415, detail=f"Unsupported clip {filename}: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await file.close()
+        if spool_path:
+            os.unlink(spool_path)
+
+
+@app.get("/api/images/{image_id}/enhanced")
+async def get_enhanced_image_file(image_id: int, window: Optional[str] = None, size: Optional[int] = None):
+    """
+    Download the stored enhanced image, another DICOM window preset of it, or
+    with size the smallest stored preview at least that large (else the full image)
+    """
+    image = db.get_enhanced_image(image_id)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    filename = image["enhanced_filename"]
+    if window:
+        windows = (image["enhancement_metrics"] or {}).get("windows", {})
+        if window not in windows:
+            raise HTTPException(status_code=404, detail=f"No '{window}' window stored for this image")
+        filename = windows[window]
+    elif size:
+        previews = (image["enhancement_metrics"] or {}).get("previews", {})
+        fitting = sorted(int(level) for level in previews if int(level) >= size)
+        if fitting:
+            filename = previews[str(fitting[0])]
+    
+    path = ENHANCED_IMAGES_DIR / filename
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Enhanced image file not stored on this server")
+    
+    # Stored files stay downloadable when the engine (and its media type tables) cannot be imported
+    suffix = Path(filename).suffix
+    media_type = (MEDIA_TYPES.get(suffix) or CLIP_MEDIA_TYPES.get(suffix)) if IMAGE_ENGINE_AVAILABLE else None
+    media_type = media_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=filename)
 
 
 @app.get("/api/images/stats")
@@ -619,6 +1233,124 @@ async def get_icd10_stats():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# =============== Export APIs ===============
+
+EXPORT_CHUNK_SIZE = 64 * 1024  # Bytes buffered before each write to the client
+
+
+def generate_ndjson_export(rows, compress: bool = False):
+    """Encode rows as NDJSON, yielding ~64 KB chunks (optionally gzip-compressed)"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    buffered = 0
+    
+    for row in rows:
+        line = json.dumps(row, default=str) + "\n"
+        buffer.append(line)
+        buffered += len(line)
+        
+        if buffered >= EXPORT_CHUNK_SIZE:
+            chunk = "".join(buffer).encode("utf-8")
+            buffer.clear()
+            buffered = 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+    
+    chunk = "".join(buffer).encode("utf-8")
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+@app.get("/api/export/{table}")
+async def export_table(
+    table: str,
+    patient_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    gzip: bool = False,
+    batch_size: int = 1000
+):
+    """
+    Stream a full table as NDJSON for analytics pulls.
+    Filter by patient and created_at range (since inclusive, until exclusive).
+    """
+    if table not in EXPORT_TABLES:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown export table. Available: {', '.join(EXPORT_TABLES)}"
+        )
+    try:
+        # ISO input such as 2024-05-01T10:00 must compare with the stored "YYYY-MM-DD HH:MM:SS"
+        since, until = [normalize_timestamp(bound) if bound else None for bound in (since, until)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since and until must be ISO 8601 dates or datetimes")
+    
+    rows = db.iter_export_rows(
+        table,
+        patient_id=patient_id,
+        since=since,
+        until=until,
+        batch_size=max(1, min(batch_size, 10000))
+    )
+    
+    filename = f"{table}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson"
+    media_type = "application/x-ndjson"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    
+    return StreamingResponse(
+        generate_ndjson_export(rows, compress=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+# =============== Bulk Import APIs ===============
+
+@app.post("/api/import/{kind}")
+async def bulk_import(
+    kind: str,
+    file: UploadFile = File(...),
+    format: Optional[str] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE
+):
+    """
+    Bulk import patients or clinical notes from a CSV or NDJSON upload.
+    Returns counts plus a per-row error report (invalid rows and duplicates).
+    """
+    if kind not in IMPORT_KINDS:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown import kind. Available: {', '.join(IMPORT_KINDS)}"
+        )
+    if format and format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    
+    try:
+        fmt = format or detect_format(file.filename, file.content_type)
+        report = await run_in_threadpool(
+            import_stream, db, kind, file.file, fmt, max(1, min(batch_size, 50000))
+        )
+        return {
+            "success": True,
+            "data": report,
+            "message": f"Imported {report['inserted']} of {report['total_rows']} rows"
+        }
+    except (UnicodeDecodeError, csv.Error, ValueError) as e:
+        # Undecodable or malformed files are the client's; batches before the bad row stay committed
+        raise HTTPException(status_code=400, detail=f"Invalid {kind} upload: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await file.close()
+
+
 # =============== Run Server ===============
 
 if __name__ == "__main__":
@@ -633,6 +1365,7 @@ if __name__ == "__main__":
     print("🤖 AI Models:")
     print(f"   ✅ Groq Cloud API: {GROQ_MODEL}")
     print(f"   {'✅' if BEDROCK_AVAILABLE else '⚠️'} AWS Bedrock: {'Active' if BEDROCK_AVAILABLE else 'Fallback only'}")
+    print(f"🖼️ Image Engine: {'✅ ' + str(NUM_WORKERS) + ' worker processes' if IMAGE_ENGINE_AVAILABLE else '⚠️ Unavailable'}")
     print("=" * 70)
     
     uvicorn.run(
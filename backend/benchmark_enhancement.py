@@ -0,0 +1,616 @@
+"""
+Benchmarks for the medical image enhancement engine
+Run from the backend directory:
+
+    python benchmark_enhancement.py lut --size 2048
+    python benchmark_enhancement.py grayscale --size 2048
+    python benchmark_enhancement.py tiled --size 8192 --max-memory-mb 512
+    python benchmark_enhancement.py clahe --size 2048
+    python benchmark_enhancement.py batch --images 16 --size 1024
+    python benchmark_enhancement.py encode --size 2048
+    python benchmark_enhancement.py denoise --size 2048 --sigma 8
+    python benchmark_enhancement.py upscale --size 2048
+    python benchmark_enhancement.py speckle --frames 64 --width 800 --height 600
+    python benchmark_enhancement.py gate --size 2048
+    python benchmark_enhancement.py base64 --megabytes 20
+
+Each case runs in a fresh worker process so peak RSS growth can be attributed to it
+"""
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / "lambda_package"))
+
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+
+from base64_stream import decode_base64, encode_base64
+from batch_processing import spool_to_shared_memory
+from clahe import clahe
+from denoise import PRESETS as DENOISE_PRESETS, denoise, estimate_noise
+from encoders import encode_image
+from enhancement_engine import apply_modality_enhancement, enhance_image_to_file, get_peak_rss_mb
+from pipelines import configure_pipelines
+from point_ops import apply_point_ops
+from speckle import METHODS as SPECKLE_METHODS, reduce_speckle
+from super_resolution import METHODS as UPSCALE_METHODS, upscale
+
+MODALITIES = ['XRAY', 'CT', 'MRI', 'ULTRASOUND', 'DXA', 'OTHER']
+
+
+def synthetic_image(size, mode='RGB', seed=0, noise=0.04):
+    """Smooth anatomy-like gradients plus noise, so histograms are realistic"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    body = 0.5 + 0.3 * np.sin(6 * x) * np.cos(4 * y) - 0.2 * ((x - 0.5) ** 2 + (y - 0.5) ** 2)
+    body += rng.normal(0, noise, body.shape)
+    gray = np.clip(body * 200 + 20, 0, 255).astype(np.uint8)
+    if mode == 'I;16':
+        return Image.fromarray(gray.astype(np.uint16) * 257)
+    img = Image.fromarray(gray, 'L')
+    return img.convert(mode) if mode != 'L' else img
+
+
+def legacy_modality_enhancement(img, modality):
+    """Reference: the original step-by-step PIL chain (one full image per step)"""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    modality = modality.upper()
+    if modality in ('XRAY', 'X-RAY'):
+        img = ImageOps.autocontrast(img, cutoff=2)
+        img = ImageOps.invert(img)
+        img = ImageEnhance.Contrast(img).enhance(1.5)
+        img = ImageEnhance.Sharpness(img).enhance(2.0)
+        img = img.filter(ImageFilter.SHARPEN)
+    elif modality in ('CT', 'CT SCAN'):
+        img = ImageOps.grayscale(img).convert('RGB')
+        img = ImageOps.autocontrast(img, cutoff=1)
+        img = ImageEnhance.Contrast(img).enhance(1.4)
+        img = img.filter(ImageFilter.EDGE_ENHANCE_MORE)
+        img = ImageEnhance.Brightness(img).enhance(1.1)
+    elif modality == 'MRI':
+        img = ImageOps.autocontrast(img, cutoff=3)
+        img = ImageEnhance.Contrast(img).enhance(1.6)
+        img = img.filter(ImageFilter.MedianFilter(size=3))
+        img = ImageEnhance.Brightness(img).enhance(1.15)
+        img = ImageEnhance.Sharpness(img).enhance(1.5)
+    elif modality == 'ULTRASOUND':
+        img = img.filter(ImageFilter.MedianFilter(size=5))
+        img = ImageOps.autocontrast(img, cutoff=2)
+        img = ImageEnhance.Contrast(img).enhance(1.3)
+        img = ImageEnhance.Sharpness(img).enhance(1.4)
+    elif modality == 'DXA':
+        img = ImageOps.grayscale(img).convert('RGB')
+        img = ImageOps.autocontrast(img, cutoff=1)
+        img = ImageEnhance.Contrast(img).enhance(1.7)
+        img = img.filter(ImageFilter.SHARPEN)
+        img = ImageEnhance.Sharpness(img).enhance(2.2)
+    else:
+        img = ImageOps.autocontrast(img, cutoff=2)
+        img = ImageEnhance.Contrast(img).enhance(1.3)
+        img = ImageEnhance.Sharpness(img).enhance(1.5)
+    return img
+
+
+def legacy_tone_chain(img):
+    """Reference: a full tone chain as separate PIL operations"""
+    img = ImageOps.autocontrast(img, cutoff=2)
+    img = ImageOps.invert(img)
+    img = ImageEnhance.Contrast(img).enhance(1.5)
+    return ImageEnhance.Brightness(img).enhance(1.1)
+
+
+def fused_tone_chain(img):
+    """The same tone chain as one fused LUT"""
+    return apply_point_ops(img, [
+        ('autocontrast', 2), ('invert', None), ('contrast', 1.5), ('brightness', 1.1)
+    ])
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter (Linux only) so setup cost is not counted"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def current_peak_rss_mb():
+    """Peak RSS since the last reset (VmHWM), falling back to the lifetime peak"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return get_peak_rss_mb()
+
+
+def current_rss_mb():
+    """Current RSS (VmRSS), or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _timed_case(fn_name, size, modality, repeat, mode, options=None):
+    """Worker body: build the input, run the case, report time and RSS growth"""
+    fn = globals()[fn_name]
+    img = synthetic_image(size, mode)
+    img.load()
+    reset_peak_rss()
+    rss_before = current_rss_mb() or get_peak_rss_mb()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(img, modality, **(options or {})) if modality else fn(img)
+        timings.append(time.perf_counter() - started)
+        del result
+    rss_after = current_peak_rss_mb()
+    growth = rss_after - rss_before if rss_after is not None else float('nan')
+    return min(timings), growth
+
+
+def run_case(fn_name, size, modality=None, repeat=3, mode='RGB', options=None):
+    """Run one benchmark case in a fresh process"""
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(_timed_case, fn_name, size, modality, repeat, mode, options).result()
+
+
+def bench_lut(args):
+    """Fused LUT tone mapping vs the step-by-step PIL chain"""
+    size = args.size
+    print(f"Tone mapping, {size}x{size} RGB (autocontrast + invert + contrast + brightness)")
+    legacy_time, legacy_rss = run_case('legacy_tone_chain', size)
+    fused_time, fused_rss = run_case('fused_tone_chain', size)
+    print(f"  step-by-step: {legacy_time * 1000:8.1f} ms  peak RSS +{legacy_rss:6.1f} MB")
+    print(f"  fused LUT:    {fused_time * 1000:8.1f} ms  peak RSS +{fused_rss:6.1f} MB")
+    print(f"  speedup {legacy_time / fused_time:.1f}x")
+
+    print(f"\nFull modality pipelines, {size}x{size} RGB")
+    img = synthetic_image(size)
+    for modality in MODALITIES:
+        legacy_time, _ = run_case('legacy_modality_enhancement', size, modality)
+        fused_time, _ = run_case('apply_modality_enhancement_image', size, modality)
+        fused_img = apply_modality_enhancement_image(img, modality)
+        # Grayscale input now stays single-channel; compare in the engine's output mode
+        reference = np.asarray(legacy_modality_enhancement(img, modality).convert(fused_img.mode), dtype=np.int16)
+        fused = np.asarray(fused_img, dtype=np.int16)
+        diff = np.abs(reference - fused)
+        print(f"  {modality:<10} legacy {legacy_time * 1000:7.1f} ms  fused {fused_time * 1000:7.1f} ms  "
+              f"max diff {diff.max():3d}  mean diff {diff.mean():.3f}")
+
+
+def apply_modality_enhancement_image(img, modality):
+    """Engine entry point returning only the image"""
+    return apply_modality_enhancement(img, modality)[0]
+
+
+def bench_grayscale(args):
+    """Single-channel X-ray input: legacy RGB conversion vs native 8-bit and 16-bit paths"""
+    size = args.size
+    megapixels = size * size / 1e6
+    print(f"Grayscale input, {size}x{size} ({megapixels:.1f} MP) - time, throughput, peak RSS growth")
+    print(f"  {'modality':<10} {'legacy RGB':>28} {'native L':>28} {'native 16-bit':>28}")
+    for modality in MODALITIES:
+        cells = []
+        for fn_name, mode in [
+            ('legacy_modality_enhancement', 'L'),
+            ('apply_modality_enhancement_image', 'L'),
+            ('apply_modality_enhancement_image', 'I;16'),
+        ]:
+            seconds, rss = run_case(fn_name, size, modality, repeat=args.repeat, mode=mode)
+            cells.append(f"{seconds * 1000:7.0f} ms {megapixels / seconds:5.1f} MP/s +{rss:5.0f} MB")
+        print(f"  {modality:<10} " + " ".join(f"{cell:>28}" for cell in cells))
+
+
+def whole_image_enhancement(img, modality):
+    """Engine with tiling disabled: every step materializes a full-size image"""
+    return apply_modality_enhancement(img, modality, tiling={'enabled': False})[0]
+
+
+def tiled_enhancement(img, modality, **tiling):
+    """Engine forced onto the tiled path with the given tiling options"""
+    return apply_modality_enhancement(img, modality, tiling=dict(tiling, enabled=True))[0]
+
+
+def bench_tiled(args):
+    """Whole-image vs tiled execution on a large grayscale image"""
+    size = args.size
+    megapixels = size * size / 1e6
+    tiling = {'max_memory_mb': args.max_memory_mb, 'workers': args.workers}
+    print(f"Large image, {size}x{size} L ({megapixels:.0f} MP), tiled cap {args.max_memory_mb} MB")
+    print(f"  {'modality':<10} {'whole image':>28} {'tiled':>28}")
+    for modality in MODALITIES:
+        cells = []
+        for fn_name, options in [('whole_image_enhancement', None), ('tiled_enhancement', tiling)]:
+            seconds, rss = run_case(fn_name, size, modality, repeat=args.repeat, mode='L', options=options)
+            cells.append(f"{seconds * 1000:7.0f} ms {megapixels / seconds:5.1f} MP/s +{rss:5.0f} MB")
+        print(f"  {modality:<10} " + " ".join(f"{cell:>28}" for cell in cells))
+
+    img = synthetic_image(min(size, 2048), 'L')
+    for modality in MODALITIES:
+        whole = np.asarray(whole_image_enhancement(img, modality))
+        tiled = np.asarray(tiled_enhancement(img, modality, tile_size=300))
+        assert np.array_equal(whole, tiled), f"{modality}: tiled output differs from whole-image output"
+    print("  tiled output identical to whole-image output for all modalities")
+
+
+def best_time(fn, repeat):
+    """(fastest wall time, last result) over repeat runs"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def bench_clahe(args):
+    """Vectorized, thread-parallel CLAHE vs skimage.exposure.equalize_adapthist"""
+    from skimage.exposure import equalize_adapthist
+
+    size = args.size
+    megapixels = size * size / 1e6
+    grid = (args.grid, args.grid)
+    print(f"CLAHE, {size}x{size} ({megapixels:.1f} MP), {args.grid}x{args.grid} tiles, clip limit {args.clip_limit}")
+    for mode in ('L', 'I;16'):
+        array = np.asarray(synthetic_image(size, mode))
+        max_value = np.iinfo(array.dtype).max
+        nbins = 256 if array.dtype == np.uint8 else 4096
+        kernel_size = (size // args.grid, size // args.grid)
+
+        def reference():
+            equalized = equalize_adapthist(array, kernel_size=kernel_size, clip_limit=args.clip_limit, nbins=nbins)
+            return (equalized * max_value + 0.5).astype(array.dtype)
+
+        skimage_time, expected = best_time(reference, args.repeat)
+        print(f"  {array.dtype.name:<7} skimage          {skimage_time * 1000:8.1f} ms  {megapixels / skimage_time:6.1f} MP/s")
+        for workers in sorted({1, args.workers}):
+            seconds, result = best_time(
+                lambda: clahe(array, grid, args.clip_limit, nbins, workers=workers), args.repeat)
+            diff = np.abs(result.astype(np.float64) - expected) / max_value * 255
+            print(f"  {array.dtype.name:<7} clahe {workers:2d} thread{'s' if workers > 1 else ' '} "
+                  f"{seconds * 1000:8.1f} ms  {megapixels / seconds:6.1f} MP/s  speedup {skimage_time / seconds:5.1f}x  "
+                  f"mean diff {diff.mean():.2f}/255  corr {np.corrcoef(result.ravel(), expected.ravel())[0, 1]:.4f}")
+
+
+def bench_batch(args):
+    """Batch throughput (images/s) through a process pool, handing files over in /dev/shm"""
+    encoded = []
+    for seed in range(args.images):
+        buffer = BytesIO()
+        synthetic_image(args.size, 'L', seed=seed).save(buffer, format='PNG')
+        encoded.append(buffer.getvalue())
+    print(f"Batch of {args.images} {args.size}x{args.size} PNGs, {args.modality} (decode + enhance + encode)")
+
+    baseline = None
+    with tempfile.TemporaryDirectory() as output_dir:
+        for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+            if workers > (os.cpu_count() or 1):
+                continue
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pool.submit(time.sleep, 0).result()  # start the workers before timing
+                started = time.perf_counter()
+                spool_paths = [spool_to_shared_memory(data, '.png') for data in encoded]
+                futures = [
+                    pool.submit(enhance_image_to_file, path, args.modality,
+                                os.path.join(output_dir, f"{index}.png"), tiling={'workers': 1})
+                    for index, path in enumerate(spool_paths)
+                ]
+                for future in futures:
+                    future.result()
+                elapsed = time.perf_counter() - started
+                for path in spool_paths:
+                    os.unlink(path)
+            throughput = args.images / elapsed
+            baseline = baseline or throughput
+            print(f"  {workers:2d} workers: {throughput:6.2f} images/s  scaling {throughput / baseline:4.2f}x")
+
+
+# webp:100 (method 6) is omitted: tens of seconds per 4 MP image for ~1% smaller files
+ENCODINGS = ['png:9', 'png', 'png:3', 'png:1', 'png:1:rle', 'png:1:huffman', 'png:0', 'webp:75', 'webp:50',
+             'webp:0', 'jpeg:95', 'jpeg:85']
+
+
+def bench_encode(args):
+    """Encode time vs size for each output encoding, on enhanced images"""
+    megapixels = args.size * args.size / 1e6
+    for mode, modality in (('RGB', 'OTHER'), ('L', args.modality), ('I;16', args.modality)):
+        enhanced = apply_modality_enhancement(synthetic_image(args.size, mode), modality,
+                                              output_mode=mode if mode == 'RGB' else None)[0]
+        raw_bytes = len(enhanced.tobytes())
+        print(f"\n{args.size}x{args.size} {enhanced.mode} ({raw_bytes / 1e6:.1f} MB raw), {modality}")
+        print(f"  {'encoding':<14} {'time':>9} {'MP/s':>7} {'size':>9} {'ratio':>6}")
+        for encoding in ENCODINGS:
+            seconds, (data, _) = best_time(lambda: encode_image(enhanced, encoding), args.repeat)
+            print(f"  {encoding:<14} {seconds * 1000:6.0f} ms {megapixels / seconds:7.1f} "
+                  f"{len(data) / 1e6:6.2f} MB {raw_bytes / len(data):5.1f}x")
+
+
+def psnr(reference, result, max_value):
+    mse = np.mean((reference.astype(np.float64) - result) ** 2)
+    return 10 * np.log10(max_value ** 2 / mse) if mse else float('inf')
+
+
+def bench_denoise(args):
+    """ms per megapixel and PSNR gain for each denoising method and preset"""
+    megapixels = args.size * args.size / 1e6
+    rng = np.random.default_rng(1)
+    for mode in ('L', 'I;16'):
+        clean = np.asarray(synthetic_image(args.size, mode, noise=0))
+        max_value = np.iinfo(clean.dtype).max
+        noise = rng.normal(0, args.sigma * (max_value / 255), clean.shape)
+        noisy = np.clip(clean + noise, 0, max_value).astype(clean.dtype)
+
+        seconds, sigma = best_time(lambda: estimate_noise(noisy), args.repeat)
+        print(f"\n{args.size}x{args.size} {clean.dtype.name}, added noise sigma {args.sigma}/255, "
+              f"PSNR {psnr(clean, noisy, max_value):.2f} dB")
+        print(f"  noise estimate {sigma * 255 / max_value:.2f}/255 in {seconds * 1000 / megapixels:.1f} ms/MP")
+        for method, presets in DENOISE_PRESETS.items():
+            for preset in presets:
+                seconds, (result, _) = best_time(
+                    lambda: denoise(noisy, method, preset, noise_threshold=0, workers=args.workers), args.repeat)
+                print(f"  {method:<9} {preset:<8} {seconds * 1000 / megapixels:8.1f} ms/MP  "
+                      f"PSNR {psnr(clean, result, max_value):6.2f} dB")
+
+
+def bench_upscale(args):
+    """
+    2x super-resolution time and PSNR: a detailed image is area-downsampled to
+    size x size and upscaled back, against PIL's bicubic and Lanczos resize
+    """
+    from skimage import data
+
+    reference = synthetic_image(2 * args.size, 'L', noise=0)
+    # Sharp-edged detail: tiled test photographs over the smooth background
+    detail = np.asarray(reference).astype(np.float32)
+    for sample in (data.camera(), data.text(), data.coins()):
+        tiles = np.tile(sample, (2 * args.size // sample.shape[0] + 1, 2 * args.size // sample.shape[1] + 1))
+        detail = 0.6 * detail + 0.4 * tiles[:2 * args.size, :2 * args.size]
+    reference = detail.astype(np.uint8)
+    small = reference.reshape(args.size, 2, args.size, 2).mean(axis=(1, 3))
+    small = np.clip(small + 0.5, 0, 255).astype(np.uint8)
+    margin = 16  # Border handling differs between methods
+    inner = (slice(margin, -margin), slice(margin, -margin))
+    output_megapixels = 4 * args.size * args.size / 1e6
+
+    print(f"{args.size}x{args.size} -> {2 * args.size}x{2 * args.size}, uint8")
+    cases = [(f"PIL {name}", lambda f=resample: np.asarray(Image.fromarray(small).resize(
+                 (2 * args.size, 2 * args.size), f)))
+             for name, resample in (('bicubic', Image.BICUBIC), ('lanczos', Image.LANCZOS))]
+    for method in UPSCALE_METHODS:
+        for sharpen in (0.0, 0.5):
+            cases.append((f"{method} sharpen {sharpen}", lambda m=method, s=sharpen: upscale(
+                small, 2, m, s, workers=args.workers)[0]))
+    for name, fn in cases:
+        seconds, result = best_time(fn, args.repeat)
+        print(f"  {name:<26} {seconds * 1000 / output_megapixels:7.1f} ms/output MP  "
+              f"PSNR {psnr(reference[inner], result[inner], 255):6.2f} dB")
+
+
+def speckle_frames(count, width, height, looks=4, seed=0):
+    """
+    (reflectivity, frames): a drifting phantom of smooth tissue with a bright and
+    a dark lesion, times gamma-distributed speckle (unit mean, Cu = 1 / sqrt(looks))
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    truths, frames = [], []
+    for index in range(count):
+        shift = 2 * index
+        truth = 80 + 60 * np.sin((x + shift) / 60) * np.cos(y / 45)
+        truth[(x - width / 2 - shift) ** 2 + (y - height / 2) ** 2 < (height / 8) ** 2] = 200
+        truth[(x - width / 4) ** 2 + (y - height / 4 - shift) ** 2 < (height / 20) ** 2] = 20
+        speckled = truth * rng.gamma(looks, 1 / looks, truth.shape)
+        truths.append(truth)
+        frames.append(np.clip(speckled, 0, 255).astype(np.uint8))
+    return truths, frames
+
+
+def bench_speckle(args):
+    """
+    Speckle reduction on a cine loop: the legacy ultrasound branch (RGB
+    MedianFilter 5 chain) vs the engine's pipeline, then the filters alone
+    """
+    truths, frames = speckle_frames(args.frames, args.width, args.height, args.looks)
+    rgb_frames = [Image.fromarray(frame).convert('RGB') for frame in frames]
+    gray_frames = [Image.fromarray(frame) for frame in frames]
+    print(f"Cine loop of {args.frames} {args.width}x{args.height} frames, speckle Cu {1 / np.sqrt(args.looks):.2f}, "
+          f"PSNR of the frames {np.mean([psnr(t, f, 255) for t, f in zip(truths, frames)]):.2f} dB")
+
+    def per_loop(fn, inputs):
+        return best_time(lambda: [fn(frame) for frame in inputs], args.repeat)
+
+    seconds, _ = per_loop(lambda img: legacy_modality_enhancement(img, 'ULTRASOUND'), rgb_frames)
+    print(f"  {'legacy ULTRASOUND (RGB)':<28} {args.frames / seconds:7.1f} frames/s")
+    seconds, _ = per_loop(lambda img: apply_modality_enhancement(img, 'ULTRASOUND', metrics_mode='off')[0],
+                          rgb_frames)
+    print(f"  {'engine ULTRASOUND':<28} {args.frames / seconds:7.1f} frames/s")
+
+    print("  filter only (PSNR against the speckle-free phantom):")
+    cases = [
+        ('MedianFilter 5 (RGB)', rgb_frames,
+         lambda img: np.asarray(img.filter(ImageFilter.MedianFilter(size=5)))[..., 0]),
+        ('MedianFilter 5 (L)', gray_frames, lambda img: np.asarray(img.filter(ImageFilter.MedianFilter(size=5)))),
+    ]
+    for method in SPECKLE_METHODS:
+        for window in (5, 7, 11):
+            cases.append((f"{method} {window}x{window}", frames,
+                          lambda frame, m=method, w=window: reduce_speckle(frame, m, w)[0]))
+    for name, inputs, fn in cases:
+        seconds, results = per_loop(fn, inputs)
+        quality = np.mean([psnr(t, r, 255) for t, r in zip(truths, results)])
+        print(f"    {name:<26} {args.frames / seconds:7.1f} frames/s  PSNR {quality:6.2f} dB")
+
+
+def bench_gate(args):
+    """
+    Pipeline time with and without the quality gate on well exposed, flat,
+    blurred and noisy versions of a detailed image, with the gate's decisions
+    """
+    from skimage import data
+
+    rng = np.random.default_rng(2)
+    detail = np.tile(data.camera(), (args.size // 512 + 1, args.size // 512 + 1))[:args.size, :args.size]
+    images = {
+        'well exposed': Image.fromarray(detail),
+        'flat': Image.fromarray((detail * 0.25 + 90).astype(np.uint8)),
+        'blurred': Image.fromarray(detail).filter(ImageFilter.GaussianBlur(2)),
+        'noisy': Image.fromarray(np.clip(detail + rng.normal(0, 12, detail.shape), 0, 255).astype(np.uint8)),
+    }
+    print(f"{args.size}x{args.size} uint8, metrics off")
+    for modality in args.modalities.split(','):
+        print(f"  {modality}")
+        for name, img in images.items():
+            configure_pipelines(gate=None)
+            full, _ = best_time(lambda: apply_modality_enhancement(img, modality, metrics_mode='off'), args.repeat)
+            configure_pipelines(gate={'enabled': True})
+            gated, (_, metrics) = best_time(
+                lambda: apply_modality_enhancement(img, modality, metrics_mode='off'), args.repeat)
+            decision = metrics['quality_gate']
+            changes = ', '.join([f"-{stage}" for stage in decision['dropped']] +
+                                [f"+{stage}" for stage in decision['strengthened']])
+            print(f"    {name:<13} full {full * 1000:7.1f} ms  gated {gated * 1000:7.1f} ms "
+                  f"(gate {decision['time'] * 1000:4.1f} ms)  {decision['decision']:<18} {changes}")
+
+
+def traced(fn):
+    """(traced peak MB, wall time) of one call"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 / 1024, elapsed
+
+
+def bench_base64(args):
+    """
+    Peak memory of the base64 decode and encode around an incompressible image of
+    the given size: stdlib one-shot calls vs base64_stream. The decode peak leaves
+    out the request string; the encode peak includes the encoder's BytesIO
+    """
+    data = np.random.default_rng(0).integers(0, 256, args.megabytes * 1024 * 1024, dtype=np.uint8).tobytes()
+    text = base64.b64encode(data).decode('ascii')
+
+    def encoder_output():
+        buffered = BytesIO()
+        for position in range(0, len(data), 1 << 16):  # Grows as an encoder writing chunks does
+            buffered.write(data[position:position + (1 << 16)])
+        return buffered
+
+    def stdlib_encode():
+        buffered = encoder_output()
+        encoded = buffered.getvalue()
+        buffered.close()
+        return base64.b64encode(encoded).decode('utf-8')
+
+    cases = [
+        ('decode  b64decode', lambda: base64.b64decode(text)),
+        ('decode  stream (cold buffer)', lambda: decode_base64(text)),
+        ('decode  stream (reused buffer)', lambda: decode_base64(text)),
+        ('encode  b64encode(getvalue())', stdlib_encode),
+        ('encode  stream from BytesIO', lambda: encode_base64(encoder_output())),
+    ]
+    print(f"{args.megabytes} MB image, {len(text) / 1024 / 1024:.1f} MB base64")
+    for name, fn in cases:
+        peak, elapsed = traced(fn)
+        print(f"  {name:<32} peak {peak:7.1f} MB  {elapsed * 1000:7.1f} ms")
+    assert bytes(decode_base64(text)) == data and encode_base64(data) == text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image enhancement benchmarks")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    lut = subparsers.add_parser('lut', help="Fused point operations vs the PIL chain")
+    lut.add_argument('--size', type=int, default=2048)
+    lut.set_defaults(func=bench_lut)
+
+    gray = subparsers.add_parser('grayscale', help="Native grayscale / 16-bit vs RGB conversion")
+    gray.add_argument('--size', type=int, default=2048)
+    gray.add_argument('--repeat', type=int, default=2)
+    gray.set_defaults(func=bench_grayscale)
+
+    tiled = subparsers.add_parser('tiled', help="Tiled execution with a memory cap vs whole image")
+    tiled.add_argument('--size', type=int, default=8192)
+    tiled.add_argument('--repeat', type=int, default=1)
+    tiled.add_argument('--max-memory-mb', type=int, default=512)
+    tiled.add_argument('--workers', type=int, default=None)
+    tiled.set_defaults(func=bench_tiled)
+
+    clahe_parser = subparsers.add_parser('clahe', help="CLAHE vs skimage.exposure.equalize_adapthist")
+    clahe_parser.add_argument('--size', type=int, default=2048)
+    clahe_parser.add_argument('--repeat', type=int, default=3)
+    clahe_parser.add_argument('--grid', type=int, default=8)
+    clahe_parser.add_argument('--clip-limit', type=float, default=0.01)
+    clahe_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    clahe_parser.set_defaults(func=bench_clahe)
+
+    batch = subparsers.add_parser('batch', help="Batch throughput vs worker count")
+    batch.add_argument('--images', type=int, default=16)
+    batch.add_argument('--size', type=int, default=1024)
+    batch.add_argument('--modality', default='XRAY')
+    batch.set_defaults(func=bench_batch)
+
+    encode = subparsers.add_parser('encode', help="Output encoders: encode time vs bytes")
+    encode.add_argument('--size', type=int, default=2048)
+    encode.add_argument('--repeat', type=int, default=2)
+    encode.add_argument('--modality', default='XRAY')
+    encode.set_defaults(func=bench_encode)
+
+    denoise_parser = subparsers.add_parser('denoise', help="Denoising methods: ms per megapixel and PSNR")
+    denoise_parser.add_argument('--size', type=int, default=2048)
+    denoise_parser.add_argument('--repeat', type=int, default=2)
+    denoise_parser.add_argument('--sigma', type=float, default=8.0, help="Added Gaussian noise, in 8-bit levels")
+    denoise_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    denoise_parser.set_defaults(func=bench_denoise)
+
+    upscale_parser = subparsers.add_parser('upscale', help="2x super-resolution: time and PSNR vs PIL resize")
+    upscale_parser.add_argument('--size', type=int, default=2048)
+    upscale_parser.add_argument('--repeat', type=int, default=2)
+    upscale_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    upscale_parser.set_defaults(func=bench_upscale)
+
+    speckle_parser = subparsers.add_parser('speckle', help="Ultrasound speckle filters on a cine loop vs MedianFilter 5")
+    speckle_parser.add_argument('--frames', type=int, default=64)
+    speckle_parser.add_argument('--width', type=int, default=800)
+    speckle_parser.add_argument('--height', type=int, default=600)
+    speckle_parser.add_argument('--looks', type=float, default=4.0, help="Speckle looks (Cu = 1 / sqrt(looks))")
+    speckle_parser.add_argument('--repeat', type=int, default=1)
+    speckle_parser.set_defaults(func=bench_speckle)
+
+    gate_parser = subparsers.add_parser('gate', help="Pipelines with and without the no-reference quality gate")
+    gate_parser.add_argument('--size', type=int, default=2048)
+    gate_parser.add_argument('--repeat', type=int, default=2)
+    gate_parser.add_argument('--modalities', default='XRAY,CT,MRI,ULTRASOUND')
+    gate_parser.set_defaults(func=bench_gate)
+
+    base64_parser = subparsers.add_parser('base64', help="Peak memory of base64 decode/encode: stdlib vs streaming")
+    base64_parser.add_argument('--megabytes', type=int, default=20)
+    base64_parser.set_defaults(func=bench_base64)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
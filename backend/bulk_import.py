@@ -0,0 +1,229 @@
+"""
+Bulk import of patients and clinical notes for clinic onboarding
+Streams CSV or NDJSON rows, validates them one at a time and inserts
+them with executemany in sized transactions
+"""
+import argparse
+import csv
+import io
+import json
+import time
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from database import Database, normalize_timestamp
+
+IMPORT_KINDS = ('patients', 'notes')
+DEFAULT_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000  # Keep the per-row report bounded on very dirty files
+
+PATIENT_FIELDS = ('patient_id', 'name', 'age', 'gender')
+NOTE_TEXT_FIELDS = ('subjective', 'objective', 'assessment', 'plan')
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str] = None) -> str:
+    """Guess csv or ndjson from the file name or content type"""
+    name = (filename or '').lower()
+    if name.endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    if name.endswith('.csv'):
+        return 'csv'
+    if content_type and 'json' in content_type:
+        return 'ndjson'
+    return 'csv'
+
+
+def read_rows(stream, fmt: str) -> Iterator[Tuple[int, object]]:
+    """
+    Yield (row_number, row) pairs from a text stream without loading the file.
+    Malformed NDJSON lines are yielded as the exception so they land in the report.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row_number, row in enumerate(reader, start=1):
+            yield row_number, row
+    elif fmt == 'ndjson':
+        for row_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield row_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, ValueError(f"Invalid JSON: {e.msg}")
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+
+def _required(row: Dict, field: str) -> str:
+    value = row.get(field)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        raise ValueError(f"Missing required field '{field}'")
+    return str(value).strip()
+
+
+def validate_patient_row(row: Dict) -> Tuple:
+    """Validate a patient row, returning the (patient_id, name, age, gender) record"""
+    patient_id = _required(row, 'patient_id')
+    name = _required(row, 'name')
+    try:
+        age = int(_required(row, 'age'))
+    except ValueError:
+        raise ValueError(f"Invalid age '{row.get('age')}'")
+    if not 0 <= age <= 150:
+        raise ValueError(f"Age out of range: {age}")
+    gender = _required(row, 'gender')
+    return (patient_id, name, age, gender)
+
+
+def validate_note_row(row: Dict) -> Tuple:
+    """Validate a clinical note row, returning the bulk_add_clinical_notes record"""
+    patient_id = _required(row, 'patient_id')
+    patient_name = _required(row, 'patient_name')
+    note_type = _required(row, 'note_type')
+    sections = [str(row.get(field) or '').strip() for field in NOTE_TEXT_FIELDS]
+
+    full_note = str(row.get('full_note') or '').strip()
+    if not full_note:
+        if not any(sections):
+            raise ValueError("Note has no content")
+        full_note = "\n\n".join(
+            f"{field.upper()}:\n{text}"
+            for field, text in zip(NOTE_TEXT_FIELDS, sections) if text
+        )
+
+    icd10_codes = row.get('icd10_codes') or None
+    if isinstance(icd10_codes, str):
+        # CSV columns carry codes as "I10;E11" or as a JSON array
+        icd10_codes = icd10_codes.strip()
+        if icd10_codes.startswith('['):
+            try:
+                icd10_codes = json.loads(icd10_codes)
+            except json.JSONDecodeError:
+                raise ValueError("Invalid icd10_codes JSON")
+        else:
+            icd10_codes = [code.strip() for code in icd10_codes.split(';') if code.strip()]
+
+    created_at = str(row.get('created_at') or '').strip() or None
+    if created_at:
+        try:
+            created_at = normalize_timestamp(created_at)
+        except ValueError:
+            raise ValueError(f"Invalid created_at '{created_at}'")
+
+    return (
+        patient_id, patient_name, note_type, *sections, full_note,
+        json.dumps(icd10_codes) if icd10_codes else None,
+        created_at
+    )
+
+
+def import_rows(db: Database, kind: str, rows: Iterator[Tuple[int, object]],
+                batch_size: int = DEFAULT_BATCH_SIZE) -> Dict:
+    """
+    Validate and insert streamed rows, committing every batch_size rows.
+    Returns a report with counts and per-row errors.
+    """
+    if kind not in IMPORT_KINDS:
+        raise ValueError(f"Unknown import kind '{kind}'")
+
+    validate = validate_patient_row if kind == 'patients' else validate_note_row
+    report = {
+        'kind': kind,
+        'total_rows': 0,
+        'inserted': 0,
+        'duplicates': 0,
+        'failed': 0,
+        'errors': []
+    }
+
+    def add_error(row_number, message):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'row': row_number, 'error': message})
+
+    def flush(batch_rows, batch):
+        if not batch:
+            return
+        if kind == 'patients':
+            duplicates = db.bulk_add_patients(batch)
+            for index in duplicates:
+                report['duplicates'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({
+                        'row': batch_rows[index],
+                        'error': f"Patient already exists: {batch[index][0]}"
+                    })
+            report['inserted'] += len(batch) - len(duplicates)
+        else:
+            report['inserted'] += db.bulk_add_clinical_notes(batch)
+
+    started = time.perf_counter()
+    batch_rows, batch = [], []
+
+    for row_number, row in rows:
+        report['total_rows'] += 1
+        if isinstance(row, Exception):
+            add_error(row_number, str(row))
+            continue
+        if not isinstance(row, dict):
+            add_error(row_number, "Row must be an object")
+            continue
+        try:
+            record = validate(row)
+        except ValueError as e:
+            add_error(row_number, str(e))
+            continue
+
+        batch_rows.append(row_number)
+        batch.append(record)
+        if len(batch) >= batch_size:
+            flush(batch_rows, batch)
+            batch_rows, batch = [], []
+
+    flush(batch_rows, batch)
+    report['errors'].sort(key=lambda error: error['row'])
+
+    elapsed = time.perf_counter() - started
+    report['elapsed_seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round(report['total_rows'] / elapsed) if elapsed > 0 else None
+    report['errors_truncated'] = report['failed'] + report['duplicates'] > len(report['errors'])
+    return report
+
+
+def import_stream(db: Database, kind: str, binary_stream, fmt: str,
+                  batch_size: int = DEFAULT_BATCH_SIZE) -> Dict:
+    """Import from a binary file object such as an UploadFile's spooled file"""
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    try:
+        return import_rows(db, kind, read_rows(text_stream, fmt), batch_size)
+    finally:
+        # Leave the underlying file open for its owner
+        text_stream.detach()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import patients or clinical notes")
+    parser.add_argument('kind', choices=IMPORT_KINDS)
+    parser.add_argument('file', type=Path, help="CSV or NDJSON file")
+    parser.add_argument('--format', choices=('csv', 'ndjson'), help="Override format detection")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--db', help="Database path (defaults to ehr_data.db)")
+    args = parser.parse_args()
+
+    db = Database(args.db) if args.db else Database()
+    fmt = args.format or detect_format(args.file.name)
+
+    with open(args.file, 'rb') as f:
+        report = import_stream(db, args.kind, f, fmt, args.batch_size)
+
+    print(f"✅ Imported {report['inserted']} of {report['total_rows']} {args.kind} rows "
+          f"in {report['elapsed_seconds']}s ({report['rows_per_second']} rows/s)")
+    if report['duplicates'] or report['failed']:
+        print(f"⚠️ {report['duplicates']} duplicates, {report['failed']} invalid rows")
+        for error in report['errors'][:20]:
+            print(f"   row {error['row']}: {error['error']}")
+
+
+if __name__ == "__main__":
+    main()
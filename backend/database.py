@@ -3,14 +3,30 @@ Database models and connection for EHR AI System
 Uses SQLite for simplicity, easily upgradable to PostgreSQL
 """
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
 import json
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator, Tuple
 
 # Database path
 DB_PATH = Path(__file__).parent / "ehr_data.db"
 
+# Tables that can be streamed out by the export API, with their JSON columns
+EXPORT_TABLES = {
+    'clinical_notes': ['icd10_codes'],
+    'enhanced_images': ['enhancement_metrics'],
+    'icd10_suggestions': [],
+}
+
+
+
+def normalize_timestamp(value: str) -> str:
+    """ISO 8601 date or datetime as the 'YYYY-MM-DD HH:MM:SS' (UTC) text CURRENT_TIMESTAMP stores"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
 
 class Database:
     """Database handler for EHR system"""
@@ -19,9 +35,9 @@ class Database:
         self.db_path = db_path
         self.init_database()
     
-    def get_connection(self):
+    def get_connection(self, check_same_thread: bool = True):
         """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, check_same_thread=check_same_thread)
         conn.row_factory = sqlite3.Row
         return conn
     
@@ -253,6 +269,23 @@ class Database:
         conn.close()
         return images
     
+    def get_enhanced_image(self, image_id: int) -> Optional[Dict]:
+        """Get a single enhanced image record"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM enhanced_images WHERE id = ?', (image_id,))
+        row = cursor.fetchone()
+        conn.close()
+
+        if not row:
+            return None
+
+        image = dict(row)
+        if image['enhancement_metrics']:
+            image['enhancement_metrics'] = json.loads(image['enhancement_metrics'])
+        return image
+
     def get_image_stats(self) -> Dict:
         """Get image enhancement statistics"""
         conn = self.get_connection()
@@ -304,6 +337,42 @@ class Database:
         conn.close()
         return note_id
     
+    def bulk_add_clinical_notes(self, records: List[Tuple]) -> int:
+        """
+        Insert clinical note records in a single transaction.
+        Each record is (patient_id, patient_name, note_type, subjective, objective,
+        assessment, plan, full_note, icd10_codes_json, created_at); created_at
+        is 'YYYY-MM-DD HH:MM:SS' text, and None falls back to the current time.
+        """
+        conn = self.get_connection()
+        conn.execute('PRAGMA synchronous = NORMAL')
+        cursor = conn.cursor()
+        
+        cursor.executemany('''
+            INSERT INTO clinical_notes (
+                patient_id, patient_name, note_type, subjective,
+                objective, assessment, plan, full_note, icd10_codes, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        ''', records)
+        
+        # Update patient stats once per patient rather than once per note:
+        # last_visit moves to the newest imported note (None stands for now)
+        counts, latest = {}, {}
+        for record in records:
+            pid, created_at = record[0], record[-1]
+            counts[pid] = counts.get(pid, 0) + 1
+            if pid not in latest or latest[pid] is not None and (created_at is None or created_at > latest[pid]):
+                latest[pid] = created_at
+        cursor.executemany('''
+            UPDATE patients SET total_notes = total_notes + ?,
+                last_visit = MAX(COALESCE(last_visit, ''), COALESCE(?, CURRENT_TIMESTAMP))
+            WHERE patient_id = ?
+        ''', [(count, latest[pid], pid) for pid, count in counts.items()])
+        
+        conn.commit()
+        conn.close()
+        return len(records)
+
     def get_clinical_notes(self, patient_id: Optional[str] = None,
                           note_type: Optional[str] = None,
                           limit: int = 100) -> List[Dict]:
@@ -441,6 +510,60 @@ class Database:
             conn.close()
             return None
     
+    def bulk_add_patients(self, records: List[Tuple]) -> List[int]:
+        """
+        Insert (patient_id, name, age, gender) records in a single transaction.
+        Returns the indexes of records skipped as duplicates, matching add_patient's
+        IntegrityError handling.
+        """
+        conn = self.get_connection()
+        conn.execute('PRAGMA synchronous = NORMAL')
+        cursor = conn.cursor()
+        
+        # Existing IDs, looked up in chunks below SQLite's bound-variable limit
+        ids = [record[0] for record in records]
+        existing = set()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(
+                f'SELECT patient_id FROM patients WHERE patient_id IN ({placeholders})',
+                chunk
+            )
+            existing.update(row['patient_id'] for row in cursor.fetchall())
+        
+        duplicates = []
+        pending = []
+        for index, record in enumerate(records):
+            if record[0] in existing:
+                duplicates.append(index)
+            else:
+                existing.add(record[0])
+                pending.append((index, record))
+        
+        try:
+            cursor.executemany('''
+                INSERT INTO patients (patient_id, name, age, gender)
+                VALUES (?, ?, ?, ?)
+            ''', [record for _, record in pending])
+            conn.commit()
+        except sqlite3.IntegrityError:
+            # A concurrent writer added some of these IDs - retry row by row
+            conn.rollback()
+            for index, record in pending:
+                try:
+                    cursor.execute('''
+                        INSERT INTO patients (patient_id, name, age, gender)
+                        VALUES (?, ?, ?, ?)
+                    ''', record)
+                except sqlite3.IntegrityError:
+                    duplicates.append(index)
+            conn.commit()
+            duplicates.sort()
+        
+        conn.close()
+        return duplicates
+
     def get_patients(self, status: str = 'active') -> List[Dict]:
         """Get patients"""
         conn = self.get_connection()
@@ -482,6 +605,56 @@ class Database:
             'total_notes': totals['total_notes'] or 0
         }
     
+    # =============== Export Methods ===============
+    
+    def iter_export_rows(self, table: str, patient_id: Optional[str] = None,
+                         since: Optional[str] = None, until: Optional[str] = None,
+                         batch_size: int = 1000) -> Iterator[Dict]:
+        """
+        Stream rows of an exportable table in id order.
+        Rows are pulled with fetchmany so memory stays flat regardless of table size.
+        since/until are compared as text, so pass them through normalize_timestamp.
+        """
+        if table not in EXPORT_TABLES:
+            raise ValueError(f"Table '{table}' cannot be exported")
+        
+        query = f'SELECT * FROM {table} WHERE 1=1'
+        params = []
+        
+        if patient_id:
+            query += ' AND patient_id = ?'
+            params.append(patient_id)
+        
+        if since:
+            query += ' AND created_at >= ?'
+            params.append(since)
+        
+        if until:
+            query += ' AND created_at < ?'
+            params.append(until)
+        
+        query += ' ORDER BY id'
+        
+        # StreamingResponse may resume the generator on a different worker thread
+        conn = self.get_connection(check_same_thread=False)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            json_columns = EXPORT_TABLES[table]
+            
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    record = dict(row)
+                    for column in json_columns:
+                        if record[column]:
+                            record[column] = json.loads(record[column])
+                    yield record
+        finally:
+            conn.close()
+    
     # =============== Dashboard Methods ===============
     
     def get_dashboard_stats(self) -> Dict:
@@ -1,290 +0,0 @@
-"""
-AWS Lambda Function: Medical Image Enhancement
-Uses Amazon Bedrock Titan (FREE GenAI) + Real Image Processing
-"""
-import json
-import base64
-import boto3
-import os
-from io import BytesIO
-
-try:
-    from PIL import Image, ImageEnhance, ImageFilter, ImageOps
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
-    print("⚠️ PIL not available - using base64 passthrough")
-
-# Initialize AWS clients
-bedrock_runtime = boto3.client('bedrock-runtime', region_name='us-east-1')
-s3_client = boto3.client('s3')
-
-def enhance_image_by_modality(image_base64, modality):
-    """
-    Apply real image enhancement based on medical imaging modality
-    Different modalities require different processing techniques
-    """
-    if not PIL_AVAILABLE:
-        return image_base64, {
-            'psnr': 30.0,
-            'ssim': 0.85,
-            'contrast_improvement': 20,
-            'sharpness_improvement': 30
-        }
-    
-    try:
-        # Decode base64 image
-        image_data = base64.b64decode(image_base64)
-        img = Image.open(BytesIO(image_data))
-        
-        # Convert to RGB if needed
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Apply modality-specific enhancements
-        if modality.upper() == 'XRAY' or modality.upper() == 'X-RAY':
-            # X-Ray: High contrast, inverted (bones white), sharpened
-            img = ImageOps.autocontrast(img, cutoff=2)
-            img = ImageOps.invert(img)  # Invert for medical X-ray appearance
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.5)  # 50% more contrast
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(2.0)  # Double sharpness
-            img = img.filter(ImageFilter.SHARPEN)
-            metrics = {
-                'psnr': 35.2,
-                'ssim': 0.92,
-                'contrast_improvement': 50,
-                'sharpness_improvement': 100
-            }
-            
-        elif modality.upper() == 'CT' or modality.upper() == 'CT SCAN':
-            # CT Scan: Moderate contrast, grayscale optimized, edge enhancement
-            img = ImageOps.grayscale(img).convert('RGB')
-            img = ImageOps.autocontrast(img, cutoff=1)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.4)
-            img = img.filter(ImageFilter.EDGE_ENHANCE_MORE)
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(1.1)
-            metrics = {
-                'psnr': 36.8,
-                'ssim': 0.90,
-                'contrast_improvement': 40,
-                'sharpness_improvement': 60
-            }
-            
-        elif modality.upper() == 'MRI':
-            # MRI: Enhanced contrast, reduced noise, brightness adjusted
-            img = ImageOps.autocontrast(img, cutoff=3)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.6)
-            img = img.filter(ImageFilter.MedianFilter(size=3))  # Noise reduction
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(1.15)
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(1.5)
-            metrics = {
-                'psnr': 38.5,
-                'ssim': 0.94,
-                'contrast_improvement': 60,
-                'sharpness_improvement': 50
-            }
-            
-        elif modality.upper() == 'ULTRASOUND':
-            # Ultrasound: Speckle noise reduction, contrast enhancement
-            img = img.filter(ImageFilter.MedianFilter(size=5))
-            img = ImageOps.autocontrast(img, cutoff=2)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.3)
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(1.4)
-            metrics = {
-                'psnr': 33.5,
-                'ssim': 0.88,
-                'contrast_improvement': 30,
-                'sharpness_improvement': 40
-            }
-            
-        elif modality.upper() == 'DXA':
-            # DXA (Bone Density): High contrast, grayscale, sharpened
-            img = ImageOps.grayscale(img).convert('RGB')
-            img = ImageOps.autocontrast(img, cutoff=1)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.7)
-            img = img.filter(ImageFilter.SHARPEN)
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(2.2)
-            metrics = {
-                'psnr': 34.0,
-                'ssim': 0.91,
-                'contrast_improvement': 70,
-                'sharpness_improvement': 120
-            }
-            
-        else:
-            # Default: General medical image enhancement
-            img = ImageOps.autocontrast(img, cutoff=2)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.3)
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(1.5)
-            metrics = {
-                'psnr': 32.5,
-                'ssim': 0.88,
-                'contrast_improvement': 30,
-                'sharpness_improvement': 50
-            }
-        
-        # Convert back to base64
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        enhanced_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        
-        return enhanced_base64, metrics
-        
-    except Exception as e:
-        print(f"Image processing error: {str(e)}")
-        # Return original image if enhancement fails
-        return image_base64, {
-            'psnr': 30.0,
-            'ssim': 0.85,
-            'contrast_improvement': 0,
-            'sharpness_improvement': 0
-        }
-
-def enhance_with_bedrock_genai(modality='xray'):
-    """
-    Use Amazon Titan Text Express (FREE GenAI) for image enhancement analysis
-    This is the REAL GenAI component - generates intelligent recommendations
-    """
-    try:
-        model_id = os.environ.get('BEDROCK_MODEL_ID', 'amazon.titan-text-express-v1')
-        
-        # GenAI prompt for medical image analysis
-        prompt = f"""As an expert medical AI radiologist, provide a detailed enhancement analysis for a {modality} medical image.
-
-Generate enhancement recommendations including:
-
-1. **Image Quality Assessment** (score 0-100)
-2. **Key Areas Needing Enhancement**:
-   - Bone structures visibility
-   - Soft tissue contrast
-   - Overall clarity and sharpness
-3. **Recommended Adjustments**:
-   - Contrast level (percentage increase/decrease)
-   - Brightness adjustment (percentage)
-   - Sharpening intensity (low/medium/high)
-4. **Diagnostic Improvements**: What will become more visible after enhancement
-5. **Clinical Value**: How this enhancement aids diagnosis
-
-Provide specific, actionable insights for {modality} imaging."""
-
-        request_body = {
-            "inputText": prompt,
-            "textGenerationConfig": {
-                "maxTokenCount": 1200,
-                "temperature": 0.4,
-                "topP": 0.9,
-                "stopSequences": []
-            }
-        }
-        
-        response = bedrock_runtime.invoke_model(
-            modelId=model_id,
-            body=json.dumps(request_body)
-        )
-        
-        response_body = json.loads(response['body'].read())
-        analysis = response_body['results'][0]['outputText']
-        
-        return {
-            'analysis': analysis,
-            'model': 'amazon-titan-text-express-v1 (FREE GenAI)',
-            'quality_score': 85,  # Simulated from GenAI analysis
-            'recommendations': [
-                'Increase contrast by 25% for better bone visualization',
-                'Apply moderate sharpening to enhance edge definition',
-                f'Optimize brightness for {modality} diagnostic standards'
-            ]
-        }
-        
-    except Exception as e:
-        print(f"Bedrock GenAI error: {str(e)}")
-        return {
-            'analysis': f'GenAI analysis unavailable: {str(e)}',
-            'model': 'fallback',
-            'quality_score': 70,
-            'recommendations': ['Enable Amazon Titan access in Bedrock console']
-        }
-
-def lambda_handler(event, context):
-    """
-    Main Lambda handler - Real Image Enhancement + GenAI Analysis
-    """
-    try:
-        # Parse request
-        body = json.loads(event.get('body', '{}'))
-        image_base64 = body.get('image_base64')
-        modality = body.get('image_type', body.get('modality', 'xray'))
-        use_bedrock = body.get('use_bedrock', True)
-        
-        if not image_base64:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': '*',
-                    'Access-Control-Allow-Methods': 'POST, OPTIONS'
-                },
-                'body': json.dumps({'error': 'Missing image_base64'})
-            }
-        
-        # Apply REAL image enhancement based on modality
-        enhanced_image, metrics = enhance_image_by_modality(image_base64, modality)
-        
-        # Get GenAI analysis
-        bedrock_analysis = None
-        if use_bedrock:
-            bedrock_analysis = enhance_with_bedrock_genai(modality)
-        
-        # Prepare response with REAL enhanced image + GenAI analysis
-        response_data = {
-            'enhanced_image': enhanced_image,
-            'original_image': image_base64,
-            'metrics': metrics,
-            'modality': modality.upper(),
-            'bedrock_analysis': bedrock_analysis,
-            'success': True,
-            'message': f'Image enhanced for {modality.upper()} using modality-specific algorithms + Amazon Titan AI analysis'
-        }
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS'
-            },
-            'body': json.dumps(response_data)
-        }
-        
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS'
-            },
-            'body': json.dumps({
-                'error': str(e),
-                'success': False
-            })
-        }
@@ -107,17 +107,27 @@ Generate a professional discharge summary including:
     
     return discharge_summary
 
-def generate_radiology_report(image_findings, modality, bedrock_client):
+def generate_radiology_report(image_findings, modality, bedrock_client, image_features=None):
     """
     Generate radiology report using Claude 3
+    image_features: the feature summary the enhancement Lambda returns in
+    metrics.features (exposure, noise, sharpness, field of view), for TECHNIQUE
     """
     model_id = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-3-sonnet-20240229-v1:0')
     
+    measured = ""
+    if image_features:
+        measured = f"""
+Measured Image Features (computed from the pixels during enhancement; use them for
+TECHNIQUE and image quality, not as findings):
+{json.dumps(image_features, indent=2)}
+"""
+    
     prompt = f"""Generate a professional radiology report for a {modality} study.
 
 Imaging Findings:
 {json.dumps(image_findings, indent=2)}
-
+{measured}
 Generate a structured radiology report with:
 1. CLINICAL INDICATION
 2. TECHNIQUE
@@ -192,7 +202,8 @@ def lambda_handler(event, context):
         elif note_type == 'radiology':
             image_findings = body.get('image_findings', {})
             modality = body.get('modality', 'xray')
-            note_content = generate_radiology_report(image_findings, modality, bedrock_runtime)
+            note_content = generate_radiology_report(image_findings, modality, bedrock_runtime,
+                                                     body.get('image_features'))
         
         else:
             return {
@@ -0,0 +1,71 @@
+"""
+NumPy implementations of the PIL spatial filters used by the enhancement engine
+PIL's kernel and rank filters only handle 8-bit data, so 12/16-bit radiology
+images run through these instead and keep their full bit depth
+"""
+import numpy as np
+
+# (kernel, scale) pairs matching PIL's ImageFilter built-ins
+KERNELS = {
+    'SHARPEN': ((-2, -2, -2, -2, 32, -2, -2, -2, -2), 16),
+    'EDGE_ENHANCE': ((-1, -1, -1, -1, 10, -1, -1, -1, -1), 2),
+    'EDGE_ENHANCE_MORE': ((-1, -1, -1, -1, 9, -1, -1, -1, -1), 1),
+    'SMOOTH': ((1, 1, 1, 1, 5, 1, 1, 1, 1), 13),
+}
+
+
+def max_value_for(array):
+    """Largest representable value of an integer array's dtype"""
+    return np.iinfo(array.dtype).max
+
+
+def kernel_filter(array, name):
+    """
+    Apply a 3x3 PIL kernel filter to a single-channel array
+    Like PIL, border pixels are copied from the input and results are rounded and clipped
+    """
+    kernel, scale = KERNELS[name]
+    weights = np.asarray(kernel, dtype=np.float32).reshape(3, 3) / scale
+    source = array.astype(np.float32)
+    height, width = array.shape
+
+    acc = np.zeros((height - 2, width - 2), dtype=np.float32)
+    for dy in range(3):
+        for dx in range(3):
+            weight = weights[dy, dx]
+            if weight:
+                acc += weight * source[dy:dy + height - 2, dx:dx + width - 2]
+
+    out = array.copy()
+    np.clip(acc + 0.5, 0, max_value_for(array), out=acc)
+    out[1:-1, 1:-1] = acc.astype(array.dtype)
+    return out
+
+
+def blend(degenerate, array, factor):
+    """Image.blend(degenerate, image, factor) with PIL's truncation and clipping"""
+    values = degenerate.astype(np.float32)
+    values += np.float32(factor) * (array.astype(np.float32) - values)
+    np.clip(values, 0, max_value_for(array), out=values)
+    return values.astype(array.dtype)
+
+
+def sharpness(array, factor):
+    """ImageEnhance.Sharpness: extrapolate away from the SMOOTH-filtered image"""
+    return blend(kernel_filter(array, 'SMOOTH'), array, factor)
+
+
+def median_filter(array, size):
+    """Square median filter (PIL MedianFilter equivalent, edges replicated)"""
+    try:
+        from scipy import ndimage
+        return ndimage.median_filter(array, size=size, mode='nearest')
+    except ImportError:
+        pad = size // 2
+        padded = np.pad(array, pad, mode='edge')
+        height, width = array.shape
+        windows = np.stack([
+            padded[dy:dy + height, dx:dx + width]
+            for dy in range(size) for dx in range(size)
+        ])
+        return np.median(windows, axis=0).astype(array.dtype)
@@ -0,0 +1,136 @@
+"""
+Chunked base64 decoding and encoding for large image payloads
+base64.b64decode(text) first copies the whole string to ASCII bytes and then
+decodes that copy; base64.b64encode(data).decode() holds the encoder's output,
+the base64 bytes and the final str at once. Here:
+- text is decoded CHUNK_CHARS characters at a time (binascii reads ASCII str
+  directly) into a buffer that is reused by later calls on the same thread, so
+  a warm Lambda container does not reallocate it; BufferReader reads it in
+  place, as io.BytesIO would copy anything but bytes
+- output is encoded from a memoryview of the encoder's BytesIO into one
+  preallocated bytearray, and the BytesIO is released before the final str is
+  made, so the encoded image and both base64 copies never coexist
+Whitespace (MIME line breaks) is discarded as base64.b64decode does.
+"""
+import binascii
+import io
+import re
+import threading
+
+CHUNK_CHARS = 1 << 20  # Multiple of 4: whole base64 quanta per chunk
+NON_ALPHABET = re.compile(r'[^A-Za-z0-9+/=]')
+
+_local = threading.local()
+
+
+def data_start(text):
+    """Offset of the base64 data in a data URL (data:image/png;base64,...), else 0"""
+    return text.find(',') + 1
+
+
+def iter_decoded(text, start=0):
+    """Decoded bytes of text[start:], one chunk at a time. Raises binascii.Error"""
+    carry = ''
+    for position in range(start, len(text), CHUNK_CHARS):
+        chunk = carry + text[position:position + CHUNK_CHARS]
+        if not carry:
+            try:
+                # Clean chunks (the usual case) decode without a regex pass
+                yield binascii.a2b_base64(chunk, strict_mode=True)
+                continue
+            except binascii.Error:
+                pass
+        chunk = NON_ALPHABET.sub('', chunk)
+        usable = len(chunk) - len(chunk) % 4
+        carry = chunk[usable:]
+        if usable:
+            yield binascii.a2b_base64(chunk[:usable])
+    if carry:
+        raise binascii.Error("Incorrect padding")
+
+
+def reusable_buffer(size):
+    """This thread's decode buffer, replaced (never resized) when too small"""
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        _local.buffer = None  # Let the old buffer go before allocating the new one
+        buffer = _local.buffer = bytearray(size)
+    return buffer
+
+
+def decode_base64(text, start=0):
+    """
+    Decode text[start:] into this thread's reusable buffer
+    Returns a memoryview of the decoded bytes, valid until the thread's next call
+    """
+    view = memoryview(reusable_buffer((len(text) - start) * 3 // 4 + 3))
+    written = 0
+    for decoded in iter_decoded(text, start):
+        view[written:written + len(decoded)] = decoded
+        written += len(decoded)
+    return view[:written]
+
+
+def decode_base64_to(text, fp, start=0):
+    """Decode text[start:] into a binary file object; returns the decoded size"""
+    written = 0
+    for decoded in iter_decoded(text, start):
+        fp.write(decoded)
+        written += len(decoded)
+    return written
+
+
+def encode_base64(data):
+    """
+    base64 str of a bytes-like object or of a BytesIO's contents
+    A BytesIO is read through a memoryview and closed before the str is built
+    """
+    view = data.getbuffer() if isinstance(data, io.BytesIO) else memoryview(data).cast('B')
+    encoded = bytearray(4 * ((len(view) + 2) // 3))
+    step = CHUNK_CHARS // 4 * 3
+    for position in range(0, len(view), step):
+        chunk = binascii.b2a_base64(view[position:position + step], newline=False)
+        offset = position // 3 * 4
+        encoded[offset:offset + len(chunk)] = chunk
+    view.release()
+    if isinstance(data, io.BytesIO):
+        data.close()
+    return encoded.decode('ascii')
+
+
+class BufferReader(io.RawIOBase):
+    """Seekable read-only binary file over a bytes-like object, without copying it"""
+
+    def __init__(self, data):
+        super().__init__()
+        self._view = memoryview(data).cast('B')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = max(0, min(len(buffer), len(self._view) - self._position))
+        buffer[:size] = self._view[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._view.release()
+        super().close()
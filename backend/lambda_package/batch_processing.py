@@ -0,0 +1,42 @@
+"""
+Shared-memory handoff for batch enhancement on the API server
+Each image of a batch is copied once into a file on the shared memory
+filesystem (/dev/shm, tmpfs); the pool worker opens it by path, decodes,
+enhances and writes the PNG itself, so no image bytes or pixel arrays are
+pickled through the pool's pipes - only the metrics dict travels back.
+Files rather than multiprocessing.shared_memory blocks keep the pool's workers
+out of resource-tracker bookkeeping; the pages live in RAM either way.
+AWS Lambda has no /dev/shm and cannot run multiprocessing pools; the Lambda
+processes its batches on threads instead.
+"""
+import os
+import shutil
+import tempfile
+
+SHARED_MEMORY_DIR = '/dev/shm'
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def shared_memory_dir():
+    """/dev/shm where it is writable, else the regular temporary directory"""
+    if os.path.isdir(SHARED_MEMORY_DIR) and os.access(SHARED_MEMORY_DIR, os.W_OK):
+        return SHARED_MEMORY_DIR
+    return None
+
+
+def spool_to_shared_memory(source, suffix=''):
+    """
+    Copy an upload (binary file object or bytes) into a shared memory file
+    Returns its path; the caller deletes it once the worker is done
+    """
+    with tempfile.NamedTemporaryFile(dir=shared_memory_dir(), prefix='batch_', suffix=suffix,
+                                     delete=False) as spool:
+        try:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                spool.write(source)
+            else:
+                shutil.copyfileobj(source, spool, COPY_CHUNK_SIZE)
+        except BaseException:
+            os.unlink(spool.name)
+            raise
+    return spool.name
@@ -0,0 +1,377 @@
+"""
+Cine loops and multi-frame images, enhanced frame by frame on a worker pool
+(ultrasound clips, multi-frame DICOM, multi-page TIFF, animated GIF/PNG/WebP)
+
+Frames are decoded lazily. Uncompressed DICOM pixel data is memory-mapped and
+multi-page TIFFs are opened by each worker, which seeks to its own pages, so
+only frame indexes cross the process boundary. GIF, APNG and WebP frames are
+composited onto the frames before them, so they are decoded in order by the
+caller and shipped to the pool in chunks (like .nii.gz in nifti_volume).
+
+Statistics that make frames flicker when every frame has its own are computed
+once per clip from a few evenly spaced sample frames (see clip_plan): the tone
+LUTs (autocontrast cutoffs, the contrast mean), the denoising noise sigma and
+whether to denoise at all, and the speckle coefficient. Every frame is then
+mapped through the same LUTs, and no frame pays for a histogram. A DICOM clip
+gets one window ('full' takes a streaming min/max pass over the frames).
+
+Output is a multi-page TIFF (.tif, LZW; 16-bit frames stay 16-bit) or a ZIP of
+numbered frames in an output encoding (.zip), written in order as chunks finish.
+"""
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image, TiffImagePlugin, UnidentifiedImageError
+
+import image_features
+import quality_gate
+from dicom_io import (DEFAULT_WINDOWS, WINDOW_PRESETS, apply_window, colour_frame, file_window, frame_values,
+                      is_dicom, map_dicom_frames, parse_windows, read_dicom_header, rescale)
+from encoders import encode_image, extension, parse_encoding
+from enhancement_engine import apply_modality_enhancement, get_peak_rss_mb, run_step, to_working_image
+from pipelines import get_pipeline
+from point_ops import build_tone_lut, image_histograms
+from quality_metrics import compute_quality_metrics
+
+DEFAULT_CHUNK_FRAMES = 4
+DEFAULT_SAMPLE_FRAMES = 8
+DEFAULT_FRAME_ENCODING = 'png:1'
+TIFF_COMPRESSION = 'tiff_lzw'  # Lossless and about 5x faster than Deflate; the TIFF is written serially
+
+# Output suffix -> media type
+OUTPUT_MEDIA_TYPES = {'.tif': 'image/tiff', '.tiff': 'image/tiff', '.zip': 'application/zip'}
+# Frames already run one per pool worker: their pipeline steps stay single-threaded
+FRAME_TILING = {'workers': 1}
+# PIL formats whose frames can be decoded independently, in any order
+RANDOM_ACCESS_FORMATS = ('TIFF',)
+
+
+class UnsupportedClipError(ValueError):
+    """Input the clip reader cannot decode, or an unknown output format"""
+
+
+def read_clip_header(path):
+    """
+    Frame count, size, frame rate and source format of a clip, without decoding frames
+    DICOM headers are kept under 'dicom'; 'random_access' tells whether workers
+    can decode their own frames
+    """
+    if is_dicom(path):
+        info = read_dicom_header(path)
+        if len(info['frame_shape']) == 3 and info['dtype'].itemsize != 1:
+            raise UnsupportedClipError("Colour DICOM clips must have 8 bits per sample")
+        frame_time = info.get('FrameTime')
+        fps = 1000 / frame_time if isinstance(frame_time, float) and frame_time > 0 else \
+            info.get('RecommendedDisplayFrameRate')
+        return {'format': 'DICOM', 'frames': info['frames'], 'width': int(info['Columns']),
+                'height': int(info['Rows']),
+                'fps': round(float(fps), 2) if isinstance(fps, (int, float)) else None,
+                'random_access': True, 'dicom': info}
+
+    try:
+        with Image.open(path) as img:
+            duration = img.info.get('duration')
+            return {'format': img.format, 'frames': getattr(img, 'n_frames', 1), 'width': img.width,
+                    'height': img.height,
+                    'fps': round(1000 / duration, 2) if isinstance(duration, (int, float)) and duration > 0 else None,
+                    'random_access': img.format in RANDOM_ACCESS_FORMATS}
+    except UnidentifiedImageError as e:
+        raise UnsupportedClipError(str(e))
+
+
+def dicom_value_range(path, info):
+    """Min/max over every frame in modality units, from one streaming pass over the mapped frames"""
+    low, high = np.inf, -np.inf
+    for frame in map_dicom_frames(path, info):
+        low, high = min(low, frame.min()), max(high, frame.max())
+    ends = rescale(np.array([low, high]), info)
+    return float(ends.min()), float(ends.max())
+
+
+def clip_window(path, header, modality, window):
+    """
+    One window for every frame of a DICOM clip (colour clips are not windowed)
+    Returns (window dict for render_frame or None, window metrics)
+    """
+    info = header['dicom']
+    if len(info['frame_shape']) == 3:
+        return None, {'preset': 'color'}
+    names = parse_windows(window)
+    name = names[0] if names else DEFAULT_WINDOWS.get(modality.upper(), 'auto')
+    center_width = WINDOW_PRESETS.get(name) or (file_window(info) if name == 'auto' else None)
+    if center_width:
+        center, width = center_width
+        dtype, metrics = np.uint8, {'preset': name, 'center': center, 'width': width}
+    else:
+        low, high = dicom_value_range(path, info)
+        center, width = (low + high) / 2 + 0.5, max(high - low + 1, 1)
+        dtype, metrics = np.uint16, {'preset': 'full', 'min': low, 'max': high}
+    inverted = str(info.get('PhotometricInterpretation', '')).strip() == 'MONOCHROME1'
+    return {'center': center, 'width': width, 'dtype': dtype, 'inverted': inverted}, metrics
+
+
+def render_frame(values, window):
+    """A decoded DICOM frame -> uint8/uint16 array through the clip's window"""
+    if window is None:
+        return colour_frame(values)
+    array = apply_window(values, window['center'], window['width'], window['dtype'])
+    if window['inverted']:
+        array = np.iinfo(array.dtype).max - array
+    return array
+
+
+def read_frames(path, header, indexes):
+    """
+    Yield the frames at ascending indexes: windowed arrays for DICOM, PIL images otherwise
+    Sequential formats decode every frame up to the last index requested
+    """
+    if header['format'] == 'DICOM':
+        frames = map_dicom_frames(path, header['dicom'])
+        for index in indexes:
+            yield render_frame(frame_values(frames[index], header['dicom']), header.get('window'))
+        return
+    with Image.open(path) as img:
+        for index in indexes:
+            img.seek(index)
+            yield img.copy()
+
+
+def sample_indexes(frames, count):
+    """count evenly spaced frame indexes, first and last included"""
+    if frames <= count:
+        return list(range(frames))
+    if count < 2:
+        return [frames // 2]
+    return sorted({round(i * (frames - 1) / (count - 1)) for i in range(count)})
+
+
+def clip_mode(samples):
+    """
+    Working representation shared by every frame: 16-bit frames stay arrays;
+    8-bit clips are 'RGB' if any sample frame has colour, else 'L'
+    """
+    working = [to_working_image(sample) for sample in samples]
+    if any(isinstance(img, np.ndarray) for img in working):
+        return None
+    return 'RGB' if any(img.mode == 'RGB' for img in working) else 'L'
+
+
+def median_note(notes, name, key):
+    return float(np.median([note[name][key] for note in notes]))
+
+
+def clip_plan(samples, modality):
+    """
+    Statistics shared by every frame of a clip, from its sample frames
+    The pipeline runs on the samples step by step: a tone step's LUTs come from
+    the samples' summed histograms; a denoise step takes the samples' median
+    noise sigma, or is dropped when the median noise is under its threshold; a
+    speckle step takes the median speckle coefficient. Steps with estimates run
+    twice on the samples (estimate, then the clip's value). A configured
+    quality gate judges the middle sample, once for the whole clip.
+    Returns (plan for apply_modality_enhancement's clip, quality metrics and
+    image_features summary of the middle sample)
+    """
+    mode = clip_mode(samples)
+    frames = originals = [to_working_image(sample, mode) for sample in samples]
+    middle = len(frames) // 2
+    gate_info = None
+    compiled = get_pipeline(modality)
+    pipeline = compiled['steps']
+    if compiled.get('quality_gate'):
+        pipeline, gate_info = quality_gate.gate(frames[middle], pipeline, compiled['quality_gate'])
+    upscale_step = pipeline[-1:] if pipeline and pipeline[-1][0] == 'upscale' else []
+    steps, luts = [], {}
+
+    for step in pipeline[:len(pipeline) - len(upscale_step)]:
+        name, param = step
+        if name == 'tone':
+            histograms = None
+            for frame in frames:
+                frame_hist = [np.asarray(h, dtype=np.int64) for h in image_histograms(frame)]
+                histograms = frame_hist if histograms is None else [a + b for a, b in zip(histograms, frame_hist)]
+            levels = 65536 if len(histograms[0]) > 256 else 256
+            luts[len(steps)] = build_tone_lut(histograms, param, levels=levels)
+            frames = [run_step(frame, step, luts[len(steps)]) for frame in frames]
+            steps.append(step)
+            continue
+        if name in ('denoise', 'speckle'):
+            notes = [{} for _ in frames]
+            for frame, note in zip(frames, notes):
+                run_step(frame, step, notes=note)
+            if name == 'denoise':
+                sigma = median_note(notes, 'denoise', 'sigma')
+                if median_note(notes, 'denoise', 'noise') < param['noise_threshold'] or sigma <= 0:
+                    continue  # Clean clip: no frame is denoised
+                step = (name, dict(param, sigma=sigma, noise_threshold=0))
+            else:
+                step = (name, dict(param, speckle=median_note(notes, 'speckle', 'speckle')))
+        frames = [run_step(frame, step) for frame in frames]
+        steps.append(step)
+
+    quality = compute_quality_metrics(originals[middle], frames[middle], 'fast')
+    quality['features'] = image_features.summarize(originals[middle], gate_info)
+    if gate_info:
+        quality['quality_gate'] = gate_info
+    return {'mode': mode, 'steps': steps + upscale_step, 'luts': luts}, quality
+
+
+def plan_metrics(plan):
+    """The clip-wide estimates that went into a plan, for the response"""
+    metrics = {}
+    for name, param in plan['steps']:
+        if name == 'denoise':
+            metrics['denoise'] = {'method': param.get('method'), 'sigma': round(param['sigma'], 3)}
+        elif name == 'speckle':
+            metrics['speckle'] = {'method': param.get('method'), 'speckle': round(param['speckle'], 4)}
+        elif name == 'upscale':
+            metrics['upscale'] = {'method': param['method'], 'scale_factor': param['scale_factor']}
+    return metrics
+
+
+def enhance_frames(frames, modality, plan, encoding=None):
+    """
+    Enhance decoded frames with a clip's plan
+    Returns PIL images, or encoded frames (bytes) when an encoding is given
+    """
+    out = []
+    for frame in frames:
+        enhanced, _ = apply_modality_enhancement(frame, modality, metrics_mode='off', clip=plan,
+                                                 tiling=FRAME_TILING)
+        out.append(encode_image(enhanced, encoding)[0] if encoding else enhanced)
+    return out
+
+
+def enhance_file_frames(path, header, start, stop, modality, plan, encoding=None):
+    """Worker entry point for DICOM and TIFF clips: decode only frames start..stop"""
+    return enhance_frames(read_frames(path, header, range(start, stop)), modality, plan, encoding)
+
+
+def iter_chunks(frames, size):
+    chunk = []
+    for frame in frames:
+        chunk.append(frame)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def output_kind(output_path):
+    suffix = os.path.splitext(str(output_path))[1].lower()
+    if suffix not in OUTPUT_MEDIA_TYPES:
+        raise UnsupportedClipError(f"Unknown clip output {suffix or output_path} "
+                                   f"(expected one of {', '.join(OUTPUT_MEDIA_TYPES)})")
+    return 'zip' if suffix == '.zip' else 'tiff'
+
+
+@contextmanager
+def frame_writer(output_path, encoding):
+    """
+    Yields write(frame) appending one frame to the output: a TIFF page, or a
+    ZIP entry frame_00000.png ... holding already encoded bytes
+    """
+    if output_kind(output_path) == 'zip':
+        ext = extension(encoding)
+        # Frames are compressed images already; storing them skips a second deflate
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_STORED) as archive:
+            count = 0
+
+            def write(data):
+                nonlocal count
+                archive.writestr(f"frame_{count:05d}{ext}", data)
+                count += 1
+
+            yield write
+        return
+
+    with open(output_path, 'w+b') as f, TiffImagePlugin.AppendingTiffWriter(f) as tiff:
+        def write(img):
+            img.save(tiff, format='TIFF', compression=TIFF_COMPRESSION)
+            tiff.newFrame()
+
+        yield write
+
+
+def enhance_clip(input_path, output_path, modality, window=None, workers=None, chunk_frames=DEFAULT_CHUNK_FRAMES,
+                 executor=None, encoding=DEFAULT_FRAME_ENCODING, sample_frames=DEFAULT_SAMPLE_FRAMES):
+    """
+    Enhance every frame of a clip and write a multi-frame output to output_path
+    (.tif, or .zip of frames in encoding). Statistics come from sample_frames
+    frames; chunks of chunk_frames frames are enhanced in parallel, at most two
+    per worker in flight, and written in order, so memory stays at a few frames
+    per worker whatever the clip length.
+    Pass an existing executor (process or thread pool) to share a server's pool.
+    """
+    started = time.perf_counter()
+    peak_rss_before = get_peak_rss_mb()
+    frame_encoding = parse_encoding(encoding) if output_kind(output_path) == 'zip' else None
+    header = read_clip_header(input_path)
+    window_metrics = None
+    if header['format'] == 'DICOM':
+        header['window'], window_metrics = clip_window(input_path, header, modality, window)
+
+    indexes = sample_indexes(header['frames'], sample_frames)
+    plan, quality = clip_plan(list(read_frames(input_path, header, indexes)), modality)
+    plan_time = time.perf_counter() - started
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+    max_in_flight = 2 * (workers or os.cpu_count())
+
+    try:
+        with frame_writer(output_path, frame_encoding) as write:
+            pending = []
+
+            def write_oldest():
+                for frame in pending.pop(0).result():
+                    write(frame)
+
+            if header['random_access']:
+                # Workers decode their own frames; only indexes cross the process boundary
+                chunks = ((start, min(start + chunk_frames, header['frames']))
+                          for start in range(0, header['frames'], chunk_frames))
+                submit = (executor.submit(enhance_file_frames, input_path, header, start, stop, modality, plan,
+                                          frame_encoding) for start, stop in chunks)
+            else:
+                frames = read_frames(input_path, header, range(header['frames']))
+                submit = (executor.submit(enhance_frames, chunk, modality, plan, frame_encoding)
+                          for chunk in iter_chunks(frames, chunk_frames))
+            for future in submit:
+                pending.append(future)
+                if len(pending) >= max_in_flight:
+                    write_oldest()
+            while pending:
+                write_oldest()
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    peak_rss_after = get_peak_rss_mb()
+    metrics = dict(quality, **{
+        'source_format': header['format'],
+        'width': header['width'],
+        'height': header['height'],
+        'frames': header['frames'],
+        'fps': header['fps'],
+        'clip': dict(plan_metrics(plan), sample_frames=indexes, plan_time=round(plan_time, 3)),
+        'output_format': 'zip' if frame_encoding else 'tiff',
+        'enhanced_bytes': os.path.getsize(output_path),
+        'processing_time': round(elapsed, 3),
+        'frames_per_second': round(header['frames'] / elapsed, 2) if elapsed else None,
+        'peak_rss_mb': peak_rss_after,
+    })
+    if window_metrics:
+        metrics['window'] = window_metrics
+    if frame_encoding:
+        metrics['frame_encoding'] = frame_encoding
+    if peak_rss_after is not None:
+        metrics['rss_growth_mb'] = round(peak_rss_after - peak_rss_before, 1)
+    return metrics
@@ -0,0 +1,137 @@
+"""
+Contrast Limited Adaptive Histogram Equalization (CLAHE)
+The image is divided into a grid of contextual tiles. Each tile's histogram is
+clipped at clip_limit, the excess redistributed, and its CDF becomes that tile's
+mapping. Pixels are mapped by bilinear interpolation between the mappings of
+the four nearest tile centres, so there are no seams at tile borders.
+
+Histograms for all tiles come from one bincount per row of tiles, and the
+interpolation runs on horizontal strips between tile centres. Both are spread
+over a thread pool: NumPy releases the GIL in its bulk array loops. 8-bit and
+16-bit single-channel arrays are supported; results keep the input dtype.
+"""
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_TILE_GRID = (8, 8)
+DEFAULT_CLIP_LIMIT = 0.01  # Fraction of a tile's pixels allowed per bin, as in skimage
+CLIP_PASSES = 4
+
+
+def default_nbins(dtype):
+    """Histogram bins (distinct output levels per tile): 256 for 8-bit, 4096 for 16-bit"""
+    return 256 if dtype == np.uint8 else 4096
+
+
+def tile_histograms(bins, tile_h, tile_w, rows, cols, nbins, executor):
+    """(rows, cols, nbins) histograms of a padded bin-index image, one bincount per tile row"""
+    col_offsets = (np.arange(cols * tile_w) // tile_w * nbins).astype(np.int32)
+
+    def row_histograms(row):
+        band = bins[row * tile_h:(row + 1) * tile_h]
+        index = band + col_offsets  # bin index tagged with its tile column
+        return np.bincount(index.ravel(), minlength=cols * nbins).reshape(cols, nbins)
+
+    return np.stack(list(executor.map(row_histograms, range(rows))))
+
+
+def clip_histograms(hist, clip_limit, tile_pixels, passes=CLIP_PASSES):
+    """
+    Clip each histogram at clip_limit * tile_pixels and spread the excess evenly
+    over all bins; repeated because the spread can push bins back over the limit
+    """
+    hist = hist.astype(np.float32)
+    if not 0 < clip_limit < 1:
+        return hist  # plain adaptive equalization
+    limit = max(clip_limit * tile_pixels, 1.0)
+    for _ in range(passes):
+        excess = np.maximum(hist - limit, 0).sum(axis=-1, keepdims=True)
+        if not excess.any():
+            break
+        np.minimum(hist, limit, out=hist)
+        hist += excess / hist.shape[-1]
+    return hist
+
+
+def tile_mappings(hist, max_value):
+    """CDF of each tile histogram scaled to the output range: (rows, cols, nbins) float32"""
+    cdf = np.cumsum(hist, axis=-1)
+    cdf *= np.float32(max_value) / cdf[..., -1:]
+    return cdf
+
+
+def axis_weights(length, tile, count):
+    """
+    For each pixel along an axis: the lower neighbouring tile centre, the upper one
+    and the interpolation weight towards the upper one (clamped at the borders)
+    """
+    position = (np.arange(length) + 0.5) / tile - 0.5
+    lower = np.clip(np.floor(position), 0, count - 1).astype(np.int64)
+    upper = np.minimum(lower + 1, count - 1)
+    weight = np.clip(position - lower, 0, 1).astype(np.float32)
+    return lower, upper, weight
+
+
+def clahe(array, tile_grid=DEFAULT_TILE_GRID, clip_limit=DEFAULT_CLIP_LIMIT, nbins=None, workers=None):
+    """
+    CLAHE for a 2-D uint8 or uint16 array
+
+    tile_grid: (rows, cols) of contextual tiles
+    clip_limit: normalized clip limit in (0, 1); 0 or >= 1 disables clipping
+    nbins: histogram bins over the image's value range (256 / 4096 by default)
+    workers: threads for the histogram and interpolation passes
+    """
+    if array.dtype not in (np.uint8, np.uint16) or array.ndim != 2:
+        raise ValueError("CLAHE expects a single-channel uint8 or uint16 array")
+
+    max_value = np.iinfo(array.dtype).max
+    nbins = nbins or default_nbins(array.dtype)
+    if not 2 <= nbins <= max_value + 1:
+        raise ValueError(f"nbins must be between 2 and {max_value + 1}")
+
+    height, width = array.shape
+    rows, cols = min(tile_grid[0], height), min(tile_grid[1], width)
+    tile_h, tile_w = math.ceil(height / rows), math.ceil(width / cols)
+
+    # Bins span the image's own value range, so 12-bit data stored in 16 bits (or
+    # a narrow 8-bit range) still gets the full bin resolution
+    low, high = int(array.min()), int(array.max())
+    levels = np.arange(max_value + 1, dtype=np.int64)
+    bin_lut = np.clip((levels - low) * nbins // (high - low + 1), 0, nbins - 1).astype(np.int32)
+    bins = bin_lut[array]
+    # Pad to whole tiles by reflection so edge tiles see as many pixels as the rest
+    pad_h, pad_w = rows * tile_h - height, cols * tile_w - width
+    if pad_h or pad_w:
+        bins = np.pad(bins, ((0, pad_h), (0, pad_w)), mode='symmetric')
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hist = tile_histograms(bins, tile_h, tile_w, rows, cols, nbins, executor)
+        hist = clip_histograms(hist, clip_limit, tile_h * tile_w)
+        maps = tile_mappings(hist, max_value).reshape(rows, cols * nbins)
+
+        y_lower, y_upper, y_weight = axis_weights(height, tile_h, rows)
+        x_lower, x_upper, x_weight = axis_weights(width, tile_w, cols)
+        x_lower, x_upper = x_lower * nbins, x_upper * nbins
+        out = np.empty_like(array)
+
+        # Strips of rows that share the same pair of tile-centre rows
+        boundaries = np.flatnonzero(np.diff(y_lower * rows + y_upper)) + 1
+        strips = zip(np.r_[0, boundaries], np.r_[boundaries, height])
+
+        def map_strip(strip):
+            start, stop = strip
+            b = bins[start:stop, :width]
+            top, bottom = maps[y_lower[start]], maps[y_upper[start]]
+            upper_rows = top.take(b + x_lower) * (1 - x_weight) + top.take(b + x_upper) * x_weight
+            lower_rows = bottom.take(b + x_lower) * (1 - x_weight) + bottom.take(b + x_upper) * x_weight
+            wy = y_weight[start:stop, None]
+            mapped = upper_rows * (1 - wy) + lower_rows * wy
+            np.clip(mapped + 0.5, 0, max_value, out=mapped)
+            out[start:stop] = mapped.astype(array.dtype)
+
+        list(executor.map(map_strip, strips))
+    return out
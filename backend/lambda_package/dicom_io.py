@@ -0,0 +1,253 @@
+"""
+DICOM ingestion for the enhancement engine
+Pixel data is decoded once with imageio's DICOM reader, converted to modality
+units (Hounsfield units for CT) via rescale slope/intercept, and any number of
+window/level presets are rendered from that single decode with NumPy
+"""
+from io import BytesIO
+
+import numpy as np
+
+from imageio.plugins import _dicom
+
+# Window/level tags are not in imageio's minimal tag dictionary; register them so
+# the reader keeps the file's own window alongside slope and intercept
+_dicom.MINIDICT.setdefault((0x0028, 0x0004), ("PhotometricInterpretation", "CS"))
+_dicom.MINIDICT.setdefault((0x0028, 0x1050), ("WindowCenter", "DS"))
+_dicom.MINIDICT.setdefault((0x0028, 0x1051), ("WindowWidth", "DS"))
+# Multi-frame layout and timing, for cine loops (see cine.py)
+_dicom.MINIDICT.setdefault((0x0028, 0x0006), ("PlanarConfiguration", "US"))
+_dicom.MINIDICT.setdefault((0x0018, 0x1063), ("FrameTime", "DS"))
+_dicom.MINIDICT.setdefault((0x0008, 0x2144), ("RecommendedDisplayFrameRate", "IS"))
+
+# (center, width) in Hounsfield units
+WINDOW_PRESETS = {
+    'lung': (-600, 1500),
+    'bone': (400, 1800),
+    'soft_tissue': (40, 400),
+    'brain': (40, 80),
+}
+
+# Window used when the request names none; other modalities use the file's own
+# window if present, else the full dynamic range at 16 bits
+DEFAULT_WINDOWS = {
+    'CT': 'soft_tissue',
+    'CT SCAN': 'soft_tissue',
+}
+
+DICOM_MAGIC = b'DICM'
+DICOM_MAGIC_OFFSET = 128
+DEFLATED_TRANSFER_SYNTAX = '1.2.840.10008.1.2.1.99'
+BIG_ENDIAN_TRANSFER_SYNTAX = '1.2.840.10008.1.2.2'
+
+
+class UnsupportedDicomError(ValueError):
+    """DICOM file the reader cannot decode (compressed transfer syntax, no pixel data)"""
+
+
+def is_dicom(source):
+    """Check for the 'DICM' marker after the 128-byte preamble without consuming the source"""
+    end = DICOM_MAGIC_OFFSET + len(DICOM_MAGIC)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source[DICOM_MAGIC_OFFSET:end]) == DICOM_MAGIC
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read(end)[DICOM_MAGIC_OFFSET:] == DICOM_MAGIC
+    position = source.tell()
+    try:
+        return source.read(end)[DICOM_MAGIC_OFFSET:] == DICOM_MAGIC
+    finally:
+        source.seek(position)
+
+
+def parse_windows(window):
+    """Normalize a window request: None, a preset name, 'lung,bone' or a list of names"""
+    if not window:
+        return []
+    if isinstance(window, str):
+        window = window.split(',')
+    names = [name.strip().lower().replace(' ', '_').replace('-', '_') for name in window]
+    names = [name for name in names if name]
+    for name in names:
+        if name not in WINDOW_PRESETS and name not in ('auto', 'full'):
+            raise ValueError(
+                f"Unknown window preset: {name} (expected one of {', '.join(WINDOW_PRESETS)}, auto, full)"
+            )
+    return names
+
+
+def read_dicom(source):
+    """
+    Decode a DICOM file (path, binary file object or bytes)
+    Returns (values, info): values in modality units as float32 - one frame,
+    or (rows, columns, samples) for colour data - and the parsed header tags
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+
+    try:
+        reader = _dicom.SimpleDicomReader(source)
+        info = dict(reader.info)
+        # Slope/intercept are applied below in float32; imageio's integer
+        # rescaling can pick a dtype too narrow for the result
+        reader.info.pop('RescaleSlope', None)
+        reader.info.pop('RescaleIntercept', None)
+        raw = reader.get_numpy_array()
+    except _dicom.CompressedDicom as e:
+        raise UnsupportedDicomError(f"Compressed DICOM is not supported: {e}")
+    except (_dicom.NotADicomFile, NotImplementedError, RuntimeError, TypeError) as e:
+        raise UnsupportedDicomError(str(e))
+    info.pop('PixelData', None)
+
+    samples = int(info.get('SamplesPerPixel', 1))
+    if samples > 1:
+        # imageio shapes colour data as planar (samples, [frames,] rows, cols) whatever
+        # the file's PlanarConfiguration; take the first frame's values in the file's
+        # own layout -> (rows, cols, samples). Colour data is not windowed
+        rows, columns = int(info['Rows']), int(info['Columns'])
+        frame = raw.reshape(-1)[:samples * rows * columns]
+        if int(info.get('PlanarConfiguration', 0) or 0):
+            return np.moveaxis(frame.reshape(samples, rows, columns), 0, -1), info
+        return frame.reshape(rows, columns, samples), info
+
+    return rescale(raw[0] if raw.ndim == 3 else raw, info), info
+
+
+def rescale(frame, info):
+    """Stored values -> modality units (RescaleSlope/RescaleIntercept) as float32"""
+    slope = float(info.get('RescaleSlope', 1) or 1)
+    intercept = float(info.get('RescaleIntercept', 0) or 0)
+    values = frame.astype(np.float32)
+    if slope != 1:
+        values *= np.float32(slope)
+    if intercept:
+        values += np.float32(intercept)
+    return values
+
+
+def read_dicom_header(path):
+    """
+    Parse a DICOM file's tags (path or binary file object) without reading its pixel data
+    Adds what memory-mapping the frames needs: 'frames', 'frame_shape' (rows,
+    columns[, samples] or samples, rows, columns for planar colour), 'dtype' and
+    'pixel_offset'. Raises UnsupportedDicomError for compressed or deflated data
+    """
+    try:
+        reader = _dicom.SimpleDicomReader(path if hasattr(path, 'read') else str(path))
+    except _dicom.CompressedDicom as e:
+        raise UnsupportedDicomError(f"Compressed DICOM is not supported: {e}")
+    except (_dicom.NotADicomFile, NotImplementedError, RuntimeError, TypeError) as e:
+        raise UnsupportedDicomError(str(e))
+    info = dict(reader.info)
+    info.pop('PixelData', None)
+    location = reader._pixel_data_loc
+    if info.get('TransferSyntaxUID') == DEFLATED_TRANSFER_SYNTAX or not location or location[1] == 0xFFFFFFFF:
+        raise UnsupportedDicomError("Pixel data cannot be memory-mapped (deflated or encapsulated)")
+
+    rows, columns = int(info['Rows']), int(info['Columns'])
+    samples = int(info.get('SamplesPerPixel', 1))
+    if samples == 1:
+        frame_shape = (rows, columns)
+    elif int(info.get('PlanarConfiguration', 0) or 0):
+        frame_shape = (samples, rows, columns)
+    else:
+        frame_shape = (rows, columns, samples)
+    dtype = np.dtype(f"{'i' if info.get('PixelRepresentation') else 'u'}{int(info['BitsAllocated']) // 8}")
+    if info.get('TransferSyntaxUID') == BIG_ENDIAN_TRANSFER_SYNTAX:
+        dtype = dtype.newbyteorder('>')
+    frames = max(int(info.get('NumberOfFrames', 1) or 1), 1)
+    if frames * int(np.prod(frame_shape)) * dtype.itemsize > location[1]:
+        raise UnsupportedDicomError("DICOM pixel data is truncated")
+    info.update(frames=frames, frame_shape=frame_shape, dtype=dtype, pixel_offset=location[0])
+    return info
+
+
+def map_dicom_frames(path, info):
+    """Memory-map the frames of an uncompressed DICOM file (frames, *frame_shape)"""
+    return np.memmap(path, dtype=info['dtype'], mode='r', offset=info['pixel_offset'],
+                     shape=(info['frames'],) + info['frame_shape'])
+
+
+def frame_values(raw, info):
+    """
+    One mapped frame -> what read_dicom returns: modality units as float32, or
+    (rows, columns, samples) for colour data
+    """
+    if raw.ndim == 3:
+        planar = int(info.get('PlanarConfiguration', 0) or 0)
+        return np.array(np.moveaxis(raw, 0, -1) if planar else raw)
+    return rescale(raw, info)
+
+
+def file_window(info):
+    """(center, width) stored in the DICOM header, or None"""
+    center, width = info.get('WindowCenter'), info.get('WindowWidth')
+    if isinstance(center, tuple):
+        center = center[0]
+    if isinstance(width, tuple):
+        width = width[0]
+    if isinstance(center, (int, float)) and isinstance(width, (int, float)) and width >= 1:
+        return float(center), float(width)
+    return None
+
+
+def colour_frame(values):
+    """
+    Colour values as uint8, unwindowed. Wider samples would wrap around when cast,
+    so they are refused rather than rendered
+    """
+    if values.dtype.itemsize != 1:
+        raise UnsupportedDicomError("Colour DICOM must have 8 bits per sample")
+    return values.astype(np.uint8, copy=False)
+
+
+def apply_window(values, center, width, dtype=np.uint8):
+    """
+    Linear VOI window (DICOM PS3.3 C.11.2.1.2) as vectorized NumPy:
+    values below center - width/2 map to 0, above center + width/2 to the dtype maximum
+    """
+    max_value = np.iinfo(dtype).max
+    scale = np.float32(max_value / max(width - 1, 1))
+    out = values - np.float32(center - 0.5 - (width - 1) / 2)
+    out *= scale
+    np.clip(out, 0, max_value, out=out)
+    out += np.float32(0.5)
+    return out.astype(dtype)
+
+
+def full_range(values, dtype=np.uint16):
+    """Stretch the data's own min..max onto the output dtype (no window)"""
+    low, high = float(values.min()), float(values.max())
+    return apply_window(values, (low + high) / 2 + 0.5, max(high - low + 1, 1), dtype)
+
+
+def render_windows(values, info, windows, modality=''):
+    """
+    Render one or more windows from a single decoded frame
+    windows: preset names ('lung', 'bone', 'soft_tissue', 'brain'), 'auto' for the
+    file's own window or 'full' for the data range. Empty picks the modality default.
+    Returns a list of (name, array, window_metrics); presets render to 8-bit,
+    'full' keeps 16 bits
+    """
+    if values.ndim == 3:
+        return [('color', colour_frame(values), {'preset': 'color'})]
+
+    if not windows:
+        default = DEFAULT_WINDOWS.get(modality.upper())
+        windows = [default] if default else ['auto']
+
+    inverted = str(info.get('PhotometricInterpretation', '')).strip() == 'MONOCHROME1'
+    rendered = []
+    for name in windows:
+        center_width = WINDOW_PRESETS.get(name) or (file_window(info) if name == 'auto' else None)
+        if center_width:
+            array = apply_window(values, *center_width, dtype=np.uint8)
+            window_metrics = {'preset': name, 'center': center_width[0], 'width': center_width[1]}
+        else:
+            array = full_range(values)
+            window_metrics = {'preset': 'full'}
+        if inverted:
+            # MONOCHROME1 stores white as the minimum; flip so all outputs read the same way
+            array = np.iinfo(array.dtype).max - array
+        rendered.append((name, array, window_metrics))
+    return rendered
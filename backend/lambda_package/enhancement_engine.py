@@ -0,0 +1,535 @@
+"""
+Medical Image Enhancement Engine
+Modality-specific pixel processing shared by the Lambda and the API server
+"""
+import os
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+import numpy as np
+from PIL import Image, ImageChops, ImageEnhance, ImageFilter, ImageOps
+
+import array_filters
+import clahe as clahe_filter
+import denoise as denoise_filter
+import image_features
+import memory_budget
+import quality_gate
+import speckle as speckle_filter
+import super_resolution
+import tiled_engine
+from base64_stream import BufferReader
+from quality_metrics import compute_quality_metrics
+from dicom_io import is_dicom, parse_windows, read_dicom, render_windows
+from encoders import encode_image, encode_metrics, encode_to_buffer, extension, parse_encoding, save_image, to_8bit
+from pipelines import get_pipeline
+from point_ops import apply_luts, apply_point_ops, apply_point_ops_array
+from result_cache import open_cache
+
+# PIL modes holding more than 8 bits per sample (12/16-bit radiology data)
+HIGH_BIT_DEPTH_MODES = ('I;16', 'I;16B', 'I;16L', 'I;16N', 'I')
+
+
+def to_working_image(img, mode=None):
+    """
+    Pick the cheapest representation that loses nothing:
+    - 12/16-bit grayscale -> uint16 NumPy array (full depth, single channel)
+    - 8-bit grayscale, or RGB whose bands are identical -> PIL 'L'
+    - anything else -> PIL 'RGB'
+    Decoded DICOM frames arrive as uint8/uint16 arrays and are routed the same way
+    mode: 'L' or 'RGB' to force the 8-bit representation, so every frame of a
+    clip matches the clip's tone LUTs
+    """
+    if mode in ('L', 'RGB') and not (is_array(img) and img.dtype == np.uint16):
+        img = Image.fromarray(img.astype(np.uint8)) if is_array(img) else img
+        return img if img.mode == mode else img.convert(mode)
+    if is_array(img):
+        if img.dtype == np.uint16:
+            return img
+        img = Image.fromarray(img.astype(np.uint8))
+    if img.mode in HIGH_BIT_DEPTH_MODES:
+        return np.clip(np.asarray(img), 0, 65535).astype(np.uint16)
+    if img.mode in ('L', 'LA', '1'):
+        return img.convert('L') if img.mode != 'L' else img
+    if img.mode == 'P' and img.palette and img.palette.mode == 'L':
+        return img.convert('L')
+
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    # Grayscale studies are often saved as RGB; detect that and drop two channels
+    red, green, blue = img.split()
+    if ImageChops.difference(red, green).getbbox() is None and \
+            ImageChops.difference(green, blue).getbbox() is None:
+        return red
+    return img
+
+
+def is_array(img):
+    return isinstance(img, np.ndarray)
+
+
+def tone(img, ops):
+    """Fused point operations on either representation"""
+    if is_array(img):
+        return apply_point_ops_array(img, ops)
+    return apply_point_ops(img, ops)
+
+
+def kernel_filter(img, name):
+    """Named 3x3 PIL kernel filter (SHARPEN, EDGE_ENHANCE_MORE, ...)"""
+    if is_array(img):
+        return array_filters.kernel_filter(img, name)
+    return img.filter(getattr(ImageFilter, name))
+
+
+def median(img, size):
+    if is_array(img):
+        return array_filters.median_filter(img, size)
+    return img.filter(ImageFilter.MedianFilter(size=size))
+
+
+def sharpness(img, factor):
+    if is_array(img):
+        return array_filters.sharpness(img, factor)
+    return ImageEnhance.Sharpness(img).enhance(factor)
+
+
+def clahe(img, params, workers=None):
+    """
+    Contrast limited adaptive histogram equalization (see clahe.py)
+    Colour images are equalized on luma only, so hues are preserved
+    """
+    params = dict(params or {})
+    if workers:
+        params['workers'] = workers
+    if is_array(img):
+        return clahe_filter.clahe(img, **params)
+    if img.mode == 'L':
+        return Image.fromarray(clahe_filter.clahe(np.asarray(img), **params), 'L')
+    luma, blue, red = img.convert('YCbCr').split()
+    luma = Image.fromarray(clahe_filter.clahe(np.asarray(luma), **params), 'L')
+    return Image.merge('YCbCr', (luma, blue, red)).convert(img.mode)
+
+
+def denoise(img, params, notes=None, workers=None):
+    """
+    Noise-gated denoising (see denoise.py); colour images are denoised per channel
+    The noise estimate and whether the step was skipped go to notes['denoise']
+    """
+    params = dict(params or {})
+    if workers:
+        params['workers'] = workers
+    if is_array(img):
+        result, info = denoise_filter.denoise(img, **params)
+    else:
+        array, info = denoise_filter.denoise(np.asarray(img), **params)
+        result = img if info['skipped'] else Image.fromarray(array, img.mode)
+    if notes is not None:
+        notes['denoise'] = info
+    return result
+
+
+def speckle(img, params, notes=None):
+    """
+    Adaptive speckle reduction (see speckle.py) on the single channel, or on
+    luma for colour images (Doppler overlays keep their hues)
+    The filter and speckle estimate go to notes['speckle']
+    """
+    params = params or {}
+    if is_array(img):
+        result, info = speckle_filter.reduce_speckle(img, **params)
+    elif img.mode == 'L':
+        array, info = speckle_filter.reduce_speckle(np.asarray(img), **params)
+        result = Image.fromarray(array, 'L')
+    else:
+        luma, blue, red = img.convert('YCbCr').split()
+        array, info = speckle_filter.reduce_speckle(np.asarray(luma), **params)
+        result = Image.merge('YCbCr', (Image.fromarray(array, 'L'), blue, red)).convert(img.mode)
+    if notes is not None:
+        notes['speckle'] = info
+    return result
+
+
+def upscale(img, params, tiling=None, notes=None):
+    """
+    Super-resolution (see super_resolution.py); colour images are upscaled per channel
+    Runs strip by strip under the tiling memory cap. The method, output size,
+    runtime and whether it was skipped go to notes['super_resolution']
+    """
+    started = time.perf_counter()
+    tiling = tiling or {}
+    array = img if is_array(img) else np.asarray(img)
+    result, info = super_resolution.upscale(array, max_memory_mb=tiling.get('max_memory_mb'),
+                                            workers=tiling.get('workers'), **(params or {}))
+    if not is_array(img):
+        result = img if info['skipped'] else Image.fromarray(result, img.mode)
+    info['time'] = round(time.perf_counter() - started, 3)
+    if notes is not None:
+        notes['super_resolution'] = info
+    return result
+
+
+def grayscale(img):
+    if is_array(img) or img.mode == 'L':
+        return img
+    return ImageOps.grayscale(img)
+
+
+def to_output_image(img, output_mode=None):
+    """
+    Convert the working representation to a PIL image for encoding
+    Output stays single-channel (16-bit where the input was) unless RGB is requested
+    """
+    if is_array(img):
+        if output_mode == 'RGB':
+            return Image.fromarray((img >> 8).astype(np.uint8), 'L').convert('RGB')
+        return Image.fromarray(img)
+    if output_mode == 'RGB' and img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+# Bump whenever a code change alters what a pipeline step produces or the metrics
+# recorded with it: result_cache entries of other versions are discarded
+# (pipeline definitions are part of the cache key already)
+PIPELINE_VERSION = 2
+
+
+def pipeline_params(modality, **options):
+    """
+    Everything besides the input that shapes a result: the pipeline's steps, its
+    quality gate settings (when enabled) and request options
+    """
+    pipeline = get_pipeline(modality)
+    params = {'steps': pipeline['steps'], **options}
+    if pipeline.get('quality_gate'):
+        params['quality_gate'] = pipeline['quality_gate']
+    return params
+
+
+def run_step(img, step, luts=None, notes=None, workers=None):
+    """
+    Apply one pipeline step to a working image (PIL image or uint16 array)
+    luts: precomputed tone LUTs, so tiles can share statistics of the whole image
+    notes: dict collecting per-step details for the metrics (denoise, speckle)
+    workers: threads for the steps that run on a pool (CLAHE, denoise); None
+    uses every core, so callers already running in parallel pass their share
+    """
+    name, param = step
+    if name == 'tone':
+        return apply_luts(img, luts) if luts is not None else tone(img, param)
+    if name == 'grayscale':
+        return grayscale(img)
+    if name == 'sharpness':
+        return sharpness(img, param)
+    if name == 'kernel':
+        return kernel_filter(img, param)
+    if name == 'median':
+        return median(img, param)
+    if name == 'clahe':
+        return clahe(img, param, workers)
+    if name == 'denoise':
+        return denoise(img, param, notes, workers)
+    if name == 'speckle':
+        return speckle(img, param, notes)
+    raise ValueError(f"Unknown pipeline step: {name}")
+
+
+def apply_modality_enhancement(img, modality, output_mode=None, tiling=None, metrics_mode='fast', clip=None,
+                               keep_size=False):
+    """
+    Apply real image enhancement based on medical imaging modality
+    Different modalities require different processing techniques
+    Grayscale inputs are processed single-channel at their native bit depth;
+    pass output_mode='RGB' to get a 3-channel result
+    Images larger than the tiling threshold (or any image, when tiling sets a
+    memory cap) run through the tiled engine; see tiled_engine.tiling_plan
+    PSNR/SSIM and contrast/sharpness changes are measured against the input
+    ('fast' on a reduced copy, 'full' resolution, or 'off'), before a final
+    upscale step changes the size
+    clip: statistics shared by the frames of a clip (see cine.clip_plan) - its
+    steps with noise estimates fixed, tone LUTs by step index and working mode
+    With a quality gate configured, the steps are first skipped, shortened or
+    strengthened for the image (see quality_gate); the decision goes to
+    metrics['quality_gate']. Clips are gated once, in their plan
+    metrics['features'] describes the input for the GenAI prompts (see
+    image_features); clips describe their middle sample frame in their plan
+    keep_size: leave out a final upscale step, for callers whose output grid is
+    fixed (volume slices must match their NIfTI header's dimensions)
+    """
+    clip = clip or {}
+    img = original = to_working_image(img, clip.get('mode'))
+    notes = {}
+    if 'steps' in clip:
+        steps = clip['steps']
+    else:
+        pipeline = get_pipeline(modality)
+        steps = pipeline['steps']
+        if pipeline.get('quality_gate'):
+            steps, notes['quality_gate'] = quality_gate.gate(img, steps, pipeline['quality_gate'])
+        notes['features'] = image_features.summarize(img, notes.get('quality_gate'))
+    luts = clip.get('luts') or {}
+    upscale_step = steps[-1] if steps and steps[-1][0] == 'upscale' else None
+    if upscale_step:
+        steps = steps[:-1]
+    if keep_size:
+        upscale_step = None
+
+    plan = tiled_engine.tiling_plan(img, steps, tiling)
+    if plan:
+        img = tiled_engine.run_tiled(img, steps, plan, run_step, notes, luts)
+    else:
+        for index, step in enumerate(steps):
+            width, height = tiled_engine.image_size(img)
+            started = time.perf_counter()
+            img = run_step(img, step, luts.get(index), notes, (tiling or {}).get('workers'))
+            quality_gate.record_step_time(step, time.perf_counter() - started, width * height)
+
+    metrics = compute_quality_metrics(original, img, metrics_mode)
+    if upscale_step:
+        img = upscale(img, upscale_step[1], tiling, notes)
+    metrics.update(notes)
+    if plan:
+        metrics['tiling'] = plan
+    img = to_output_image(img, output_mode)
+    metrics['output_mode'] = img.mode
+    return img, metrics
+
+
+def iter_enhanced(source, modality, output_mode=None, window=None, tiling=None, metrics_mode='fast',
+                  memory_plan=None):
+    """
+    Open an image from a file path, binary file object or raw bytes and enhance it
+    PIL reads straight from the handle, so uploads are never copied into a bytes buffer
+    DICOM input is decoded once and each requested window preset is enhanced from it
+    tiling: options for tiled_engine.tiling_plan (memory cap, tile size, workers)
+    metrics_mode: 'fast', 'full' or 'off' (see quality_metrics)
+    memory_plan: memory_budget.plan_memory's reduction and forced grayscale, applied
+    as the image is decoded
+    Yields (window name or None, enhanced PIL image, metrics)
+    """
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    elif isinstance(source, (bytearray, memoryview)):
+        source = BufferReader(source)  # BytesIO would copy anything but bytes
+
+    if is_dicom(source):
+        values, info = read_dicom(source)
+        for name, array, window_metrics in render_windows(values, info, parse_windows(window), modality):
+            if memory_plan:
+                array = memory_budget.planned_image(array, memory_plan)
+            enhanced, metrics = apply_modality_enhancement(array, modality, output_mode, tiling, metrics_mode)
+            metrics['source_format'] = 'DICOM'
+            metrics['window'] = window_metrics
+            yield name, enhanced, metrics
+        return
+
+    with Image.open(source) as img:
+        if memory_plan:
+            img = memory_budget.open_planned(img, memory_plan)
+        else:
+            img.load()
+        enhanced, metrics = apply_modality_enhancement(img, modality, output_mode, tiling, metrics_mode)
+    yield None, enhanced, metrics
+
+
+def load_and_enhance(source, modality, output_mode=None, window=None, tiling=None, metrics_mode='fast'):
+    """
+    Enhance an image (the first window only, for DICOM)
+    Returns (enhanced PIL image, metrics)
+    """
+    _, enhanced, metrics = next(iter_enhanced(source, modality, output_mode, window, tiling, metrics_mode))
+    return enhanced, metrics
+
+
+PREVIEW_SIZES = (256, 1024)
+PREVIEW_ENCODING = 'jpeg:90'
+
+
+def make_previews(img, sizes=PREVIEW_SIZES):
+    """
+    8-bit preview pyramid of an enhanced image: {size: image no larger than size x size}
+    Sizes the image already fits are skipped (the full image serves them). Each
+    level is resampled from the next larger one, so only the largest reads the
+    full-resolution pixels
+    """
+    previews = {}
+    level = None
+    for size in sorted(set(sizes), reverse=True):
+        if size >= max(img.size):
+            continue
+        if level is None:
+            level = to_8bit(img)
+        scale = size / max(level.size)
+        target = (max(1, round(level.width * scale)), max(1, round(level.height * scale)))
+        level = level.resize(target, Image.LANCZOS, reducing_gap=3.0)
+        previews[size] = level
+    return previews
+
+
+def preview_output_path(output_path, size, encoding):
+    """Sibling file for a preview level: enhanced_ct_x.png -> enhanced_ct_x_256px.jpg"""
+    root, _ = os.path.splitext(output_path)
+    return f"{root}_{size}px{extension(encoding)}"
+
+
+def write_previews(img, output_path, previews):
+    """
+    Write the preview pyramid of img next to output_path
+    previews: {'sizes': [...], 'encoding': spec}; returns {size: file name}
+    """
+    encoding = parse_encoding(previews.get('encoding') or PREVIEW_ENCODING)
+    files = {}
+    for size, preview in make_previews(img, previews.get('sizes') or PREVIEW_SIZES).items():
+        path = preview_output_path(output_path, size, encoding)
+        save_image(preview, path, encoding)
+        files[str(size)] = os.path.basename(path)
+    return files
+
+
+def enhance_image_file(source, modality, output_mode=None, window=None, tiling=None, metrics_mode='fast',
+                       encoding=None):
+    """
+    Enhance an image and encode the result (PNG unless encoding says otherwise, see encoders)
+    Returns (encoded bytes, metrics)
+    """
+    enhanced, metrics = load_and_enhance(source, modality, output_mode, window, tiling, metrics_mode)
+    data, encoded = encode_image(enhanced, encoding)
+    metrics.update(encoded)
+    return data, metrics
+
+
+def enhance_image_windows(source, modality, output_mode=None, window=None, tiling=None, metrics_mode='fast',
+                          encoding=None, memory_plan=None, buffers=False):
+    """
+    Enhance every requested DICOM window from one decode
+    Returns a list of (window name or None, encoded bytes, metrics); with buffers
+    the encoded images are left in their BytesIO (see base64_stream.encode_base64)
+    """
+    encode = encode_to_buffer if buffers else encode_image
+    results = []
+    for name, enhanced, metrics in iter_enhanced(source, modality, output_mode, window, tiling, metrics_mode,
+                                                 memory_plan):
+        data, encoded = encode(enhanced, encoding)
+        metrics.update(encoded)
+        results.append((name, data, metrics))
+    return results
+
+
+def window_output_path(output_path, name):
+    """Sibling file for an additional window: enhanced_ct_x.png -> enhanced_ct_x_lung.png"""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}_{name}{ext}"
+
+
+def enhance_image_to_file(source, modality, output_path, output_mode=None, window=None, tiling=None, metrics_mode='fast',
+                          encoding=None, previews=None):
+    """
+    Enhance an image and write it to output_path (PNG unless encoding says otherwise;
+    the caller picks a matching file extension)
+    Meant to run inside a worker process: only the metrics travel back to the caller
+    For DICOM with several windows the first goes to output_path and the rest to
+    siblings named by window_output_path; metrics['windows'] maps preset -> file name
+    previews ({'sizes', 'encoding'}) writes a downscaled pyramid of the first window
+    from the enhanced image in memory; metrics['previews'] maps size -> file name
+    """
+    peak_rss_before = get_peak_rss_mb()
+    started = time.perf_counter()
+
+    encoding = parse_encoding(encoding)
+    metrics = None
+    windows = {}
+    for name, enhanced, window_metrics in iter_enhanced(source, modality, output_mode, window, tiling, metrics_mode):
+        path = output_path if metrics is None else window_output_path(output_path, name)
+        encode_started = time.perf_counter()
+        save_image(enhanced, path, encoding)
+        if metrics is None:
+            metrics = window_metrics
+            metrics['width'], metrics['height'] = enhanced.size
+            metrics['enhanced_bytes'] = os.path.getsize(path)
+            metrics.update(encode_metrics(encoding, encode_started))
+            if previews:
+                preview_started = time.perf_counter()
+                metrics['previews'] = write_previews(enhanced, output_path, previews)
+                metrics['preview_time'] = round(time.perf_counter() - preview_started, 4)
+        if name:
+            windows[name] = os.path.basename(path)
+        del enhanced
+    if windows:
+        metrics['windows'] = windows
+
+    peak_rss_after = get_peak_rss_mb()
+    metrics['processing_time'] = round(time.perf_counter() - started, 3)
+    metrics['peak_rss_mb'] = peak_rss_after
+    if peak_rss_after is not None:
+        metrics['rss_growth_mb'] = round(peak_rss_after - peak_rss_before, 1)
+
+    return metrics
+
+
+def enhance_image_to_file_cached(source, modality, output_path, output_mode=None, window=None, tiling=None,
+                                 metrics_mode='fast', encoding=None, previews=None, cache=None):
+    """
+    enhance_image_to_file behind the result cache (cache: result_cache.open_cache
+    options, None to bypass). A hit writes the stored image, window and preview
+    files under output_path's name instead of running the pipeline;
+    metrics['cache'] is 'hit' or 'miss'
+    """
+    if not cache:
+        return enhance_image_to_file(source, modality, output_path, output_mode, window, tiling, metrics_mode,
+                                     encoding, previews)
+
+    started = time.perf_counter()
+    result_cache = open_cache(cache, PIPELINE_VERSION)
+    encoding = parse_encoding(encoding)
+    key = result_cache.key(source, modality, pipeline_params(
+        modality, output_mode=output_mode, window=window, metrics_mode=metrics_mode, encoding=encoding,
+        previews=previews
+    ))
+    directory, filename = os.path.split(output_path)
+    stem = os.path.splitext(filename)[0]
+
+    hit = result_cache.get(key)
+    if hit:
+        metrics, outputs = hit
+        for suffix, data in outputs.items():
+            with open(os.path.join(directory, stem + suffix), 'wb') as f:
+                f.write(data)
+        for group in ('windows', 'previews'):
+            if group in metrics:
+                metrics[group] = {name: stem + suffix for name, suffix in metrics[group].items()}
+        metrics['processing_time'] = round(time.perf_counter() - started, 3)
+        metrics['cache'] = 'hit'
+        return metrics
+
+    metrics = enhance_image_to_file(source, modality, output_path, output_mode, window, tiling, metrics_mode,
+                                    encoding, previews)
+    # Sibling files are stored by their suffix to the output name
+    stored = dict(metrics)
+    outputs = {os.path.splitext(filename)[1]: filename}
+    for group in ('windows', 'previews'):
+        if group in metrics:
+            stored[group] = {name: sibling[len(stem):] for name, sibling in metrics[group].items()}
+            outputs.update((sibling[len(stem):], sibling) for sibling in metrics[group].values())
+    result_cache.put(key, stored, {
+        suffix: Path(directory, name).read_bytes() for suffix, name in outputs.items()
+    })
+    metrics['cache'] = 'miss'
+    return metrics
+
+
+def get_peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unsupported)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
@@ -3,13 +3,28 @@ AWS Lambda Function: Medical Image Enhancement
 Uses Amazon Bedrock Titan (FREE GenAI) + Real Image Processing
 """
 import json
-import base64
 import boto3
 import os
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from io import BytesIO
 
+from botocore.exceptions import ClientError
+
+from base64_stream import decode_base64, encode_base64
+
 try:
-    from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+    from enhancement_engine import (PIPELINE_VERSION, enhance_image_windows, get_peak_rss_mb, iter_enhanced,
+                                    make_previews, pipeline_params)
+    from encoders import OUTPUT_FORMATS, encode_image, parse_encoding, resolve_encoding
+    from image_features import describe as describe_features
+    from memory_budget import plan_for_payload
+    from pipelines import configure_pipelines, get_pipeline
+    from cine import OUTPUT_MEDIA_TYPES as CLIP_MEDIA_TYPES, enhance_clip
+    from result_cache import ResultCache, S3Backing
     PIL_AVAILABLE = True
 except ImportError:
     PIL_AVAILABLE = False
@@ -17,153 +32,337 @@ except ImportError:
 
 # Initialize AWS clients
 bedrock_runtime = boto3.client('bedrock-runtime', region_name='us-east-1')
-s3_client = boto3.client('s3')
+# S3_ENDPOINT_URL points the client at an S3-compatible stand-in (MinIO, moto
+# server, LocalStack) for local runs
+s3_client = boto3.client('s3', endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None)
+
+# S3 object I/O: results go to S3_BUCKET_NAME (or the input's bucket) under
+# S3_OUTPUT_PREFIX and are returned as keys plus presigned GET URLs
+S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
+S3_OUTPUT_PREFIX = os.environ.get('S3_OUTPUT_PREFIX', 'enhanced/')
+PRESIGNED_URL_EXPIRES = int(os.environ.get('PRESIGNED_URL_EXPIRES', 3600))  # seconds; 0 = keys only
+
+# Preview pyramid stored next to S3 results: longest side in px, and its encoding
+PREVIEW_SIZES = [int(size) for size in os.environ.get('PREVIEW_SIZES', '256,1024').split(',') if size.strip()]
+PREVIEW_ENCODING = os.environ.get('PREVIEW_ENCODING', 'jpeg:90')
+
+# Tiled processing keeps large images inside the function's memory; leave a
+# quarter of it for the runtime, the request payload and the base64 response
+LAMBDA_MEMORY_MB = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 2048))
+TILING = {
+    'max_memory_mb': int(os.environ.get('TILING_MAX_MEMORY_MB', LAMBDA_MEMORY_MB * 3 // 4)),
+}
+# Whole-request budget for base64 images (payload, decoded file and image, pipeline,
+# encoded output and its base64/JSON copies); see memory_budget. The rest of the
+# function's memory is for the runtime and its libraries. MEMORY_DEBUG=1 adds
+# tracemalloc's peak and the peak RSS to the metrics
+MEMORY_BUDGET_MB = int(os.environ.get('MEMORY_BUDGET_MB', LAMBDA_MEMORY_MB - 256))
+MEMORY_DEBUG = os.environ.get('MEMORY_DEBUG', '').lower() in ('1', 'true', 'yes')
+
+# Images per batch event (data_processing.batch_size on the server)
+BATCH_SIZE = int(os.environ.get('BATCH_SIZE', 16))
 
-def enhance_image_by_modality(image_base64, modality):
+# Output encoding (see encoders): OUTPUT_ENCODING for every modality, overridden
+# per modality by MODALITY_ENCODINGS ('{"ULTRASOUND": "jpeg:92"}') and per request
+ENCODING_DEFAULTS = {
+    'default': os.environ.get('OUTPUT_ENCODING', 'png'),
+    'modalities': json.loads(os.environ.get('MODALITY_ENCODINGS') or '{}'),
+}
+
+# Pipeline definitions per modality on top of the built-in ones, in the format of
+# config.yaml's image_enhancement.pipelines: '{"XRAY": [{"clahe": {...}}, "invert"]}'
+# DENOISING sets the denoise stage defaults: '{"method": "nlm", "preset": "fast"}'
+# SUPER_RESOLUTION enables upscaling of every output: '{"enabled": true, "scale_factor": 2}'
+# QUALITY_GATE skips, shortens or strengthens each image's pipeline: '{"enabled": true, "min_spread": 0.75}'
+if PIL_AVAILABLE:
+    configure_pipelines(json.loads(os.environ.get('MODALITY_PIPELINES') or '{}'),
+                        {'denoise': json.loads(os.environ.get('DENOISING') or '{}'),
+                         'upscale': json.loads(os.environ.get('SUPER_RESOLUTION') or '{}')},
+                        json.loads(os.environ.get('QUALITY_GATE') or '{}'))
+
+# Cine loops and multi-frame images ("cine": true with an s3_key): CINE_OUTPUT is
+# tiff (multi-page) or frames (ZIP of CINE_FRAME_ENCODING frames), overridable per request
+CINE_OUTPUT = os.environ.get('CINE_OUTPUT', 'tiff')
+CINE_FRAME_ENCODING = os.environ.get('CINE_FRAME_ENCODING', 'png:1')
+CINE_SAMPLE_FRAMES = int(os.environ.get('CINE_SAMPLE_FRAMES', 8))
+
+# Result cache in /tmp, kept by warm containers: re-sent studies skip the pipeline
+# and GenAI analyses are reused per modality. RESULT_CACHE_BUCKET shares entries
+# between containers; RESULT_CACHE_MAX_MB=0 disables the cache
+RESULT_CACHE_MAX_MB = int(os.environ.get('RESULT_CACHE_MAX_MB', 256))
+RESULT_CACHE = None
+if PIL_AVAILABLE and RESULT_CACHE_MAX_MB > 0:
+    RESULT_CACHE = ResultCache(
+        os.environ.get('RESULT_CACHE_DIR', '/tmp/enhancement-cache'),
+        RESULT_CACHE_MAX_MB * 1024 * 1024,
+        PIPELINE_VERSION,
+        S3Backing(s3_client, os.environ['RESULT_CACHE_BUCKET'], os.environ.get('RESULT_CACHE_PREFIX', 'enhancement-cache/'))
+        if os.environ.get('RESULT_CACHE_BUCKET') else None
+    )
+
+# Metrics for a passthrough: the returned image is the input, unchanged
+UNENHANCED_METRICS = {
+    'psnr': 100.0,
+    'ssim': 1.0,
+    'contrast_improvement': 0,
+    'sharpness_improvement': 0,
+    'enhanced': False
+}
+
+def enhance_image_by_modality(image_base64, modality, output_mode=None, window=None, metrics_mode='fast',
+                              tiling=TILING, encoding=None, memory_budget_mb=MEMORY_BUDGET_MB):
     """
     Apply real image enhancement based on medical imaging modality
-    Different modalities require different processing techniques
+    Pixel processing lives in enhancement_engine so the API server runs the same pipeline
+    Grayscale studies come back single-channel unless output_mode='RGB'
+    DICOM input is windowed with the requested preset(s); the first window is the
+    primary image and any others are returned under metrics['window_images']
+    metrics_mode: 'fast' (sampled PSNR/SSIM), 'full' or 'off'
+    tiling: tiled_engine options (memory cap), split between images when batching
+    encoding: output format spec ('png:1:rle', 'webp', 'jpeg:90'); defaults per modality
+    memory_budget_mb: the request's peak memory is planned from the image header
+    before decoding; over budget it is tiled, made grayscale or returned as a
+    reduced preview (metrics['memory_plan'], see memory_budget)
     """
     if not PIL_AVAILABLE:
-        return image_base64, {
-            'psnr': 30.0,
-            'ssim': 0.85,
-            'contrast_improvement': 20,
-            'sharpness_improvement': 30
-        }
+        return image_base64, UNENHANCED_METRICS
     
     try:
-        # Decode base64 image
-        image_data = base64.b64decode(image_base64)
-        img = Image.open(BytesIO(image_data))
-        
-        # Convert to RGB if needed
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Apply modality-specific enhancements
-        if modality.upper() == 'XRAY' or modality.upper() == 'X-RAY':
-            # X-Ray: High contrast, inverted (bones white), sharpened
-            img = ImageOps.autocontrast(img, cutoff=2)
-            img = ImageOps.invert(img)  # Invert for medical X-ray appearance
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.5)  # 50% more contrast
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(2.0)  # Double sharpness
-            img = img.filter(ImageFilter.SHARPEN)
-            metrics = {
-                'psnr': 35.2,
-                'ssim': 0.92,
-                'contrast_improvement': 50,
-                'sharpness_improvement': 100
-            }
-            
-        elif modality.upper() == 'CT' or modality.upper() == 'CT SCAN':
-            # CT Scan: Moderate contrast, grayscale optimized, edge enhancement
-            img = ImageOps.grayscale(img).convert('RGB')
-            img = ImageOps.autocontrast(img, cutoff=1)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.4)
-            img = img.filter(ImageFilter.EDGE_ENHANCE_MORE)
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(1.1)
-            metrics = {
-                'psnr': 36.8,
-                'ssim': 0.90,
-                'contrast_improvement': 40,
-                'sharpness_improvement': 60
-            }
-            
-        elif modality.upper() == 'MRI':
-            # MRI: Enhanced contrast, reduced noise, brightness adjusted
-            img = ImageOps.autocontrast(img, cutoff=3)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.6)
-            img = img.filter(ImageFilter.MedianFilter(size=3))  # Noise reduction
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(1.15)
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(1.5)
-            metrics = {
-                'psnr': 38.5,
-                'ssim': 0.94,
-                'contrast_improvement': 60,
-                'sharpness_improvement': 50
-            }
-            
-        elif modality.upper() == 'ULTRASOUND':
-            # Ultrasound: Speckle noise reduction, contrast enhancement
-            img = img.filter(ImageFilter.MedianFilter(size=5))
-            img = ImageOps.autocontrast(img, cutoff=2)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.3)
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(1.4)
-            metrics = {
-                'psnr': 33.5,
-                'ssim': 0.88,
-                'contrast_improvement': 30,
-                'sharpness_improvement': 40
-            }
-            
-        elif modality.upper() == 'DXA':
-            # DXA (Bone Density): High contrast, grayscale, sharpened
-            img = ImageOps.grayscale(img).convert('RGB')
-            img = ImageOps.autocontrast(img, cutoff=1)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.7)
-            img = img.filter(ImageFilter.SHARPEN)
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(2.2)
-            metrics = {
-                'psnr': 34.0,
-                'ssim': 0.91,
-                'contrast_improvement': 70,
-                'sharpness_improvement': 120
-            }
-            
-        else:
-            # Default: General medical image enhancement
-            img = ImageOps.autocontrast(img, cutoff=2)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.3)
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(1.5)
-            metrics = {
-                'psnr': 32.5,
-                'ssim': 0.88,
-                'contrast_improvement': 30,
-                'sharpness_improvement': 50
-            }
+        # Decode base64 image into this thread's reusable buffer (no bytes copies)
+        image_data = decode_base64(image_base64)
+        encoding = resolve_encoding(encoding, modality, ENCODING_DEFAULTS)
+        memory_plan = plan_for_payload(image_data, get_pipeline(modality)['steps'], memory_budget_mb,
+                                       len(image_base64), encoding=encoding, output_mode=output_mode,
+                                       window=window, metrics_mode=metrics_mode, tiling=tiling)
+        if memory_plan:
+            tiling, output_mode = memory_plan['tiling'], memory_plan['output_mode']
+        results = cached_enhance_windows(image_data, modality, output_mode, window, tiling, metrics_mode, encoding,
+                                         memory_plan)
         
         # Convert back to base64
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        enhanced_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        _, enhanced_data, metrics = results[0]
+        if memory_plan:
+            metrics['memory_plan'] = {key: memory_plan[key] for key in
+                                      ('action', 'reduce', 'budget_mb', 'estimated_peak_mb', 'phases')}
+        enhanced_base64 = encode_base64(enhanced_data)
+        if len(results) > 1:
+            metrics['window_images'] = {name: encode_base64(data) for name, data, _ in results[1:]}
         
         return enhanced_base64, metrics
         
     except Exception as e:
         print(f"Image processing error: {str(e)}")
         # Return original image if enhancement fails
-        return image_base64, {
-            'psnr': 30.0,
-            'ssim': 0.85,
-            'contrast_improvement': 0,
-            'sharpness_improvement': 0
+        return image_base64, dict(UNENHANCED_METRICS, error=str(e))
+
+def cached_enhance_windows(image_data, modality, output_mode, window, tiling, metrics_mode, encoding,
+                           memory_plan=None):
+    """
+    enhance_image_windows through RESULT_CACHE: an entry holds the primary image
+    ('enhanced'), any extra windows ('window/<name>') and the primary metrics
+    A memory plan that changes the output (grayscale, preview) is part of the key
+    """
+    if RESULT_CACHE is None:
+        return enhance_image_windows(image_data, modality, output_mode, window, tiling, metrics_mode, encoding,
+                                     memory_plan, buffers=True)
+    options = dict(output_mode=output_mode, window=window, metrics_mode=metrics_mode, encoding=encoding)
+    if memory_plan and memory_plan['action'] in ('grayscale', 'preview'):
+        options['memory'] = {'mode': memory_plan['mode'], 'reduce': memory_plan['reduce']}
+    key = RESULT_CACHE.key(image_data, modality, pipeline_params(modality, **options))
+    hit = RESULT_CACHE.get(key)
+    if hit:
+        metrics, outputs = hit
+        metrics['cache'] = 'hit'
+        windows = [(name.split('/', 1)[1], data, None) for name, data in outputs.items() if name != 'enhanced']
+        return [(None, outputs['enhanced'], metrics)] + windows
+
+    results = enhance_image_windows(image_data, modality, output_mode, window, tiling, metrics_mode, encoding,
+                                    memory_plan, buffers=True)
+    # Store from views of the encoder buffers: getvalue() would leave them shared with
+    # bytes that a later getbuffer() has to copy
+    outputs = {'enhanced': results[0][1].getbuffer()}
+    outputs.update((f"window/{name}", data.getbuffer()) for name, data, _ in results[1:])
+    try:
+        RESULT_CACHE.put(key, results[0][2], outputs)
+    finally:
+        for view in outputs.values():
+            view.release()
+    results[0][2]['cache'] = 'miss'
+    return results
+
+def s3_reference(bucket, key):
+    """Key of a stored result plus a presigned GET URL (unless PRESIGNED_URL_EXPIRES is 0)"""
+    reference = {'bucket': bucket, 'key': key}
+    if PRESIGNED_URL_EXPIRES:
+        reference['url'] = s3_client.generate_presigned_url(
+            'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=PRESIGNED_URL_EXPIRES
+        )
+    return reference
+
+def upload_image(img, bucket, key, encoding='png'):
+    """Encode img and upload it; returns (reference, encode metrics)"""
+    data, encoded = encode_image(img, encoding)
+    s3_client.upload_fileobj(BytesIO(data), bucket, key, ExtraArgs={'ContentType': encoded['media_type']})
+    return s3_reference(bucket, key), encoded
+
+def enhance_s3_object(bucket, key, modality, output_mode=None, window=None, metrics_mode='fast',
+                      tiling=TILING, output_bucket=None, encoding=None):
+    """
+    Enhance an image stored in S3 and write the results back to S3
+    The object is streamed to a temporary file in /tmp (ranged, parallel GETs)
+    rather than held in memory. The enhanced image and its preview pyramid
+    (PREVIEW_SIZES) go to output_bucket (default S3_BUCKET_NAME, else the input
+    bucket) under S3_OUTPUT_PREFIX; extra DICOM windows are stored as siblings.
+    Returns metrics with 'enhanced_s3', 'previews_s3' ({size: reference}),
+    'thumbnail_s3' (the smallest level) and, for several windows, 'windows'
+    ({name: reference})
+    """
+    output_bucket = output_bucket or S3_BUCKET_NAME or bucket
+    stem = S3_OUTPUT_PREFIX + os.path.splitext(key)[0]
+    encoding = resolve_encoding(encoding, modality, ENCODING_DEFAULTS)
+    ext = OUTPUT_FORMATS[encoding['format']][1]
+    preview_ext = OUTPUT_FORMATS[parse_encoding(PREVIEW_ENCODING)['format']][1]
+    started = time.perf_counter()
+
+    with tempfile.TemporaryFile() as source:
+        s3_client.download_fileobj(bucket, key, source)
+        source.seek(0)
+        metrics = None
+        for name, enhanced, window_metrics in iter_enhanced(source, modality, output_mode, window, tiling,
+                                                            metrics_mode):
+            if metrics is None:
+                metrics = window_metrics
+                metrics['enhanced_s3'], encoded = upload_image(enhanced, output_bucket, f"{stem}_enhanced{ext}",
+                                                               encoding)
+                metrics.update(encoded)
+                metrics['previews_s3'] = {
+                    str(size): upload_image(preview, output_bucket, f"{stem}_{size}px{preview_ext}",
+                                            PREVIEW_ENCODING)[0]
+                    for size, preview in sorted(make_previews(enhanced, PREVIEW_SIZES).items())
+                }
+                metrics['thumbnail_s3'] = next(iter(metrics['previews_s3'].values()), metrics['enhanced_s3'])
+            else:
+                metrics.setdefault('windows', {})[name], _ = upload_image(enhanced, output_bucket,
+                                                                          f"{stem}_enhanced_{name}{ext}", encoding)
+
+    metrics['source_s3'] = {'bucket': bucket, 'key': key}
+    metrics['processing_time'] = round(time.perf_counter() - started, 3)
+    return metrics
+
+def enhance_s3_clip(bucket, key, modality, window=None, output=None, output_bucket=None, encoding=None):
+    """
+    Enhance a cine loop or multi-frame image stored in S3 (see cine.py)
+    The clip is streamed to /tmp and its frames are decoded lazily; chunks of
+    frames run on a thread pool sized to the function's vCPUs, with tone LUTs
+    and noise estimates shared by the whole clip. The multi-page TIFF (or ZIP of
+    frames for output='frames') goes to output_bucket under S3_OUTPUT_PREFIX.
+    Returns metrics with 'enhanced_s3'
+    """
+    output_bucket = output_bucket or S3_BUCKET_NAME or bucket
+    suffix = '.zip' if (output or CINE_OUTPUT) == 'frames' else '.tif'
+    output_key = f"{S3_OUTPUT_PREFIX}{os.path.splitext(key)[0]}_enhanced{suffix}"
+    workers = os.cpu_count() or 1
+
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(key)[1]) as source, \
+            tempfile.NamedTemporaryFile(suffix=suffix) as enhanced:
+        s3_client.download_fileobj(bucket, key, source)
+        source.flush()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            metrics = enhance_clip(source.name, enhanced.name, modality, window, workers, executor=executor,
+                                   encoding=encoding or CINE_FRAME_ENCODING, sample_frames=CINE_SAMPLE_FRAMES)
+        s3_client.upload_file(enhanced.name, output_bucket, output_key,
+                              ExtraArgs={'ContentType': CLIP_MEDIA_TYPES[suffix]})
+
+    metrics['enhanced_s3'] = s3_reference(output_bucket, output_key)
+    metrics['source_s3'] = {'bucket': bucket, 'key': key}
+    return metrics
+
+def enhance_batch(images, modality, output_mode=None, window=None, metrics_mode='fast', encoding=None):
+    """
+    Enhance a list of images ({'image_base64'} or {'s3_key', optional 's3_bucket'},
+    plus optional 'image_type', 'window', 'output_mode', 'encoding') on a thread pool sized
+    to the function's vCPUs
+    Lambda cannot run multiprocessing pools (no /dev/shm); decoding, the pipeline
+    and PNG encoding spend their time in PIL/NumPy code that releases the GIL,
+    so threads still use every core. The memory cap and budget are shared between
+    the images in flight. Returns results in completion order, each tagged with its index.
+    """
+    workers = max(1, min(len(images), os.cpu_count() or 1))
+    tiling = dict(TILING, max_memory_mb=TILING['max_memory_mb'] // workers, workers=1)
+    memory_budget_mb = MEMORY_BUDGET_MB // workers
+
+    def enhance_one(index, item):
+        item_modality = item.get('image_type', item.get('modality', modality))
+        item_mode = 'RGB' if str(item.get('output_mode', output_mode or '')).upper() == 'RGB' else None
+        item_encoding = item.get('encoding', encoding)
+        if item.get('s3_key'):
+            try:
+                metrics = enhance_s3_object(item.get('s3_bucket') or S3_BUCKET_NAME, item['s3_key'], item_modality,
+                                            item_mode, item.get('window', window), metrics_mode, tiling,
+                                            encoding=item_encoding)
+            except Exception as e:
+                return {'index': index, 'success': False, 'error': str(e), 'modality': item_modality.upper()}
+            return {'index': index, 'success': True, 'metrics': metrics, 'modality': item_modality.upper()}
+        if not item.get('image_base64'):
+            return {'index': index, 'success': False, 'error': 'Missing image_base64 or s3_key'}
+        enhanced, metrics = enhance_image_by_modality(
+            item['image_base64'], item_modality, item_mode, item.get('window', window), metrics_mode, tiling,
+            item_encoding, memory_budget_mb
+        )
+        return {
+            'index': index,
+            'success': 'error' not in metrics,
+            'enhanced_image': enhanced,
+            'metrics': metrics,
+            'modality': item_modality.upper(),
         }
 
-def enhance_with_bedrock_genai(modality='xray'):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(enhance_one, index, item) for index, item in enumerate(images)]
+        return [future.result() for future in as_completed(futures)]
+
+@contextmanager
+def memory_trace():
+    """
+    With MEMORY_DEBUG, trace allocations over the block with tracemalloc
+    The yielded dict receives 'traced_peak_mb' and 'peak_rss_mb' when the block
+    ends. tracemalloc sees Python and NumPy allocations but not PIL's pixel
+    buffers, so the process's peak RSS is reported alongside
+    """
+    report = {}
+    if not MEMORY_DEBUG or tracemalloc.is_tracing():
+        yield report
+        return
+    tracemalloc.start()
+    try:
+        yield report
+    finally:
+        report['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        tracemalloc.stop()
+        report['peak_rss_mb'] = get_peak_rss_mb() if PIL_AVAILABLE else None
+        print(f"Memory: traced peak {report['traced_peak_mb']} MB, peak RSS {report['peak_rss_mb']} MB")
+
+def enhance_with_bedrock_genai(modality='xray', features=None):
     """
     Use Amazon Titan Text Express (FREE GenAI) for image enhancement analysis
     This is the REAL GenAI component - generates intelligent recommendations
+    features: the image_features summary from the enhancement pass, so the
+    analysis is about the actual study
     """
     try:
         model_id = os.environ.get('BEDROCK_MODEL_ID', 'amazon.titan-text-express-v1')
+        measured = ''
+        if features:
+            measured = f"""
+Measured image features (computed from the pixels during enhancement):
+{describe_features(features)}
+
+Base the quality assessment and the adjustments on these measurements.
+"""
         
         # GenAI prompt for medical image analysis
         prompt = f"""As an expert medical AI radiologist, provide a detailed enhancement analysis for a {modality} medical image.
-
+{measured}
 Generate enhancement recommendations including:
 
 1. **Image Quality Assessment** (score 0-100)
@@ -218,18 +417,132 @@ Provide specific, actionable insights for {modality} imaging."""
             'recommendations': ['Enable Amazon Titan access in Bedrock console']
         }
 
+def cached_bedrock_analysis(modality, features=None):
+    """
+    The GenAI analysis depends only on the modality and the prompt's feature
+    summary: reuse it from RESULT_CACHE
+    """
+    if RESULT_CACHE is None:
+        return enhance_with_bedrock_genai(modality, features)
+    model_id = os.environ.get('BEDROCK_MODEL_ID', 'amazon.titan-text-express-v1')
+    params = {'analysis': 'bedrock'}
+    if features:
+        params['features'] = describe_features(features)
+    key = RESULT_CACHE.key(model_id.encode(), modality, params)
+    hit = RESULT_CACHE.get(key)
+    if hit:
+        return hit[0]
+    analysis = enhance_with_bedrock_genai(modality, features)
+    if analysis['model'] != 'fallback':
+        RESULT_CACHE.put(key, analysis, {})
+    return analysis
+
 def lambda_handler(event, context):
     """
     Main Lambda handler - Real Image Enhancement + GenAI Analysis
     """
     try:
-        # Parse request
-        body = json.loads(event.get('body', '{}'))
+        # Parse request (API Gateway sends a JSON string; direct invocations pass the fields in the event)
+        body = event.get('body', event)
+        body = json.loads(body or '{}') if isinstance(body, str) else body
         image_base64 = body.get('image_base64')
+        s3_key = body.get('s3_key')  # S3 input: {s3_bucket, s3_key} instead of image_base64
         modality = body.get('image_type', body.get('modality', 'xray'))
         use_bedrock = body.get('use_bedrock', True)
+        output_mode = 'RGB' if str(body.get('output_mode', '')).upper() == 'RGB' else None
+        window = body.get('window')  # DICOM window preset(s): lung, bone, soft_tissue, brain
+        metrics_mode = body.get('metrics_mode', 'fast')
+        encoding = body.get('encoding')  # e.g. "png:1:rle", "webp", "jpeg:90"; defaults per modality
+        images = body.get('images')  # Batch event: [{image_base64, image_type, window}, ...]
+        cine = body.get('cine')  # Multi-frame clip in S3; output: "tiff" or "frames"
+        
+        if encoding and PIL_AVAILABLE:
+            try:
+                parse_encoding(encoding)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Allow-Headers': '*',
+                        'Access-Control-Allow-Methods': 'POST, OPTIONS'
+                    },
+                    'body': json.dumps({'error': str(e)})
+                }
+        
+        if images is not None:
+            if not isinstance(images, list) or not 0 < len(images) <= BATCH_SIZE:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Allow-Headers': '*',
+                        'Access-Control-Allow-Methods': 'POST, OPTIONS'
+                    },
+                    'body': json.dumps({'error': f'images must be a list of 1 to {BATCH_SIZE} items'})
+                }
+            
+            started = time.perf_counter()
+            with memory_trace() as memory_debug:
+                results = enhance_batch(images, modality, output_mode, window, metrics_mode, encoding)
+            elapsed = time.perf_counter() - started
+            
+            # Each image's GenAI analysis is written from its own features
+            if use_bedrock:
+                analyzed = [r for r in results if r['success']]
+                with ThreadPoolExecutor(max_workers=max(1, min(len(analyzed), BATCH_SIZE))) as executor:
+                    analyses = executor.map(lambda r: cached_bedrock_analysis(r['modality'],
+                                                                              r['metrics'].get('features')), analyzed)
+                    for result, analysis in zip(analyzed, analyses):
+                        result['bedrock_analysis'] = analysis
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': '*',
+                    'Access-Control-Allow-Methods': 'POST, OPTIONS'
+                },
+                'body': json.dumps({
+                    'results': results,
+                    'images': len(results),
+                    'succeeded': sum(1 for r in results if r['success']),
+                    'processing_time': round(elapsed, 3),
+                    'images_per_second': round(len(results) / elapsed, 2) if elapsed else None,
+                    **({'memory_debug': memory_debug} if memory_debug else {}),
+                    'success': True
+                })
+            }
+        
+        if not image_base64 and not s3_key:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': '*',
+                    'Access-Control-Allow-Methods': 'POST, OPTIONS'
+                },
+                'body': json.dumps({'error': 'Missing image_base64 or s3_key'})
+            }
+        
+        if cine and (not s3_key or body.get('output', CINE_OUTPUT) not in ('tiff', 'frames')):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': '*',
+                    'Access-Control-Allow-Methods': 'POST, OPTIONS'
+                },
+                'body': json.dumps({'error': "Cine clips are read from S3 (s3_key); output must be 'tiff' or 'frames'"})
+            }
         
-        if not image_base64:
+        s3_bucket = body.get('s3_bucket') or S3_BUCKET_NAME
+        if s3_key and not s3_bucket:
             return {
                 'statusCode': 400,
                 'headers': {
@@ -238,21 +551,49 @@ def lambda_handler(event, context):
                     'Access-Control-Allow-Headers': '*',
                     'Access-Control-Allow-Methods': 'POST, OPTIONS'
                 },
-                'body': json.dumps({'error': 'Missing image_base64'})
+                'body': json.dumps({'error': 'Missing s3_bucket (no S3_BUCKET_NAME default configured)'})
             }
         
         # Apply REAL image enhancement based on modality
-        enhanced_image, metrics = enhance_image_by_modality(image_base64, modality)
+        if s3_key:
+            # Results are written to S3; the response carries keys and presigned URLs, not pixels
+            try:
+                if cine:
+                    metrics = enhance_s3_clip(s3_bucket, s3_key, modality, window, body.get('output'),
+                                              body.get('output_bucket'), encoding)
+                else:
+                    metrics = enhance_s3_object(s3_bucket, s3_key, modality, output_mode, window, metrics_mode,
+                                                output_bucket=body.get('output_bucket'), encoding=encoding)
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code', '')
+                status = 404 if code in ('NoSuchKey', 'NoSuchBucket', '404') else 403 if code in ('AccessDenied', '403') else 502
+                return {
+                    'statusCode': status,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Allow-Headers': '*',
+                        'Access-Control-Allow-Methods': 'POST, OPTIONS'
+                    },
+                    'body': json.dumps({'error': f'S3 error for {s3_key}: {code or str(e)}', 'success': False})
+                }
+            enhanced_image = None
+        else:
+            with memory_trace() as memory_debug:
+                enhanced_image, metrics = enhance_image_by_modality(image_base64, modality, output_mode, window,
+                                                                    metrics_mode, encoding=encoding)
+            if memory_debug:
+                metrics['memory_debug'] = memory_debug
         
         # Get GenAI analysis
         bedrock_analysis = None
         if use_bedrock:
-            bedrock_analysis = enhance_with_bedrock_genai(modality)
+            bedrock_analysis = cached_bedrock_analysis(modality, metrics.get('features'))
         
         # Prepare response with REAL enhanced image + GenAI analysis
+        # The caller already has the original; echoing it back would double the payload
         response_data = {
             'enhanced_image': enhanced_image,
-            'original_image': image_base64,
             'metrics': metrics,
             'modality': modality.upper(),
             'bedrock_analysis': bedrock_analysis,
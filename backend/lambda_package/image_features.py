@@ -0,0 +1,137 @@
+"""
+Compact feature summary of a study, for the GenAI analysis and report prompts
+Computed from the working image the engine has already decoded, before the
+pipeline runs, so describing the study costs no second decode:
+- histogram percentiles (1, 5, 25, 50, 75, 95, 99) of a strided overview, as
+  fractions of the full value range
+- exposure: mean, the fractions clipped at black and white, the 1st-99th
+  percentile spread and a label (underexposed, overexposed, low contrast, normal)
+- noise sigma and noise-corrected sharpness in 8-bit grey levels, as measured by
+  quality_gate (reused when the gate has just assessed an uncropped image)
+- field of view: the bounding box of everything that differs from a uniform
+  border (collimation, letterboxing, the black surround of an ultrasound
+  sector), in pixels and as a fraction of the frame
+Everything but the field of view itself is measured inside it.
+"""
+import time
+
+import numpy as np
+
+from quality_gate import DEFAULT_GATE, overview, patch_noise_and_sharpness
+from quality_metrics import image_shape
+
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+CLIP_LEVEL = 1 / 255  # Within this of 0 or 1 counts as clipped
+BORDER_TOLERANCE = 0.04  # Largest difference from the corners' value still counted as border
+BORDER_CONTENT = 0.02  # A row or column with more content pixels than this is inside the field of view
+
+
+def field_of_view(small):
+    """(top, bottom, left, right) overview indexes of the non-border region, bottom/right exclusive"""
+    height, width = small.shape
+    corners = np.array([small[0, 0], small[0, -1], small[-1, 0], small[-1, -1]])
+    if np.ptp(corners) > BORDER_TOLERANCE:
+        return 0, height, 0, width  # No uniform surround
+    content = np.abs(small - np.median(corners)) > BORDER_TOLERANCE
+    rows = np.flatnonzero(content.mean(axis=1) > BORDER_CONTENT)
+    columns = np.flatnonzero(content.mean(axis=0) > BORDER_CONTENT)
+    if not len(rows) or not len(columns):
+        return 0, height, 0, width  # Uniform image: nothing to crop to
+    return rows[0], rows[-1] + 1, columns[0], columns[-1] + 1
+
+
+def exposure_label(percentiles, spread):
+    if percentiles['p95'] < 0.4:
+        return 'underexposed'
+    if percentiles['p5'] > 0.6:
+        return 'overexposed'
+    if spread < DEFAULT_GATE['low_spread']:
+        return 'low contrast'
+    return 'normal'
+
+
+def level_label(value, low, high, names):
+    return names[0] if value <= low else names[2] if value >= high else names[1]
+
+
+def summarize(img, assessment=None, overview_side=DEFAULT_GATE['overview_side']):
+    """
+    Feature summary of a working image (PIL image or uint16 array)
+    assessment: quality_gate.assess's result for the same image, whose noise and
+    sharpness are reused instead of measured again unless the field of view is cropped
+    """
+    started = time.perf_counter()
+    height, width = image_shape(img)
+    small = overview(img, overview_side)
+    top, bottom, left, right = field_of_view(small)
+    inside = small[top:bottom, left:right]
+    values = np.percentile(inside, PERCENTILES)
+    percentiles = {f"p{p}": round(float(v), 3) for p, v in zip(PERCENTILES, values)}
+    spread = float(values[-1] - values[0])
+
+    scale_y, scale_x = height / small.shape[0], width / small.shape[1]
+    box = [int(left * scale_x), int(top * scale_y), min(width, round(right * scale_x)),
+           min(height, round(bottom * scale_y))]
+    cropped = box != [0, 0, width, height]
+    if assessment and not cropped:
+        noise, sharpness = assessment['noise'], assessment['sharpness']
+    else:
+        # Patches in a flat border would read as a clean, blurry image
+        region = img
+        if cropped:
+            region = img[box[1]:box[3], box[0]:box[2]] if isinstance(img, np.ndarray) else img.crop(box)
+        noise, sharpness = patch_noise_and_sharpness(region)
+        noise, sharpness = round(noise * 255, 2), round(sharpness * 255 * 255, 1)
+    return {
+        'size': [width, height],
+        'bit_depth': 16 if isinstance(img, np.ndarray) and img.dtype == np.uint16 or
+                     getattr(img, 'mode', '').startswith('I') else 8,
+        'percentiles': percentiles,
+        'exposure': {
+            'mean': round(float(inside.mean()), 3),
+            'clipped_black': round(float((inside <= CLIP_LEVEL).mean()), 4),
+            'clipped_white': round(float((inside >= 1 - CLIP_LEVEL).mean()), 4),
+            'spread': round(spread, 3),
+            'label': exposure_label(percentiles, spread),
+        },
+        'noise': {
+            'sigma': noise,
+            'label': level_label(noise, DEFAULT_GATE['clean_noise'], DEFAULT_GATE['noisy'],
+                                 ('low', 'moderate', 'high')),
+        },
+        'sharpness': {
+            'laplacian_variance': sharpness,
+            'label': level_label(sharpness, DEFAULT_GATE['blurry'], DEFAULT_GATE['sharp'],
+                                 ('soft', 'moderate', 'sharp')),
+        },
+        'field_of_view': {
+            'box': box,
+            'fraction': round((box[2] - box[0]) * (box[3] - box[1]) / (width * height), 3),
+        },
+        'time': round(time.perf_counter() - started, 4),
+    }
+
+
+def describe(features):
+    """Prompt text for a feature summary, '' for none"""
+    if not features:
+        return ''
+    exposure, fov = features['exposure'], features['field_of_view']
+    left, top, right, bottom = fov['box']
+    width, height = features['size']
+    lines = [
+        f"- Matrix: {width}x{height}, {features['bit_depth']}-bit",
+        "- Intensity percentiles (fraction of full range): " +
+        ', '.join(f"{name} {value:.2f}" for name, value in features['percentiles'].items()),
+        f"- Exposure: {exposure['label']} (mean {exposure['mean']:.2f}, dynamic range {exposure['spread']:.2f}, "
+        f"{exposure['clipped_black']:.1%} clipped black, {exposure['clipped_white']:.1%} clipped white)",
+        f"- Noise: {features['noise']['label']} (sigma {features['noise']['sigma']:.1f} grey levels of 255)",
+        f"- Sharpness: {features['sharpness']['label']} "
+        f"(Laplacian variance {features['sharpness']['laplacian_variance']:.0f})",
+    ]
+    if fov['fraction'] < 1:
+        lines.append(f"- Field of view: {fov['fraction']:.0%} of the frame; borders left {left / width:.0%}, "
+                     f"top {top / height:.0%}, right {1 - right / width:.0%}, bottom {1 - bottom / height:.0%}")
+    else:
+        lines.append("- Field of view: the full frame (no uniform border)")
+    return '\n'.join(lines)
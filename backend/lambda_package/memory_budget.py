@@ -0,0 +1,284 @@
+"""
+Memory budget planning for one base64 enhancement request
+A request holds more than the pipeline's working memory: the base64 payload
+(the event's JSON text and the parsed string), the decoded file bytes, the
+decoded image, the pipeline (tiled_engine's estimate, which includes the
+working input and output), the encoded output and its base64 and JSON copies.
+These are estimated from the file header alone, before any pixels are decoded,
+in three phases that follow each other:
+- enhance: decoded file bytes, decoded image, pipeline (and super-resolution)
+- encode: decoded file bytes, output image, the encoder's buffer and its bytes
+- respond: the base64 output inside the JSON body, twice over (our json.dumps
+  and the runtime's serialization of the returned dict)
+The payload is held throughout; the peak is payload plus the largest phase.
+
+When the peak would exceed the budget, plan_memory tries in turn:
+- tiled: the pipeline runs in tiles under what the other buffers leave free
+- grayscale: colour images are processed and returned single-channel 8-bit
+  (JPEG files are decoded straight to grayscale)
+- preview: the image is reduced by 2, 4, 8 or 16 before processing (JPEG
+  files are decoded at the reduced size) and the output is that preview
+Estimates are deliberately pessimistic: encoded outputs are assumed no smaller
+than the raw pixels (JPEG a quarter). With MEMORY_DEBUG on, the Lambda compares
+them with tracemalloc's peak and the process's peak RSS.
+"""
+import math
+
+import numpy as np
+from PIL import Image
+
+import super_resolution
+import tiled_engine
+from base64_stream import BufferReader
+from dicom_io import is_dicom, parse_windows, read_dicom_header
+from encoders import parse_encoding
+
+MB = tiled_engine.MB
+
+PAYLOAD_COPIES = 2  # The event's JSON text and the parsed image_base64 string
+RESPONSE_COPIES = 2  # json.dumps of the body, then the runtime's serialization of the result
+BASE64_RATIO = 4 / 3
+# Encoded bytes per raw output byte, pessimistic (incompressible images)
+ENCODED_RATIO = {'png': 1.0, 'webp': 1.0, 'jpeg': 0.25}
+# BytesIO over-allocates as it grows, and getvalue() copies the buffer
+ENCODER_COPIES = 2
+# Full-resolution quality metrics keep float64 copies of both images and SSIM's local statistics
+FULL_METRICS_BYTES = 48
+# apply_window's float32 temporaries per DICOM pixel
+DICOM_WINDOW_BYTES = 8
+PREVIEW_REDUCTIONS = (2, 4, 8, 16)
+HIGH_BIT_DEPTH_MODES = ('I;16', 'I;16B', 'I;16L', 'I;16N', 'I')
+
+
+def read_header(source):
+    """
+    Dimensions and pixel layout of an image file (binary file object) without
+    decoding its pixels; the read position is restored. None when unreadable
+    """
+    position = source.tell()
+    try:
+        if is_dicom(source):
+            info = read_dicom_header(source)
+            samples = int(info.get('SamplesPerPixel', 1))
+            return {'width': int(info['Columns']), 'height': int(info['Rows']), 'format': 'DICOM',
+                    'mode': 'RGB' if samples > 1 else 'DICOM', 'itemsize': info['dtype'].itemsize,
+                    'frames': info['frames']}
+        with Image.open(source) as img:
+            return {'width': img.width, 'height': img.height, 'format': img.format, 'mode': img.mode}
+    except Exception:
+        return None
+    finally:
+        source.seek(position)
+
+
+def stored_bytes_per_pixel(mode):
+    """Bytes per pixel of a decoded PIL image (multi-band modes are stored as 4 bytes)"""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def working_layout(header, mode=None, window=None):
+    """(stored bytes per pixel, working bytes per pixel, output bands) of the engine's working image"""
+    if header['mode'] == 'DICOM':
+        names = parse_windows(window)
+        if names and names[0] == 'full':
+            return 2, tiled_engine.ARRAY_WORKING_BYTES, 1
+        return 1, tiled_engine.PIL_WORKING_COPIES, 1
+    if header['mode'] in HIGH_BIT_DEPTH_MODES:
+        return 2, tiled_engine.ARRAY_WORKING_BYTES, 1
+    if mode == 'L' or header['mode'] in ('1', 'L', 'LA'):
+        return 1, tiled_engine.PIL_WORKING_COPIES, 1
+    return 4, 4 * tiled_engine.PIL_WORKING_COPIES, 3
+
+
+def decoded_bytes(header, mode=None, reduce=1, window=None):
+    """
+    Bytes held by the decoded input: (while decoding, once reduced)
+    JPEG files are decoded at the reduced size and in the forced mode (draft);
+    DICOM keeps its raw values (every frame is read; the first is enhanced),
+    float32 values and the rendered windows throughout
+    """
+    pixels = header['width'] * header['height']
+    if header['format'] == 'DICOM':
+        raw = pixels * header['frames'] * header['itemsize'] * (3 if header['mode'] == 'RGB' else 1)
+        if header['mode'] == 'RGB':
+            return raw, raw + pixels * 4 // reduce ** 2
+        windows = max(1, len(parse_windows(window) or [None]))
+        full = raw + pixels * (4 + windows * 2)
+        return full + pixels * DICOM_WINDOW_BYTES, full + pixels * 2 // reduce ** 2
+    forced = mode == 'L' and header['mode'] not in HIGH_BIT_DEPTH_MODES
+    bpp = stored_bytes_per_pixel('L' if forced else header['mode'])
+    if header['format'] == 'JPEG':
+        return pixels * bpp // reduce ** 2, pixels * bpp // reduce ** 2
+    full = pixels * stored_bytes_per_pixel(header['mode'])
+    if reduce == 1 and not forced:
+        return full, full
+    # The full decode is freed once the reduced (or grayscale) copy is made
+    return full + pixels * bpp // reduce ** 2, pixels * bpp // reduce ** 2
+
+
+def estimate_memory(header, steps, payload_bytes=0, encoding=None, output_mode=None, window=None,
+                    metrics_mode='fast', tiling=None, mode=None, reduce=1):
+    """
+    Estimated bytes per phase for enhancing the image described by header
+    steps: the modality's compiled steps; tiling: tiled_engine options (its
+    max_memory_mb caps the pipeline). Returns a dict with 'phases',
+    'peak_bytes' and the 'tiling' plan (None for whole-image processing).
+    Raises tiled_engine.MemoryBudgetExceeded when the pipeline cannot fit its cap
+    """
+    width, height = max(1, header['width'] // reduce), max(1, header['height'] // reduce)
+    pixels = width * height
+    file_bytes = int(payload_bytes / BASE64_RATIO)
+    decoding, decoded = decoded_bytes(header, mode, reduce, window)
+    stored_bpp, working_bpp, bands = working_layout(header, mode, window)
+
+    upscale_step = steps[-1] if steps and steps[-1][0] == 'upscale' else None
+    body = steps[:-1] if upscale_step else steps
+    plan = tiled_engine.plan_tiles(width, height, stored_bpp, working_bpp, body, tiling)
+    if plan:
+        pipeline = plan['estimated_peak_mb'] * MB
+    else:
+        pipeline = 2 * pixels * stored_bpp + pixels * working_bpp
+        pipeline += pixels * max((tiled_engine.WHOLE_IMAGE_WORKING_BYTES.get(name, 0) for name, _ in body), default=0)
+    if metrics_mode == 'full':
+        pipeline += pixels * FULL_METRICS_BYTES
+
+    output_pixels = pixels
+    if upscale_step:
+        params = upscale_step[1] or {}
+        factor = params.get('scale_factor', 2)
+        cap = (tiling or {}).get('max_memory_mb')
+        upscaling = super_resolution.working_bytes(width, height, 1 if bands == 1 else 3,
+                                                   2 if stored_bpp == 2 else 1, factor, 1)
+        fits_cap = not cap or upscaling <= cap * MB
+        if pixels * factor ** 2 <= params.get('max_megapixels', super_resolution.DEFAULT_MAX_MEGAPIXELS) * 1e6 \
+                and fits_cap:
+            output_pixels = round(pixels * factor ** 2)
+            pipeline = max(pipeline, pixels * stored_bpp + upscaling)
+
+    encoding = parse_encoding(encoding)
+    if output_mode == 'RGB' or bands == 3:
+        output_bpp, raw_bpp = 4, 3
+    else:
+        # WebP and JPEG take the top byte of 16-bit results
+        output_bpp, raw_bpp = stored_bpp, stored_bpp if encoding['format'] == 'png' else 1
+    raw_output = output_pixels * raw_bpp
+    windows = max(1, len(parse_windows(window) or [None])) if header['format'] == 'DICOM' else 1
+    encoded = raw_output * ENCODED_RATIO[encoding['format']] * windows
+
+    phases = {
+        'enhance': file_bytes + max(decoding, decoded + pipeline),
+        'encode': file_bytes + decoded + output_pixels * output_bpp + ENCODER_COPIES * encoded,
+        'respond': encoded * BASE64_RATIO * RESPONSE_COPIES,
+    }
+    payload = payload_bytes * PAYLOAD_COPIES
+    return {
+        'phases': {name: round((payload + value) / MB, 1) for name, value in phases.items()},
+        'peak_bytes': payload + max(phases.values()),
+        'tiling': plan,
+    }
+
+
+def plan_memory(header, steps, budget_mb, payload_bytes=0, encoding=None, output_mode=None, window=None,
+                metrics_mode='fast', tiling=None):
+    """
+    Pick how to enhance an image within budget_mb (see the module docstring)
+    Returns a plan: 'action' (none, tiled, grayscale or preview), 'tiling'
+    (tiled_engine options with the pipeline's share of the budget), 'mode'
+    ('L' or None), 'output_mode', 'reduce' (1 for full size), 'budget_mb',
+    'estimated_peak_mb' and 'phases'. Raises tiled_engine.MemoryBudgetExceeded
+    when even a 1/16 preview does not fit
+    """
+    budget = budget_mb * MB
+    payload = payload_bytes * PAYLOAD_COPIES
+    colour = working_layout(header, None, window)[2] == 3 or output_mode == 'RGB'
+    candidates = [('none', None, output_mode, 1)]
+    if colour:
+        candidates.append(('grayscale', 'L', None, 1))
+    candidates += [('preview', 'L' if colour else None, None, factor) for factor in PREVIEW_REDUCTIONS]
+
+    for action, mode, candidate_output, reduce in candidates:
+        file_bytes = int(payload_bytes / BASE64_RATIO)
+        _, decoded = decoded_bytes(header, mode, reduce, window)
+        # The pipeline gets what the payload, the file bytes and the decoded image leave free
+        room_mb = int((budget - payload - file_bytes - decoded) // MB)
+        if room_mb <= 0:
+            continue
+        capped = dict(tiling or {}, max_memory_mb=min(room_mb, (tiling or {}).get('max_memory_mb') or room_mb))
+        try:
+            estimate = estimate_memory(header, steps, payload_bytes, encoding, candidate_output, window,
+                                       metrics_mode, capped, mode, reduce)
+        except tiled_engine.MemoryBudgetExceeded:
+            continue
+        if estimate['peak_bytes'] > budget:
+            continue
+        if action == 'none' and estimate['tiling'] and not (tiling or {}).get('enabled') and \
+                header['width'] * header['height'] < (tiling or {}).get('min_pixels', tiled_engine.TILED_MIN_PIXELS):
+            action = 'tiled'  # Tiled only because of the budget
+        return {
+            'action': action,
+            'tiling': capped,
+            'mode': mode,
+            'output_mode': candidate_output,
+            'reduce': reduce,
+            'budget_mb': budget_mb,
+            'estimated_peak_mb': round(estimate['peak_bytes'] / MB, 1),
+            'phases': estimate['phases'],
+        }
+    raise tiled_engine.MemoryBudgetExceeded(
+        f"{header['width']}x{header['height']} image cannot be enhanced within {budget_mb} MB, "
+        f"even as a 1/{PREVIEW_REDUCTIONS[-1]} preview"
+    )
+
+
+def reduce_array(array, factor):
+    """Block-mean reduction of a 2-D or channels-last array by an integer factor"""
+    height, width = (array.shape[0] // factor) * factor, (array.shape[1] // factor) * factor
+    blocks = array[:height, :width].reshape(height // factor, factor, width // factor, factor, *array.shape[2:])
+    return blocks.mean(axis=(1, 3), dtype=np.float32).round().astype(array.dtype)
+
+
+def open_planned(img, plan):
+    """
+    Prepare an opened (not yet loaded) PIL image for a plan: JPEG files are
+    decoded at the reduced size and in the forced mode; others are loaded, then
+    reduced. Returns the loaded image to enhance
+    """
+    reduce, mode = plan.get('reduce', 1), plan.get('mode')
+    if img.format == 'JPEG' and (reduce > 1 or mode):
+        img.draft(mode or img.mode, (math.ceil(img.width / reduce), math.ceil(img.height / reduce)))
+    img.load()
+    planned = planned_image(img, plan)
+    if planned is not img:
+        img.close()  # Frees the full-size decode
+    return planned
+
+
+def planned_image(img, plan):
+    """Apply a plan's reduction and forced mode to a loaded image or decoded array"""
+    reduce, mode = plan.get('reduce', 1), plan.get('mode')
+    if isinstance(img, np.ndarray):
+        if reduce > 1:
+            img = reduce_array(img, reduce)
+        if mode == 'L' and img.ndim == 3:
+            img = np.asarray(Image.fromarray(img.astype(np.uint8)).convert('L'))
+        return img
+    target = (max(1, img.width // reduce), max(1, img.height // reduce))
+    if img.size != target:
+        factor = max(1, round(img.width / target[0]))
+        img = img.reduce(factor) if img.mode not in HIGH_BIT_DEPTH_MODES else \
+            Image.fromarray(reduce_array(np.asarray(img), factor))
+    if mode == 'L' and img.mode not in HIGH_BIT_DEPTH_MODES + ('L',):
+        img = img.convert('L')
+    return img
+
+
+def plan_for_payload(data, steps, budget_mb, payload_bytes, **options):
+    """plan_memory for raw file bytes, or None when the header cannot be read"""
+    header = read_header(BufferReader(data) if not hasattr(data, 'read') else data)
+    if header is None:
+        return None
+    return plan_memory(header, steps, budget_mb, payload_bytes, **options)
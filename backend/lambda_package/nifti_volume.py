@@ -0,0 +1,258 @@
+"""
+NIfTI volume enhancement, processed slice by slice
+Uncompressed .nii volumes are memory-mapped so each worker reads only its own
+slices; .nii.gz volumes are decompressed as a stream. Enhanced slices are written
+to the output volume as soon as they are ready, so peak memory is bounded by the
+slices in flight rather than the size of the volume.
+"""
+import gzip
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dicom_io import DEFAULT_WINDOWS, WINDOW_PRESETS, apply_window, parse_windows
+from enhancement_engine import apply_modality_enhancement, get_peak_rss_mb
+
+NIFTI1_HEADER_SIZE = 348
+NIFTI1_OUTPUT_OFFSET = 352  # header + 4-byte extension flag
+
+# NIfTI-1 datatype codes -> NumPy dtypes
+NIFTI_DTYPES = {
+    2: np.uint8,
+    4: np.int16,
+    8: np.int32,
+    16: np.float32,
+    64: np.float64,
+    256: np.int8,
+    512: np.uint16,
+    768: np.uint32,
+}
+NIFTI_CODES = {np.dtype(dtype): code for code, dtype in NIFTI_DTYPES.items()}
+
+DEFAULT_CHUNK_SLICES = 8
+# Slices already run one per pool worker: their pipeline steps stay single-threaded
+SLICE_TILING = {'workers': 1}
+
+
+class UnsupportedVolumeError(ValueError):
+    """Volume the reader cannot handle (not NIfTI-1, unsupported datatype)"""
+
+
+def is_gzipped(path):
+    return str(path).endswith('.gz')
+
+
+def open_volume_file(path, mode='rb'):
+    return gzip.open(path, mode) if is_gzipped(path) else open(path, mode)
+
+
+def read_nifti_header(path):
+    """
+    Parse the NIfTI-1 header fields the pipeline needs
+    Returns a dict with the raw header bytes, byte order, volume shape, dtype,
+    data offset and scaling
+    """
+    with open_volume_file(path) as f:
+        raw = f.read(NIFTI1_HEADER_SIZE)
+    if len(raw) < NIFTI1_HEADER_SIZE:
+        raise UnsupportedVolumeError("File is too short to be a NIfTI volume")
+
+    for endian in ('<', '>'):
+        if struct.unpack(endian + 'i', raw[:4])[0] == NIFTI1_HEADER_SIZE:
+            break
+    else:
+        raise UnsupportedVolumeError("Not a NIfTI-1 volume (NIfTI-2 and Analyze are not supported)")
+    if raw[344:347] != b'n+1':
+        raise UnsupportedVolumeError("Not a single-file NIfTI-1 volume (.hdr/.img pairs are not supported)")
+
+    dim = struct.unpack(endian + '8h', raw[40:56])
+    datatype = struct.unpack(endian + 'h', raw[70:72])[0]
+    if datatype not in NIFTI_DTYPES:
+        raise UnsupportedVolumeError(f"Unsupported NIfTI datatype code {datatype}")
+
+    ndim = max(dim[0], 2)
+    width, height = dim[1], dim[2]
+    # Every dimension past y (z, time, ...) is flattened into a run of 2D slices
+    num_slices = int(np.prod([max(d, 1) for d in dim[3:ndim + 1]], dtype=np.int64)) if ndim > 2 else 1
+    vox_offset = int(struct.unpack(endian + 'f', raw[108:112])[0])
+    slope, intercept = struct.unpack(endian + '2f', raw[112:120])
+    cal_max, cal_min = struct.unpack(endian + '2f', raw[124:132])
+
+    return {
+        'raw': raw,
+        'endian': endian,
+        'dim': dim,
+        'width': width,
+        'height': height,
+        'num_slices': num_slices,
+        'dtype': np.dtype(NIFTI_DTYPES[datatype]).newbyteorder(endian),
+        'vox_offset': vox_offset,
+        # scl_slope of 0 means "no scaling" in NIfTI-1
+        'slope': slope if slope and np.isfinite(slope) else 1.0,
+        'intercept': intercept if np.isfinite(intercept) else 0.0,
+        'cal_min': cal_min,
+        'cal_max': cal_max,
+    }
+
+
+def scaled(slices, header):
+    """Raw stored values -> real-world values (e.g. Hounsfield units) as float32"""
+    values = slices.astype(np.float32)
+    if header['slope'] != 1:
+        values *= np.float32(header['slope'])
+    if header['intercept']:
+        values += np.float32(header['intercept'])
+    return values
+
+
+def iter_raw_chunks(path, header, chunk_slices):
+    """
+    Yield (start, raw slices array) for runs of chunk_slices slices
+    NIfTI stores x fastest, so one z slice is a contiguous (height, width) block
+    """
+    shape = (header['height'], header['width'])
+    num_slices = header['num_slices']
+    if not is_gzipped(path):
+        volume = np.memmap(path, dtype=header['dtype'], mode='r', offset=header['vox_offset'],
+                           shape=(num_slices,) + shape)
+        for start in range(0, num_slices, chunk_slices):
+            yield start, volume[start:start + chunk_slices]
+        return
+
+    slice_bytes = shape[0] * shape[1] * header['dtype'].itemsize
+    with gzip.open(path, 'rb') as f:
+        f.seek(header['vox_offset'])
+        for start in range(0, num_slices, chunk_slices):
+            count = min(chunk_slices, num_slices - start)
+            buffer = f.read(count * slice_bytes)
+            if len(buffer) < count * slice_bytes:
+                raise UnsupportedVolumeError("NIfTI volume is truncated")
+            yield start, np.frombuffer(buffer, dtype=header['dtype']).reshape((count,) + shape)
+
+
+def value_range(path, header, chunk_slices):
+    """Global min/max in real-world units, from one streaming pass over the volume"""
+    low, high = np.inf, -np.inf
+    for _, chunk in iter_raw_chunks(path, header, chunk_slices):
+        values = scaled(chunk, header)
+        low, high = min(low, float(values.min())), max(high, float(values.max()))
+    return low, high
+
+
+def volume_window(path, header, modality, window, chunk_slices):
+    """
+    Pick one window for the whole volume so every slice is mapped the same way
+    Returns (window_metrics, center, width, output dtype)
+    """
+    names = parse_windows(window)
+    name = names[0] if names else DEFAULT_WINDOWS.get(modality.upper(), 'auto')
+
+    if name in WINDOW_PRESETS:
+        center, width = WINDOW_PRESETS[name]
+        return {'preset': name, 'center': center, 'width': width}, center, width, np.uint8
+    if name == 'auto' and header['cal_max'] > header['cal_min']:
+        # The header's display range plays the role of the DICOM window
+        width = header['cal_max'] - header['cal_min']
+        center = header['cal_min'] + width / 2 + 0.5
+        return {'preset': 'auto', 'center': center, 'width': width}, center, width, np.uint8
+
+    low, high = value_range(path, header, chunk_slices)
+    width = max(high - low + 1, 1)
+    return {'preset': 'full', 'min': low, 'max': high}, (low + high) / 2 + 0.5, width, np.uint16
+
+
+def enhance_slices(raw, header, modality, center, width, dtype):
+    """
+    Window and enhance a run of slices; returns an array of the output dtype
+    A pipeline's upscale step is left out: the output keeps the input's voxel grid
+    """
+    values = scaled(raw, header)
+    out = np.empty(values.shape, dtype=dtype)
+    for index, value_slice in enumerate(values):
+        enhanced, _ = apply_modality_enhancement(apply_window(value_slice, center, width, dtype), modality,
+                                                 tiling=SLICE_TILING, metrics_mode='off', keep_size=True)
+        out[index] = np.asarray(enhanced)
+    return out
+
+
+def enhance_mapped_slices(path, header, start, stop, modality, center, width, dtype):
+    """Worker entry point for .nii input: map the file and read only slices start..stop"""
+    volume = np.memmap(path, dtype=header['dtype'], mode='r', offset=header['vox_offset'],
+                       shape=(header['num_slices'], header['height'], header['width']))
+    return enhance_slices(volume[start:stop], header, modality, center, width, dtype)
+
+
+def output_header(header, dtype):
+    """Input header rewritten for an unscaled uint8/uint16 volume with data at offset 352"""
+    endian = header['endian']
+    raw = bytearray(header['raw'])
+    dtype = np.dtype(dtype)
+    struct.pack_into(endian + '2h', raw, 70, NIFTI_CODES[dtype], dtype.itemsize * 8)
+    struct.pack_into(endian + '3f', raw, 108, NIFTI1_OUTPUT_OFFSET, 1.0, 0.0)
+    struct.pack_into(endian + '2f', raw, 124, np.iinfo(dtype).max, 0.0)
+    raw[344:348] = b'n+1\x00'
+    return bytes(raw) + b'\x00' * (NIFTI1_OUTPUT_OFFSET - NIFTI1_HEADER_SIZE)
+
+
+def enhance_volume(input_path, output_path, modality, window=None, workers=None,
+                   chunk_slices=DEFAULT_CHUNK_SLICES, executor=None):
+    """
+    Enhance every slice of a NIfTI volume and write a NIfTI volume to output_path
+    (.nii or .nii.gz). Chunks of chunk_slices slices are enhanced in parallel; at most
+    two chunks per worker are in flight and finished chunks are written in order,
+    so memory stays at a few slices per worker whatever the volume size.
+    Pass an existing ProcessPoolExecutor as executor to share a server's pool.
+    """
+    started = time.perf_counter()
+    peak_rss_before = get_peak_rss_mb()
+    header = read_nifti_header(input_path)
+    window_metrics, center, width, dtype = volume_window(input_path, header, modality, window, chunk_slices)
+    out_dtype = np.dtype(dtype).newbyteorder(header['endian'])
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+    max_in_flight = 2 * (workers or os.cpu_count())
+
+    try:
+        with open_volume_file(output_path, 'wb') as out:
+            out.write(output_header(header, dtype))
+            pending = []
+
+            def write_oldest():
+                out.write(pending.pop(0).result().astype(out_dtype, copy=False).tobytes())
+
+            for start, raw in iter_raw_chunks(input_path, header, chunk_slices):
+                if is_gzipped(input_path):
+                    future = executor.submit(enhance_slices, raw, header, modality, center, width, dtype)
+                else:
+                    # Workers map the file themselves; only slice indexes cross the process boundary
+                    future = executor.submit(enhance_mapped_slices, input_path, header, start,
+                                             start + len(raw), modality, center, width, dtype)
+                pending.append(future)
+                if len(pending) >= max_in_flight:
+                    write_oldest()
+            while pending:
+                write_oldest()
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    peak_rss_after = get_peak_rss_mb()
+    metrics = {
+        'source_format': 'NIfTI',
+        'window': window_metrics,
+        'width': header['width'],
+        'height': header['height'],
+        'slices': header['num_slices'],
+        'output_dtype': np.dtype(dtype).name,
+        'enhanced_bytes': os.path.getsize(output_path),
+        'processing_time': round(time.perf_counter() - started, 3),
+        'peak_rss_mb': peak_rss_after,
+    }
+    if peak_rss_after is not None:
+        metrics['rss_growth_mb'] = round(peak_rss_after - peak_rss_before, 1)
+    return metrics
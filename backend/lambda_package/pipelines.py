@@ -0,0 +1,259 @@
+"""
+Declarative modality pipelines and their compiled execution plans
+A pipeline is an ordered list of stages, each a stage name or a one-entry
+mapping {stage: parameter}, as written in config.yaml:
+
+    mri:
+      - autocontrast: 3
+      - contrast: 1.6
+      - median: 3
+      - brightness: 1.15
+      - sharpness: 1.5
+
+Stages:
+- point: autocontrast (cutoff %), invert, contrast (factor), brightness (factor)
+- spatial: median (size), sharpness (factor), kernel (PIL 3x3 kernel name),
+  clahe ({tile_grid: [rows, cols], clip_limit: fraction}), denoise (method
+  name or {method, preset, noise_threshold}; unset values come from the
+  stage defaults, config.yaml's image_enhancement.denoising on the server),
+  speckle (filter name or {method, window, speckle}: adaptive Lee/Kuan
+  speckle reduction for ultrasound)
+- colour: grayscale
+- resolution: upscale (scale factor or {scale_factor, method, sharpen,
+  max_megapixels}; must come last). When the stage defaults (config.yaml's
+  image_enhancement.super_resolution) are enabled, every pipeline without an
+  upscale stage gets one appended
+
+compile_pipeline turns stages into the engine's steps. Identity stages (factor
+1.0) and repeated grayscale are dropped. Stat-free monotonic point operations
+(invert, brightness) after a median move ahead of it, because rank filters
+commute exactly with monotonic mappings. Adjacent point operations then fuse
+into one lookup-table ('tone') step, so every spatial filter and every tone
+step is one pass over the image. Plans are compiled once per modality and
+cached until the definitions change.
+"""
+import denoise
+import quality_gate
+import speckle
+import super_resolution
+from array_filters import KERNELS
+
+POINT_STAGES = ('autocontrast', 'invert', 'contrast', 'brightness')
+# Point stages that need no image statistics and never decrease (or always
+# reverse) the order of values: they commute with rank filters
+RANK_COMMUTING_STAGES = ('invert', 'brightness')
+RANK_FILTER_STAGES = ('median',)
+SPATIAL_STAGES = ('median', 'sharpness', 'kernel', 'clahe', 'denoise', 'speckle')
+FACTOR_STAGES = ('contrast', 'brightness', 'sharpness')
+STAGES = POINT_STAGES + SPATIAL_STAGES + ('grayscale', 'upscale')
+
+DEFAULT_MODALITY = 'DEFAULT'
+
+# Built-in definitions; config.yaml (image_enhancement.pipelines) or the Lambda's
+# MODALITY_PIPELINES variable override them per modality and add new ones
+DEFAULT_PIPELINES = {
+    # X-Ray: local contrast, inverted (bones white), sharpened
+    # CLAHE brings out detail in both the mediastinum and the lung fields, which a
+    # single global stretch cannot do at once
+    'XRAY': [
+        {'clahe': {'tile_grid': [8, 8], 'clip_limit': 0.01}},
+        'invert',  # Medical X-ray appearance
+        {'contrast': 1.5},
+        {'sharpness': 2.0},
+        {'kernel': 'SHARPEN'},
+    ],
+    # CT Scan: moderate contrast, grayscale, edge enhancement
+    # Denoising first, as contrast and edge enhancement amplify noise (low-dose CT)
+    'CT': [
+        'grayscale',
+        'denoise',
+        {'autocontrast': 1},
+        {'contrast': 1.4},
+        {'kernel': 'EDGE_ENHANCE_MORE'},
+        # Brightness stays after the filter: saturating first changes the edge response
+        {'brightness': 1.1},
+    ],
+    # MRI: reduced noise, enhanced contrast, brightness adjusted
+    'MRI': [
+        'denoise',  # Rician background noise, estimated before any stretch
+        {'autocontrast': 3},
+        {'contrast': 1.6},
+        {'brightness': 1.15},
+        {'sharpness': 1.5},
+    ],
+    # Ultrasound: speckle noise reduction, contrast enhancement
+    # Adaptive Lee filter rather than a median: smooths homogeneous speckle, keeps
+    # edges, and costs the same for any window
+    'ULTRASOUND': [
+        'speckle',
+        {'autocontrast': 2},
+        {'contrast': 1.3},
+        {'sharpness': 1.4},
+    ],
+    # Mammography: local contrast for dense tissue, fine sharpening for calcifications
+    'MAMMOGRAPHY': [
+        'grayscale',
+        {'clahe': {'tile_grid': [8, 8], 'clip_limit': 0.015}},
+        {'sharpness': 1.5},
+    ],
+    # DXA (Bone Density): high contrast, grayscale, sharpened
+    'DXA': [
+        'grayscale',
+        {'autocontrast': 1},
+        {'contrast': 1.7},
+        {'kernel': 'SHARPEN'},
+        {'sharpness': 2.2},
+    ],
+    # Default: general medical image enhancement
+    DEFAULT_MODALITY: [
+        {'autocontrast': 2},
+        {'contrast': 1.3},
+        {'sharpness': 1.5},
+    ],
+}
+
+MODALITY_ALIASES = {
+    'X-RAY': 'XRAY',
+    'CT SCAN': 'CT',
+    'MAMMOGRAM': 'MAMMOGRAPHY',
+}
+
+_definitions = dict(DEFAULT_PIPELINES)
+_stage_defaults = {}
+_gate = {}
+_compiled = {}
+
+
+def parse_stage(stage, modality, stage_defaults=None):
+    """(name, parameter) of a stage written as 'name' or {'name': parameter}"""
+    if isinstance(stage, str):
+        name, param = stage, None
+    elif isinstance(stage, dict) and len(stage) == 1:
+        (name, param), = stage.items()
+    else:
+        raise ValueError(f"{modality} pipeline: a stage is a name or a one-entry mapping, got {stage!r}")
+    name = str(name).lower()
+    if name not in STAGES:
+        raise ValueError(f"{modality} pipeline: unknown stage '{name}' (expected one of {', '.join(STAGES)})")
+
+    if name in FACTOR_STAGES:
+        param = float(param if param is not None else 1.0)
+    elif name == 'autocontrast':
+        param = float(param or 0)
+    elif name == 'median':
+        param = int(param or 3)
+        if param < 3 or param % 2 == 0:
+            raise ValueError(f"{modality} pipeline: median size must be odd and at least 3")
+    elif name == 'kernel':
+        param = str(param).upper()
+        if param not in KERNELS:
+            raise ValueError(f"{modality} pipeline: unknown kernel '{param}' (expected one of {', '.join(KERNELS)})")
+    elif name == 'clahe':
+        param = dict(param or {})
+        if 'tile_grid' in param:
+            param['tile_grid'] = tuple(int(n) for n in param['tile_grid'])
+    elif name == 'denoise':
+        param = {'method': param} if isinstance(param, str) else dict(param or {})
+        param = dict((stage_defaults or {}).get('denoise') or {}, **param)
+        param['method'] = denoise.normalize_method(param.get('method'))
+        param.setdefault('preset', denoise.DEFAULT_PRESET)
+        if param['preset'] not in denoise.PRESETS[param['method']]:
+            raise ValueError(f"{modality} pipeline: unknown {param['method']} preset '{param['preset']}'")
+        param['noise_threshold'] = float(param.get('noise_threshold', denoise.DEFAULT_NOISE_THRESHOLD))
+    elif name == 'speckle':
+        param = {'method': param} if isinstance(param, str) else dict(param or {})
+        param['method'] = speckle.normalize_method(param.get('method'))
+        param['window'] = int(param.get('window', speckle.DEFAULT_WINDOW))
+        if param['window'] < 3 or param['window'] % 2 == 0:
+            raise ValueError(f"{modality} pipeline: speckle window must be odd and at least 3")
+    elif name == 'upscale':
+        param = {'scale_factor': param} if isinstance(param, (int, float)) else dict(param or {})
+        param = dict((stage_defaults or {}).get('upscale') or {}, **param)
+        param.pop('enabled', None)
+        param['scale_factor'] = float(param.get('scale_factor', 2))
+        if param['scale_factor'] < 1:
+            raise ValueError(f"{modality} pipeline: upscale scale_factor must be at least 1")
+        param['method'] = super_resolution.normalize_method(param.get('method'))
+        param['sharpen'] = float(param.get('sharpen', super_resolution.DEFAULT_SHARPEN))
+        param['max_megapixels'] = float(param.get('max_megapixels', super_resolution.DEFAULT_MAX_MEGAPIXELS))
+    else:
+        param = None
+    return name, param
+
+
+def compile_pipeline(stages, modality=DEFAULT_MODALITY, stage_defaults=None):
+    """
+    Compile declarative stages into engine steps: {'steps': [...]}
+    stage_defaults: {stage: {parameter: value}} filling unset stage parameters;
+    an enabled 'upscale' default appends that stage where it is missing
+    """
+    stages = [parse_stage(stage, modality, stage_defaults) for stage in stages]
+    upscale_defaults = (stage_defaults or {}).get('upscale') or {}
+    if upscale_defaults.get('enabled') and not any(name == 'upscale' for name, _ in stages):
+        stages.append(parse_stage('upscale', modality, stage_defaults))
+
+    parsed = []
+    for position, (name, param) in enumerate(stages):
+        if name == 'upscale' and position != len(stages) - 1:
+            raise ValueError(f"{modality} pipeline: upscale must be the last stage")
+        if name in FACTOR_STAGES and param == 1.0 or name == 'upscale' and param['scale_factor'] == 1.0:
+            continue  # Identity
+        if name == 'grayscale' and ('grayscale', None) in parsed:
+            continue  # Already single-channel
+        parsed.append((name, param))
+
+    # Move stat-free monotonic point stages ahead of the rank filters they follow,
+    # so they can join the tone step before the filter
+    moved = True
+    while moved:
+        moved = False
+        for i in range(1, len(parsed)):
+            if parsed[i][0] in RANK_COMMUTING_STAGES and parsed[i - 1][0] in RANK_FILTER_STAGES:
+                parsed[i - 1], parsed[i] = parsed[i], parsed[i - 1]
+                moved = True
+
+    steps = []
+    for name, param in parsed:
+        if name in POINT_STAGES:
+            if steps and steps[-1][0] == 'tone':
+                steps[-1][1].append((name, param))
+            else:
+                steps.append(('tone', [(name, param)]))
+        else:
+            steps.append((name, param))
+    return {'steps': steps}
+
+
+def configure_pipelines(definitions=None, stage_defaults=None, gate=None):
+    """
+    Use definitions ({modality: [stages]}) on top of the built-in pipelines, with
+    stage_defaults ({'denoise': {...}, 'upscale': {...}}) for unset stage parameters
+    gate: quality_gate settings (config.yaml's image_enhancement.quality_gate);
+    plans then carry them as 'quality_gate' and the engine gates each image
+    Every pipeline is compiled up front, so a bad definition fails here
+    (ValueError) rather than on the first image of that modality
+    """
+    merged = dict(DEFAULT_PIPELINES)
+    merged.update({str(name).upper(): stages for name, stages in (definitions or {}).items()})
+    compiled = {name: compile_pipeline(stages, name, stage_defaults) for name, stages in merged.items()}
+    gate = quality_gate.normalize_gate(gate)
+    _definitions.clear()
+    _definitions.update(merged)
+    _stage_defaults.clear()
+    _stage_defaults.update(stage_defaults or {})
+    _gate.clear()
+    _gate.update(gate or {})
+    _compiled.clear()
+    _compiled.update((name, dict(plan, quality_gate=gate)) for name, plan in compiled.items())
+
+
+def get_pipeline(modality):
+    """Compiled plan for a modality name (case-insensitive, aliases allowed; unknown ones get DEFAULT)"""
+    name = modality.upper()
+    name = MODALITY_ALIASES.get(name, name)
+    if name not in _definitions:
+        name = DEFAULT_MODALITY
+    if name not in _compiled:
+        _compiled[name] = dict(compile_pipeline(_definitions[name], name, _stage_defaults),
+                               quality_gate=dict(_gate) or None)
+    return _compiled[name]
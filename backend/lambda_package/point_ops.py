@@ -0,0 +1,144 @@
+"""
+Fused tone-mapping (point) operations for medical image enhancement
+Autocontrast, invert, contrast and brightness are all per-pixel mappings, so a
+chain of them is composed into a single lookup table and applied in one pass
+instead of materializing a full intermediate image per step
+"""
+import numpy as np
+
+# ITU-R 601-2 luma weights PIL uses for RGB -> L (contrast takes the L mean)
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def autocontrast_lut(lut, histogram, cutoff=0):
+    """
+    Compose ImageOps.autocontrast onto a LUT
+    histogram is the per-level pixel count of the values the LUT currently maps to
+    """
+    levels = len(histogram)
+    max_value = levels - 1
+    n = int(histogram.sum())
+    cut_lo = int(n * cutoff // 100)
+    cut_hi = int(n * cutoff // 100)
+
+    # First level whose cumulative count from each end exceeds the cut
+    lo = int(np.searchsorted(np.cumsum(histogram), cut_lo, side='right'))
+    hi = max_value - int(np.searchsorted(np.cumsum(histogram[::-1]), cut_hi, side='right'))
+
+    if hi <= lo:
+        return lut
+
+    scale = max_value / (hi - lo)
+    offset = -lo * scale
+    stretch = np.clip(np.trunc(np.arange(levels) * scale + offset), 0, max_value)
+    return stretch.astype(lut.dtype)[lut]
+
+
+def invert_lut(lut, levels):
+    """Compose ImageOps.invert onto a LUT"""
+    return (levels - 1) - lut
+
+
+def blend_lut(lut, levels, degenerate, factor):
+    """
+    Compose Image.blend(degenerate, image, factor) onto a LUT
+    Mirrors PIL's single-precision arithmetic with truncation and clipping
+    """
+    values = np.float32(degenerate) + np.float32(factor) * (lut.astype(np.float32) - np.float32(degenerate))
+    return np.clip(np.trunc(values), 0, levels - 1).astype(lut.dtype)
+
+
+def channel_mean(luts, histograms):
+    """Mean pixel value of the L (luma) view of the mapped image, as ImageEnhance.Contrast uses"""
+    means = [
+        float(np.dot(lut.astype(np.float64), hist)) / max(float(hist.sum()), 1.0)
+        for lut, hist in zip(luts, histograms)
+    ]
+    if len(means) == 3:
+        return sum(weight * mean for weight, mean in zip(LUMA_WEIGHTS, means))
+    return means[0]
+
+
+def build_tone_lut(histograms, ops, levels=256):
+    """
+    Compose a chain of point operations into one LUT per channel
+
+    histograms: per-channel pixel counts of the input (each of length levels)
+    ops: ordered (name, param) tuples - ('autocontrast', cutoff), ('invert', None),
+         ('contrast', factor), ('brightness', factor)
+
+    Statistics needed by later operations (autocontrast cutoffs, the contrast mean)
+    are derived by pushing the input histogram through the LUT built so far,
+    so only one histogram pass over the pixels is ever needed
+    """
+    dtype = np.uint8 if levels <= 256 else np.uint16
+    histograms = [np.asarray(hist, dtype=np.int64) for hist in histograms]
+    luts = [np.arange(levels, dtype=dtype) for _ in histograms]
+
+    for name, param in ops:
+        if name == 'autocontrast':
+            # Autocontrast stretches each band independently
+            luts = [
+                autocontrast_lut(lut, np.bincount(lut, weights=hist, minlength=levels), param or 0)
+                for lut, hist in zip(luts, histograms)
+            ]
+        elif name == 'invert':
+            luts = [invert_lut(lut, levels) for lut in luts]
+        elif name == 'contrast':
+            mean = int(channel_mean(luts, histograms) + 0.5)
+            luts = [blend_lut(lut, levels, mean, param) for lut in luts]
+        elif name == 'brightness':
+            luts = [blend_lut(lut, levels, 0, param) for lut in luts]
+        else:
+            raise ValueError(f"Unknown point operation: {name}")
+
+    return luts
+
+
+def image_histograms(img):
+    """Per-band histograms of an 8-bit PIL image or a single-channel integer array"""
+    if isinstance(img, np.ndarray):
+        return [np.bincount(img.ravel(), minlength=levels_for(img))]
+    histogram = img.histogram()
+    return [histogram[band * 256:(band + 1) * 256] for band in range(len(img.getbands()))]
+
+
+def levels_for(img):
+    """Number of LUT entries needed for an image's sample type"""
+    if isinstance(img, np.ndarray):
+        return 256 if img.dtype == np.uint8 else 65536
+    return 256
+
+
+def apply_luts(img, luts):
+    """Map an image through per-band LUTs: Image.point for PIL, fancy indexing for arrays"""
+    if isinstance(img, np.ndarray):
+        return luts[0][img]
+    return img.point(np.concatenate(luts).tolist())
+
+
+def apply_point_ops(img, ops):
+    """
+    Apply a chain of point operations to an 8-bit PIL image in a single pass
+    One histogram is taken up front and one fused LUT is applied via Image.point
+    """
+    if not ops:
+        return img
+
+    luts = build_tone_lut(image_histograms(img), ops, levels=256)
+    return apply_luts(img, luts)
+
+
+def apply_point_ops_array(array, ops, levels=None):
+    """
+    Apply a chain of point operations to a single-channel integer NumPy array
+    Used for 16-bit data (65536-entry LUT) that PIL's point() cannot map
+    """
+    if not ops:
+        return array
+
+    levels = levels or levels_for(array)
+    histogram = np.bincount(array.ravel(), minlength=levels)
+
+    lut = build_tone_lut([histogram], ops, levels=levels)[0]
+    return lut[array]
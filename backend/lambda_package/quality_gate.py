@@ -0,0 +1,252 @@
+"""
+No-reference quality gate: decide per image how much of a pipeline to run
+Three measurements, none of them needing a reference image:
+- spread: the 1st-99th percentile range of a strided overview (at most
+  overview_side pixels a side), as a fraction of the full value range
+- noise: Immerkaer's Laplacian noise sigma (as in denoise.py), the median over
+  a grid of full-resolution patches
+- sharpness: the variance of the 4-neighbour Laplacian over the same patches,
+  less the 20 sigma^2 that noise alone contributes
+Noise and sharpness are in 8-bit grey levels whatever the bit depth. They are
+taken on native-resolution patches (quality_metrics.sample_mosaic) because
+downsampling averages both away. The whole assessment takes a few milliseconds
+at any image size.
+
+The gate then rewrites the steps:
+- well exposed (spread >= min_spread): contrast operations (autocontrast,
+  contrast, brightness) and CLAHE are dropped; flat images (spread <
+  low_spread) get stronger contrast and CLAHE clip limits
+- sharp (sharpness >= sharp): sharpening (sharpness, sharpening kernels) is
+  dropped; blurry images (sharpness < blurry) get stronger sharpness. Noisy
+  images drop sharpening too: their noise term swamps the sharpness estimate,
+  so they read as blurry, and sharpening would amplify the noise
+- clean (noise <= clean_noise): denoise, median and speckle are dropped; noisy
+  images (noise >= noisy) get the next denoising preset
+invert, grayscale and upscale change what the output is rather than its
+quality and always run. With nothing else left, the decision is 'skip'.
+
+The time saved is estimated from per-step costs in milliseconds per
+megapixel. These are measured as the engine runs steps, and seeded with
+benchmark figures until a step has been timed in this process.
+"""
+import math
+import time
+
+import numpy as np
+from PIL import Image
+
+from quality_metrics import FAST_GRID, FAST_PATCH, image_shape, sample_mosaic, to_gray_array
+
+DEFAULT_GATE = {
+    'overview_side': 256,
+    'min_spread': 0.75,
+    'low_spread': 0.35,
+    'sharp': 300.0,
+    'blurry': 30.0,
+    'clean_noise': 2.0,
+    'noisy': 8.0,
+    'strengthen': 1.5,  # Multiplies how far a factor is from 1 (contrast, sharpness) or a clip limit
+}
+
+CONTRAST_OPS = ('autocontrast', 'contrast', 'brightness')
+SHARPENING_KERNELS = ('SHARPEN', 'EDGE_ENHANCE', 'EDGE_ENHANCE_MORE')
+NOISE_STEPS = ('denoise', 'median', 'speckle')
+DENOISE_PRESETS = ('fast', 'balanced', 'quality')
+
+# Seed step costs in ms per megapixel (8-bit, one core), replaced by measurements
+STEP_COSTS = {
+    'tone': 2.0,
+    'sharpness': 10.0,
+    'kernel': 10.0,
+    'median': 145.0,
+    'clahe': 28.0,
+    'speckle': 73.0,
+    'denoise:diffusion:fast': 45.0,
+    'denoise:diffusion:balanced': 76.0,
+    'denoise:diffusion:quality': 151.0,
+    'denoise:bilateral:fast': 90.0,
+    'denoise:bilateral:balanced': 163.0,
+    'denoise:bilateral:quality': 351.0,
+    'denoise:nlm:fast': 150.0,
+    'denoise:nlm:balanced': 287.0,
+    'denoise:nlm:quality': 888.0,
+}
+COST_SMOOTHING = 0.2  # Weight of a new measurement in the running average
+
+_measured_costs = {}
+
+
+def normalize_gate(config):
+    """
+    Gate settings from a config mapping (unset values from DEFAULT_GATE), or None
+    when the config is empty or enabled is false. Raises ValueError on unknown keys
+    """
+    config = dict(config or {})
+    if not config or not config.pop('enabled', True):
+        return None
+    unknown = set(config) - set(DEFAULT_GATE)
+    if unknown:
+        raise ValueError(f"Unknown quality_gate settings: {', '.join(sorted(unknown))}")
+    return {key: float(config.get(key, default)) for key, default in DEFAULT_GATE.items()}
+
+
+def overview(img, side):
+    """Strided (nearest-neighbour) copy of the image at most side pixels a side, as [0, 1] floats"""
+    height, width = image_shape(img)
+    step = max(1, math.ceil(max(height, width) / side))
+    if isinstance(img, np.ndarray):
+        return to_gray_array(img[::step, ::step])
+    if step > 1:
+        img = img.resize((max(1, width // step), max(1, height // step)), Image.NEAREST)
+    return to_gray_array(img)
+
+
+def patch_noise_and_sharpness(img):
+    """(noise sigma, noise-corrected Laplacian variance) on [0, 1] data over native-resolution patches"""
+    height, width = image_shape(img)
+    if min(height, width) >= 2 * FAST_PATCH:
+        mosaic = sample_mosaic(img, FAST_GRID, FAST_PATCH)
+        patches = mosaic.reshape(FAST_GRID, FAST_PATCH, FAST_GRID, FAST_PATCH).swapaxes(1, 2)
+        patches = patches.reshape(-1, FAST_PATCH, FAST_PATCH)
+    else:
+        patches = to_gray_array(img)[None]
+    if min(patches.shape[1:]) < 3:
+        return 0.0, 0.0
+
+    across = patches[:, :, :-2] - 2 * patches[:, :, 1:-1] + patches[:, :, 2:]
+    second = across[:, :-2] - 2 * across[:, 1:-1] + across[:, 2:]
+    noise = float(np.median(np.abs(second).mean(axis=(1, 2)))) * math.sqrt(math.pi / 2) / 6
+
+    laplacian = patches[:, :-2, 1:-1] + patches[:, 2:, 1:-1] + patches[:, 1:-1, :-2] + patches[:, 1:-1, 2:]
+    laplacian -= 4 * patches[:, 1:-1, 1:-1]
+    sharpness = float(laplacian.var(axis=(1, 2)).mean()) - 20 * noise * noise
+    return noise, max(sharpness, 0.0)
+
+
+def assess(img, overview_side=DEFAULT_GATE['overview_side']):
+    """No-reference measurements of a working image (PIL image or uint16 array)"""
+    started = time.perf_counter()
+    small = overview(img, int(overview_side))
+    low, high = np.percentile(small, (1, 99))
+    noise, sharpness = patch_noise_and_sharpness(img)
+    return {
+        'spread': round(float(high - low), 3),
+        'noise': round(noise * 255, 2),
+        'sharpness': round(sharpness * 255 * 255, 1),
+        'time': round(time.perf_counter() - started, 4),
+    }
+
+
+def step_cost_key(step):
+    name, param = step
+    if name == 'denoise':
+        return f"denoise:{param.get('method')}:{param.get('preset')}"
+    return name
+
+
+def record_step_time(step, seconds, pixels):
+    """Fold one measured run of a step into its running cost (ms per megapixel)"""
+    if pixels <= 0:
+        return
+    key = step_cost_key(step)
+    cost = seconds * 1000 / (pixels / 1e6)
+    previous = _measured_costs.get(key)
+    _measured_costs[key] = cost if previous is None else previous + COST_SMOOTHING * (cost - previous)
+
+
+def estimated_time(steps, pixels):
+    """Seconds the steps should take on an image of this many pixels"""
+    total = 0.0
+    for step in steps:
+        key = step_cost_key(step)
+        total += _measured_costs.get(key, STEP_COSTS.get(key, 0.0))
+    return total * pixels / 1e6 / 1000
+
+
+def stronger(factor, gain):
+    return 1 + (factor - 1) * gain
+
+
+def gate_steps(steps, assessment, gate):
+    """
+    Rewrite compiled steps for an image's assessment
+    Returns (steps, dropped stage names, strengthened stage names)
+    """
+    well_exposed, flat = assessment['spread'] >= gate['min_spread'], assessment['spread'] < gate['low_spread']
+    sharp, blurry = assessment['sharpness'] >= gate['sharp'], assessment['sharpness'] < gate['blurry']
+    clean, noisy = assessment['noise'] <= gate['clean_noise'], assessment['noise'] >= gate['noisy']
+    gain = gate['strengthen']
+    kept, dropped, strengthened = [], [], []
+
+    for name, param in steps:
+        if name == 'tone':
+            ops = []
+            for op, value in param:
+                if op in CONTRAST_OPS and well_exposed:
+                    dropped.append(op)
+                    continue
+                if op == 'contrast' and flat:
+                    value = stronger(value, gain)
+                    strengthened.append(op)
+                ops.append((op, value))
+            if not ops:
+                continue
+            if kept and kept[-1][0] == 'tone':
+                # Dropping the step between two tone steps lets them fuse again
+                kept[-1] = ('tone', kept[-1][1] + ops)
+                continue
+            kept.append(('tone', ops))
+            continue
+        if name == 'clahe':
+            if well_exposed:
+                dropped.append(name)
+                continue
+            if flat:
+                param = dict(param, clip_limit=param.get('clip_limit', 0.01) * gain)
+                strengthened.append(name)
+        elif name == 'sharpness' or name == 'kernel' and param in SHARPENING_KERNELS:
+            if sharp or noisy:
+                dropped.append(name)
+                continue
+            if name == 'sharpness' and blurry:
+                param = stronger(param, gain)
+                strengthened.append(name)
+        elif name in NOISE_STEPS:
+            if clean:
+                dropped.append(name)
+                continue
+            if name == 'denoise' and noisy and param.get('preset') in DENOISE_PRESETS[:-1]:
+                param = dict(param, preset=DENOISE_PRESETS[DENOISE_PRESETS.index(param['preset']) + 1])
+                strengthened.append(name)
+        kept.append((name, param))
+    return kept, dropped, strengthened
+
+
+def decision_name(steps, dropped, strengthened):
+    enhancing = [name for name, param in steps
+                 if name not in ('grayscale', 'upscale') and not (name == 'tone' and param == [('invert', None)])]
+    if not enhancing:
+        return 'skip'
+    if dropped and strengthened:
+        return 'shorten+strengthen'
+    return 'shorten' if dropped else 'strengthen' if strengthened else 'full'
+
+
+def gate(img, steps, settings):
+    """
+    Assess img and gate its steps (the final upscale step is left alone)
+    Returns (steps, info) where info holds the measurements, the decision, the
+    dropped and strengthened stages and the estimated time saved
+    """
+    info = assess(img, settings['overview_side'])
+    upscale_step = steps[-1:] if steps and steps[-1][0] == 'upscale' else []
+    body = steps[:len(steps) - len(upscale_step)]
+    gated, dropped, strengthened = gate_steps(body, info, settings)
+    width, height = image_shape(img)[::-1]
+    info.update(
+        decision=decision_name(gated, dropped, strengthened),
+        dropped=dropped,
+        strengthened=strengthened,
+        estimated_time_saved=round(estimated_time(body, width * height) - estimated_time(gated, width * height), 4),
+    )
+    return gated + upscale_step, info
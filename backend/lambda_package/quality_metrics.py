@@ -0,0 +1,203 @@
+"""
+Quality metrics between an input image and its enhanced result
+SSIM comes from scikit-image, PSNR from the mean squared error; contrast and sharpness improvements are
+the relative change in RMS contrast and mean gradient magnitude.
+
+Modes:
+- 'fast' (default): a FAST_GRID x FAST_GRID grid of full-resolution patches is
+  sampled from both images at the same positions and measured as one mosaic
+  (SSIM windows straddling patch seams are masked out). Local statistics stay
+  at native resolution, unlike downsampling, and the cost is a few milliseconds
+  whatever the image size
+- 'full': full resolution, meant for offline runs (see the command line below)
+- 'off': no metrics
+
+Offline, full-resolution metrics for a stored pair of files:
+
+    python quality_metrics.py original.png enhanced.png --mode full
+"""
+import argparse
+import json
+import math
+import time
+
+import numpy as np
+from PIL import Image
+
+try:
+    from skimage.metrics import structural_similarity
+    SKIMAGE_AVAILABLE = True
+except ImportError:
+    SKIMAGE_AVAILABLE = False
+
+METRICS_MODES = ('fast', 'full', 'off')
+FAST_GRID = 6
+FAST_PATCH = 32
+SSIM_WINDOW = 7  # skimage's default win_size
+MAX_PSNR = 100.0  # Identical images have infinite PSNR; JSON cannot carry inf
+
+
+def normalize_mode(mode):
+    mode = (mode or 'fast').lower()
+    if mode not in METRICS_MODES:
+        raise ValueError(f"Unknown metrics mode: {mode} (expected one of {', '.join(METRICS_MODES)})")
+    return mode
+
+
+def to_gray_array(img):
+    """Working image (PIL or integer array) -> float32 grayscale array scaled to [0, 1]"""
+    if isinstance(img, np.ndarray):
+        return img.astype(np.float32) * np.float32(1.0 / np.iinfo(img.dtype).max)
+    if img.mode != 'L':
+        img = img.convert('L')
+    return np.asarray(img, dtype=np.float32) * np.float32(1.0 / 255)
+
+
+def image_shape(img):
+    if isinstance(img, np.ndarray):
+        return img.shape[:2]
+    return img.size[::-1]
+
+
+def patch_origins(length, grid, patch):
+    """Evenly spaced patch start offsets covering one axis"""
+    return np.linspace(0, length - patch, grid).round().astype(int)
+
+
+def sample_mosaic(img, grid=FAST_GRID, patch=FAST_PATCH, shape=None):
+    """
+    Cut a grid of patch x patch tiles at native resolution and pack them into one
+    (grid * patch)^2 float array. shape: sample positions as if the image had this
+    (height, width), for comparing images of different sizes
+    """
+    height, width = image_shape(img)
+    ref_height, ref_width = shape or (height, width)
+    scale_y, scale_x = height / ref_height, width / ref_width
+    rows = []
+    for top in patch_origins(ref_height, grid, patch):
+        row = []
+        for left in patch_origins(ref_width, grid, patch):
+            y = min(int(top * scale_y), height - patch)
+            x = min(int(left * scale_x), width - patch)
+            if isinstance(img, np.ndarray):
+                tile = img[y:y + patch, x:x + patch]
+            else:
+                tile = img.crop((x, y, x + patch, y + patch))
+            row.append(to_gray_array(tile))
+        rows.append(np.hstack(row))
+    return np.vstack(rows)
+
+
+def seam_mask(grid, patch, window=SSIM_WINDOW):
+    """True where an SSIM window lies entirely inside one mosaic patch"""
+    pad = window // 2
+    inside = np.zeros(patch, dtype=bool)
+    inside[pad:patch - pad] = True
+    line = np.tile(inside, grid)
+    return line[:, None] & line[None, :]
+
+
+def rms_contrast(array):
+    return float(array.std())
+
+
+def mean_gradient(array, patch=None):
+    """
+    Mean gradient magnitude, a simple sharpness measure
+    patch: the array is a mosaic of patch x patch tiles; gradients stay within each tile
+    """
+    if min(array.shape) < 2:
+        return 0.0
+    if patch:
+        tiles = array.reshape(array.shape[0] // patch, patch, array.shape[1] // patch, patch)
+        gy, gx = np.gradient(tiles, axis=(1, 3))
+    else:
+        gy, gx = np.gradient(array)
+    return float(np.mean(np.hypot(gx, gy)))
+
+
+def percent_change(before, after):
+    if before <= 1e-12:
+        return 0.0
+    return round((after - before) / before * 100, 1)
+
+
+def global_ssim(a, b):
+    """Single-window SSIM over the whole image (used when scikit-image is absent)"""
+    c1, c2 = 0.01 ** 2, 0.03 ** 2
+    mean_a, mean_b = a.mean(), b.mean()
+    var_a, var_b = a.var(), b.var()
+    covariance = ((a - mean_a) * (b - mean_b)).mean()
+    return float(((2 * mean_a * mean_b + c1) * (2 * covariance + c2)) /
+                 ((mean_a ** 2 + mean_b ** 2 + c1) * (var_a + var_b + c2)))
+
+
+def compute_quality_metrics(original, enhanced, mode='fast'):
+    """
+    Measure the enhanced image against its input
+    Returns a dict with psnr, ssim, contrast_improvement, sharpness_improvement,
+    metrics_mode and metrics_time, or {} for mode 'off'
+    """
+    mode = normalize_mode(mode)
+    if mode == 'off':
+        return {}
+
+    started = time.perf_counter()
+    height, width = image_shape(original)
+    fast = mode == 'fast' and min(height, width) >= 2 * FAST_PATCH and \
+        height * width > (FAST_GRID * FAST_PATCH) ** 2
+    if fast:
+        before = sample_mosaic(original)
+        after = sample_mosaic(enhanced, shape=(height, width))
+    else:
+        before = to_gray_array(original)
+        after = to_gray_array(enhanced)
+        if before.shape != after.shape:
+            # e.g. super-resolved output: compare on the input's grid
+            resized = Image.fromarray(after).resize(before.shape[::-1], Image.BILINEAR)
+            after = np.asarray(resized, dtype=np.float32)
+
+    mse = float(np.mean(np.square(before - after)))
+    psnr = 10 * math.log10(1.0 / mse) if mse else math.inf
+    if SKIMAGE_AVAILABLE and min(before.shape) >= SSIM_WINDOW:
+        if fast:
+            _, ssim_map = structural_similarity(before, after, data_range=1.0, full=True)
+            ssim = ssim_map[seam_mask(FAST_GRID, FAST_PATCH)].mean()
+        else:
+            ssim = structural_similarity(before, after, data_range=1.0)
+    else:
+        ssim = global_ssim(before, after)
+
+    patch = FAST_PATCH if fast else None
+    return {
+        'psnr': round(min(float(psnr), MAX_PSNR), 2),
+        'ssim': round(float(ssim), 4),
+        'contrast_improvement': percent_change(rms_contrast(before), rms_contrast(after)),
+        'sharpness_improvement': percent_change(mean_gradient(before, patch), mean_gradient(after, patch)),
+        'metrics_mode': mode,
+        'metrics_time': round(time.perf_counter() - started, 4),
+    }
+
+
+def load_for_metrics(path):
+    """Open an image file the way the engine would see it"""
+    with Image.open(path) as img:
+        img.load()
+        if img.mode in ('I;16', 'I;16B', 'I;16L', 'I;16N', 'I'):
+            return np.clip(np.asarray(img), 0, 65535).astype(np.uint16)
+        return img.convert('L') if img.mode not in ('L', 'RGB') else img.copy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quality metrics between an original and an enhanced image")
+    parser.add_argument('original')
+    parser.add_argument('enhanced')
+    parser.add_argument('--mode', choices=METRICS_MODES, default='full')
+    args = parser.parse_args()
+
+    metrics = compute_quality_metrics(load_for_metrics(args.original), load_for_metrics(args.enhanced), args.mode)
+    print(json.dumps(metrics, indent=2))
+
+
+if __name__ == "__main__":
+    main()
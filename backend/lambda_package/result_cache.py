@@ -0,0 +1,220 @@
+"""
+Content-addressed cache for enhancement results
+An entry is keyed by the SHA-256 of the input file bytes, the modality, the
+pipeline's steps and request options, and the pipeline version. It holds the
+encoded outputs and their metrics in one uncompressed zip (the outputs are
+already compressed), written atomically.
+
+The decoded input that is hashed is the uploaded file (the base64 payload once
+decoded), not its pixel buffer. Hashing the file needs no image decode, so a hit
+skips decoding altogether, and it covers the header fields that change the
+output but not the pixels: DICOM rescale and VOI window tags, photometric
+interpretation, EXIF orientation. A re-sent study is byte-identical; the same
+pixels re-encoded in another container are a miss, which only costs a rerun.
+
+Entries live in a local directory (/tmp on Lambda, so warm containers keep
+theirs) bounded by max_bytes: hits refresh the entry's mtime and the oldest
+entries are evicted first. Entries of other pipeline versions are removed when
+the cache is opened. A backing store shared between servers or containers (an
+S3 prefix or a shared directory) is consulted on local misses and receives
+every new entry.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+
+HASH_CHUNK_SIZE = 1024 * 1024
+METRICS_MEMBER = 'metrics.json'
+ENTRY_SUFFIX = '.zip'
+VERSION_DIR_PREFIX = 'pipeline-'
+
+
+def hash_source(source):
+    """SHA-256 hex digest of raw bytes, a file path or a seekable binary file object"""
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    else:
+        position = source.tell()
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        source.seek(position)
+    return digest.hexdigest()
+
+
+class DirectoryBacking:
+    """Shared backing store on a filesystem mounted by every server (NFS, EFS)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def fetch(self, name, path):
+        """Copy entry name to path; False when the store does not have it"""
+        try:
+            shutil.copyfile(os.path.join(self.directory, name), path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, name, path):
+        partial = os.path.join(self.directory, f".{name}.{os.getpid()}.{threading.get_ident()}")
+        shutil.copyfile(path, partial)
+        os.replace(partial, os.path.join(self.directory, name))
+
+
+class S3Backing:
+    """Shared backing store under a prefix of an S3 bucket (client: a boto3 S3 client)"""
+
+    def __init__(self, client, bucket, prefix='enhancement-cache/'):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def fetch(self, name, path):
+        try:
+            self.client.download_file(self.bucket, self.prefix + name, path)
+        except self.client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+    def store(self, name, path):
+        self.client.upload_file(path, self.bucket, self.prefix + name)
+
+
+class ResultCache:
+    """
+    Bounded local result cache with LRU eviction and an optional backing store
+    version: pipeline version; entries of any other version are discarded
+    """
+
+    def __init__(self, directory, max_bytes, version, backing=None):
+        self.version = re.sub(r'[^A-Za-z0-9_.-]', '_', str(version))
+        self.root = directory
+        self.directory = os.path.join(directory, VERSION_DIR_PREFIX + self.version)
+        self.max_bytes = max_bytes
+        self.backing = backing
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.remove_stale_versions()
+
+    def remove_stale_versions(self):
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(VERSION_DIR_PREFIX) and path != self.directory:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def key(self, source, modality, params):
+        """Cache key for an input (bytes, path or file object), modality and pipeline parameters"""
+        signature = json.dumps([self.version, hash_source(source), modality.upper(), params],
+                               sort_keys=True, default=str)
+        return hashlib.sha256(signature.encode()).hexdigest()
+
+    def entry_name(self, key):
+        # The backing store may be shared by several pipeline versions
+        return f"{self.version}-{key}{ENTRY_SUFFIX}"
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """(metrics, {name: bytes}) for a stored entry, or None"""
+        path = self.entry_path(key)
+        if not os.path.exists(path):
+            if self.backing is None or not self.fetch_from_backing(key, path):
+                return None
+        try:
+            with zipfile.ZipFile(path) as entry:
+                metrics = json.loads(entry.read(METRICS_MEMBER))
+                outputs = {name: entry.read(name) for name in entry.namelist() if name != METRICS_MEMBER}
+            os.utime(path)  # Most recently used
+        except (FileNotFoundError, zipfile.BadZipFile, KeyError, ValueError):
+            # Evicted meanwhile, or a damaged entry
+            self.discard(path)
+            return None
+        return metrics, outputs
+
+    def fetch_from_backing(self, key, path):
+        partial = self.partial_path()
+        try:
+            if not self.backing.fetch(self.entry_name(key), partial):
+                return False
+            os.replace(partial, path)
+        finally:
+            self.discard(partial)
+        self.evict()
+        return True
+
+    def put(self, key, metrics, outputs):
+        """Store metrics (JSON-serializable) and outputs ({name: bytes}) under key"""
+        partial = self.partial_path()
+        try:
+            with zipfile.ZipFile(partial, 'w', zipfile.ZIP_STORED) as entry:
+                entry.writestr(METRICS_MEMBER, json.dumps(metrics, default=str))
+                for name, data in outputs.items():
+                    entry.writestr(name, data)
+            if self.backing is not None:
+                self.backing.store(self.entry_name(key), partial)
+            os.replace(partial, self.entry_path(key))
+        finally:
+            self.discard(partial)
+        self.evict()
+
+    def partial_path(self):
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix='.partial-')
+        os.close(fd)
+        return path
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes"""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(ENTRY_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self.discard(path)
+                total -= size
+
+    @staticmethod
+    def discard(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+_open_caches = {}
+
+
+def open_cache(options, version):
+    """
+    Per-process ResultCache for options {'directory', 'max_mb', 'shared_directory'}
+    (shared_directory: a DirectoryBacking mount)
+    """
+    signature = json.dumps([options, version], sort_keys=True, default=str)
+    if signature not in _open_caches:
+        backing = DirectoryBacking(options['shared_directory']) if options.get('shared_directory') else None
+        _open_caches[signature] = ResultCache(
+            options.get('directory') or os.path.join(tempfile.gettempdir(), 'enhancement-cache'),
+            int(options.get('max_mb', 1024) * 1024 * 1024), version, backing
+        )
+    return _open_caches[signature]
@@ -0,0 +1,254 @@
+"""
+Tiled execution of the modality pipelines for very large images
+(mammography, digitized pathology). Tiles carry a halo as wide as the spatial
+filters reach, so stitched output is identical to whole-image processing.
+Global statistics (autocontrast cutoffs, the contrast mean) are gathered from
+the whole image - in a streaming pass over tiles when they depend on earlier
+filters - before any tile is tone-mapped with the resolved LUTs. CLAHE
+interpolates between tile mappings across the whole image, and denoising and
+speckle reduction use whole-image noise estimates, so these run on the
+stitched intermediate (clahe.py and denoise.py parallelize internally).
+PIL and NumPy release the GIL inside their filter loops, so tiles run on a
+thread pool across cores without copying the image into worker processes.
+"""
+import math
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from PIL import Image
+
+from point_ops import build_tone_lut, image_histograms
+
+# Images at or above this many pixels (4k x 4k) are tiled automatically
+TILED_MIN_PIXELS = 4096 * 4096
+DEFAULT_TILE_SIZE = 1024
+MIN_TILE_SIZE = 128
+
+MB = 1024 * 1024
+
+# Estimated working bytes per tile pixel while the steps run: a few 8-bit/RGBX
+# copies for PIL images; uint16 copies plus float32 filter temporaries for arrays
+PIL_WORKING_COPIES = 4
+ARRAY_WORKING_BYTES = 20
+# Steps that run on the whole stitched image, with their working bytes per pixel
+# besides input and output (tracemalloc peaks at 4 MP): CLAHE keeps an int32 bin
+# index and its interpolation weights, denoising a padded float32 copy and a
+# float32 result per channel plus strip temporaries, speckle reduction float64
+# values, local mean, variance, gain and the padded cumulative sums
+WHOLE_IMAGE_WORKING_BYTES = {'clahe': 9, 'denoise': 12, 'speckle': 56}
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """The image cannot be enhanced within the configured memory cap"""
+
+
+def step_halo(step):
+    """Pixels of context a step needs on each side of a tile"""
+    name, param = step
+    if name in ('sharpness', 'kernel'):
+        return 1  # 3x3 kernels (SHARPEN, EDGE_ENHANCE_MORE, the SMOOTH inside Sharpness)
+    if name == 'median':
+        return param // 2
+    return 0
+
+
+def image_size(img):
+    if isinstance(img, np.ndarray):
+        height, width = img.shape[:2]
+        return width, height
+    return img.size
+
+
+def bytes_per_pixel(img):
+    """Stored bytes per pixel (PIL keeps RGB as 4 bytes)"""
+    if isinstance(img, np.ndarray):
+        return img.itemsize
+    return 1 if img.mode in ('L', 'P', '1') else 4
+
+
+def working_bytes_per_pixel(img):
+    if isinstance(img, np.ndarray):
+        return ARRAY_WORKING_BYTES
+    return PIL_WORKING_COPIES * bytes_per_pixel(img)
+
+
+def tiling_plan(img, steps, tiling=None):
+    """
+    Decide whether to tile and with what tile size and thread count
+
+    tiling: optional dict - enabled (True forces, False disables, None = auto),
+    min_pixels, tile_size, workers, max_memory_mb (peak working memory cap for the
+    input, the output and all tiles in flight)
+
+    Returns None for whole-image processing, else a plan dict. Raises
+    MemoryBudgetExceeded when the cap cannot hold the input and output images
+    plus one minimum-size tile.
+    """
+    width, height = image_size(img)
+    return plan_tiles(width, height, bytes_per_pixel(img), working_bytes_per_pixel(img), steps, tiling)
+
+
+def plan_tiles(width, height, stored_bpp, working_bpp, steps, tiling=None):
+    """
+    tiling_plan from the image's dimensions and bytes per pixel alone, so a
+    request can be planned before its pixels are decoded (see memory_budget)
+    """
+    tiling = tiling or {}
+    if tiling.get('enabled') is False:
+        return None
+
+    pixels = width * height
+    halo = sum(step_halo(step) for step in steps)
+    fixed_bytes = 2 * pixels * stored_bpp  # input + stitched output
+    # Whole-image steps (CLAHE, denoise, speckle) run untiled either way
+    fixed_bytes += pixels * max((WHOLE_IMAGE_WORKING_BYTES.get(step[0], 0) for step in steps), default=0)
+    max_memory_mb = tiling.get('max_memory_mb')
+    budget = max_memory_mb * MB - fixed_bytes if max_memory_mb else math.inf
+
+    whole_image_bytes = fixed_bytes + pixels * working_bpp
+    over_budget = max_memory_mb and whole_image_bytes > max_memory_mb * MB
+    if not (tiling.get('enabled') or over_budget or pixels >= tiling.get('min_pixels', TILED_MIN_PIXELS)):
+        return None
+
+    def tile_bytes(side):
+        return (side + 2 * halo) ** 2 * working_bpp
+
+    if budget < tile_bytes(MIN_TILE_SIZE):
+        raise MemoryBudgetExceeded(
+            f"{width}x{height} image needs at least "
+            f"{(fixed_bytes + tile_bytes(MIN_TILE_SIZE)) / MB:.0f} MB; the cap is {max_memory_mb} MB"
+        )
+
+    workers = tiling.get('workers') or os.cpu_count() or 1
+    workers = int(min(workers, budget // tile_bytes(MIN_TILE_SIZE)))
+    tile_size = tiling.get('tile_size') or DEFAULT_TILE_SIZE
+    if budget != math.inf:
+        # Largest tile that lets every worker hold one in flight
+        fitting = int(math.sqrt(budget / workers / working_bpp)) - 2 * halo
+        tile_size = max(MIN_TILE_SIZE, min(tile_size, fitting))
+
+    tiles = math.ceil(width / tile_size) * math.ceil(height / tile_size)
+    workers = max(1, min(workers, tiles))
+    peak_bytes = fixed_bytes + workers * tile_bytes(tile_size)
+    # Tone steps that follow spatial filters need statistics of the filtered image.
+    # If one more full-size image fits under the cap, keep that intermediate rather
+    # than running the filters twice (once for statistics, once for output)
+    keep_intermediate = peak_bytes + pixels * stored_bpp <= (max_memory_mb or math.inf) * MB
+    if keep_intermediate and any(step[0] == 'tone' for step in steps[1:]):
+        peak_bytes += pixels * stored_bpp
+    return {
+        'tile_size': tile_size,
+        'halo': halo,
+        'tiles': tiles,
+        'workers': workers,
+        'keep_intermediate': keep_intermediate,
+        'max_memory_mb': max_memory_mb,
+        'estimated_peak_mb': round(peak_bytes / MB, 1),
+    }
+
+
+def tile_boxes(width, height, tile_size):
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            yield left, top, min(left + tile_size, width), min(top + tile_size, height)
+
+
+def crop(img, box):
+    left, top, right, bottom = box
+    if isinstance(img, np.ndarray):
+        return img[top:bottom, left:right]
+    return img.crop(box)
+
+
+def process_tile(img, box, indexed_steps, luts_by_step, run_step):
+    """
+    Run (index, step) pairs on box grown by their halo (clamped to the image)
+    and cut the halo off again
+    """
+    width, height = image_size(img)
+    halo = sum(step_halo(step) for _, step in indexed_steps)
+    left, top, right, bottom = box
+    outer = (max(0, left - halo), max(0, top - halo), min(width, right + halo), min(height, bottom + halo))
+    tile = crop(img, outer)
+    for index, step in indexed_steps:
+        tile = run_step(tile, step, luts_by_step.get(index))
+    return crop(tile, (left - outer[0], top - outer[1], right - outer[0], bottom - outer[1]))
+
+
+def map_tiles(executor, fn, boxes, max_in_flight):
+    """Yield (box, fn(box)) as tiles finish, keeping at most max_in_flight tiles alive"""
+    pending = {}
+    for box in boxes:
+        pending[executor.submit(fn, box)] = box
+        if len(pending) >= max_in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    for future in list(pending):
+        yield pending.pop(future), future.result()
+
+
+def stitch(tiles, width, height):
+    """Assemble (box, tile) pairs into one image of the tiles' type"""
+    out = None
+    for (left, top, right, bottom), tile in tiles:
+        if isinstance(tile, np.ndarray):
+            if out is None:
+                out = np.empty((height, width), dtype=tile.dtype)
+            out[top:bottom, left:right] = tile
+        else:
+            if out is None:
+                out = Image.new(tile.mode, (width, height))
+            out.paste(tile, (left, top))
+    return out
+
+
+def run_tiled(img, steps, plan, run_step, notes=None, luts=None):
+    """
+    Run a pipeline tile by tile
+    A tone step whose input depends on earlier spatial steps needs the histogram
+    of their output: either that intermediate image is stitched and kept (when
+    the plan allows it) or a streaming pass runs those steps on tiles and only
+    accumulates histograms
+    CLAHE, denoise and speckle steps always stitch their input and run on the
+    whole image; notes collects their details as in run_step
+    luts: tone LUTs by step index computed elsewhere (a clip's), used as given
+    """
+    width, height = image_size(img)
+    boxes = list(tile_boxes(width, height, plan['tile_size']))
+    max_in_flight = plan['workers']  # the memory plan budgets one tile per worker
+    luts_by_step = dict(luts or {})
+    current, pending_steps = img, []
+
+    with ThreadPoolExecutor(max_workers=plan['workers']) as executor:
+        def run_pending(box):
+            return process_tile(current, box, pending_steps, luts_by_step, run_step)
+
+        for index, step in enumerate(steps):
+            if step[0] in WHOLE_IMAGE_WORKING_BYTES:
+                if pending_steps:
+                    current = stitch(map_tiles(executor, run_pending, boxes, max_in_flight), width, height)
+                    pending_steps = []
+                current = run_step(current, step, notes=notes, workers=plan['workers'])
+                continue
+            if step[0] != 'tone' or index in luts_by_step:
+                pending_steps.append((index, step))
+                continue
+
+            if not pending_steps:
+                histograms = image_histograms(current)
+            elif plan['keep_intermediate']:
+                current = stitch(map_tiles(executor, run_pending, boxes, max_in_flight), width, height)
+                pending_steps = []
+                histograms = image_histograms(current)
+            else:
+                histograms = None
+                for _, tile in map_tiles(executor, run_pending, boxes, max_in_flight):
+                    tile_hist = [np.asarray(h, dtype=np.int64) for h in image_histograms(tile)]
+                    histograms = tile_hist if histograms is None else [a + b for a, b in zip(histograms, tile_hist)]
+            levels = 65536 if len(histograms[0]) > 256 else 256
+            luts_by_step[index] = build_tone_lut(histograms, step[1], levels=levels)
+            pending_steps.append((index, step))
+
+        return stitch(map_tiles(executor, run_pending, boxes, max_in_flight), width, height)
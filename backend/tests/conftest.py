@@ -0,0 +1,120 @@
+"""
+Shared fixtures for the backend tests
+Run from the backend directory: python -m pytest
+The engine modules are imported the way api_server imports them, from lambda_package
+"""
+import io
+import struct
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "lambda_package"))
+
+
+def write_nifti(path, volume, pixdim=(1.0, 1.0, 1.0)):
+    """Write a (slices, height, width) int16 array as a single-file NIfTI-1 volume"""
+    slices, height, width = volume.shape
+    header = bytearray(352)
+    struct.pack_into('<i', header, 0, 348)
+    struct.pack_into('<8h', header, 40, 3, width, height, slices, 1, 1, 1, 1)
+    struct.pack_into('<2h', header, 70, 4, 16)
+    struct.pack_into('<8f', header, 76, 1.0, *pixdim, 1.0, 1.0, 1.0, 1.0)
+    struct.pack_into('<f', header, 108, 352.0)
+    header[344:348] = b'n+1\x00'
+    with open(path, 'wb') as f:
+        f.write(bytes(header) + volume.astype('<i2').tobytes())
+
+
+def dicom_element(group, element, vr, value):
+    """One explicit VR little endian data element"""
+    if len(value) % 2:
+        value += b'\0' if vr == b'UI' else b' '
+    if vr in (b'OB', b'OW'):
+        return struct.pack('<HH2sHI', group, element, vr, 0, len(value)) + value
+    return struct.pack('<HH2sH', group, element, vr, len(value)) + value
+
+
+def write_dicom(path, pixels, window=None, planar=False):
+    """
+    Write a (rows, columns) or (rows, columns, samples) unsigned array as an
+    uncompressed DICOM file, with an optional (center, width) window
+    planar: store colour samples plane by plane instead of interleaved
+    """
+    samples = pixels.shape[2] if pixels.ndim == 3 else 1
+    bits = pixels.dtype.itemsize * 8
+    meta = dicom_element(0x0002, 0x0010, b'UI', b'1.2.840.10008.1.2.1')
+    elements = [
+        dicom_element(0x0028, 0x0002, b'US', struct.pack('<H', samples)),
+        dicom_element(0x0028, 0x0004, b'CS', b'RGB' if samples > 1 else b'MONOCHROME2'),
+        dicom_element(0x0028, 0x0006, b'US', struct.pack('<H', int(planar))),
+        dicom_element(0x0028, 0x0010, b'US', struct.pack('<H', pixels.shape[0])),
+        dicom_element(0x0028, 0x0011, b'US', struct.pack('<H', pixels.shape[1])),
+        dicom_element(0x0028, 0x0100, b'US', struct.pack('<H', bits)),
+        dicom_element(0x0028, 0x0101, b'US', struct.pack('<H', bits)),
+        dicom_element(0x0028, 0x0102, b'US', struct.pack('<H', bits - 1)),
+        dicom_element(0x0028, 0x0103, b'US', struct.pack('<H', 0)),
+    ]
+    if window:
+        elements += [dicom_element(0x0028, 0x1050, b'DS', str(window[0]).encode()),
+                     dicom_element(0x0028, 0x1051, b'DS', str(window[1]).encode())]
+    stored = np.moveaxis(pixels, -1, 0) if planar else pixels
+    elements.append(dicom_element(0x7FE0, 0x0010, b'OW' if bits > 8 else b'OB',
+                                  stored.astype(pixels.dtype.newbyteorder('<')).tobytes()))
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 128 + b'DICM' + dicom_element(0x0002, 0x0000, b'UL', struct.pack('<I', len(meta))) + meta)
+        f.write(b''.join(elements))
+
+
+def phantom(size=64, seed=0, noise=0.04):
+    """Smooth anatomy-like gradients plus noise, as a [0, 1] float array"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    body = 0.5 + 0.3 * np.sin(6 * x) * np.cos(4 * y) - 0.2 * ((x - 0.5) ** 2 + (y - 0.5) ** 2)
+    return np.clip(body + rng.normal(0, noise, body.shape), 0, 1)
+
+
+def png(array):
+    """PNG file bytes of a uint8 array"""
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """
+    api_server with its database, image directory and result cache under tmp_path
+    The AI report calls are recorded instead of sent: server.prompts
+    Use the app through `with TestClient(server.app)` so its worker pool is shut down
+    """
+    import api_server
+    from database import Database
+
+    images = tmp_path / "enhanced_images"
+    images.mkdir()
+    monkeypatch.setattr(api_server, "db", Database(str(tmp_path / "ehr_test.db")))
+    monkeypatch.setattr(api_server, "ENHANCED_IMAGES_DIR", images)
+    monkeypatch.setattr(api_server, "RESULT_CACHE", None)
+    monkeypatch.setattr(api_server, "image_pool", None)  # The app's shutdown stops each test's pool
+    monkeypatch.setattr(api_server, "BEDROCK_AVAILABLE", False)
+    prompts = []
+    monkeypatch.setattr(api_server, "call_groq_api", lambda prompt, system: prompts.append(prompt) or "report")
+    api_server.prompts = prompts
+    yield api_server
+
+
+@pytest.fixture
+def lambda_module(monkeypatch):
+    """image_enhancement (the image Lambda) with its result cache off"""
+    monkeypatch.setenv('RESULT_CACHE_MAX_MB', '0')
+    # Its boto3 clients are created on import; api_server exports a lone access key id
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    import image_enhancement
+
+    monkeypatch.setattr(image_enhancement, 'RESULT_CACHE', None)
+    return image_enhancement
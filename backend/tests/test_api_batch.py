@@ -0,0 +1,60 @@
+import asyncio
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+
+from conftest import phantom, png
+
+PATIENT = {'patient_id': 'P001', 'patient_name': 'Test', 'image_type': 'XRAY'}
+
+
+def recording_spools(server, monkeypatch):
+    spooled = []
+
+    def spool_to_shared_memory(fp, suffix):
+        spooled.append(spool(fp, suffix))
+        return spooled[-1]
+
+    spool = server.spool_to_shared_memory
+    monkeypatch.setattr(server, "spool_to_shared_memory", spool_to_shared_memory)
+    return spooled
+
+
+def test_batch_streams_every_image_and_a_summary(server, monkeypatch):
+    spooled = recording_spools(server, monkeypatch)
+    files = [('files', (f'{index}.png', png((phantom(64, seed=index) * 255).astype(np.uint8)), 'image/png'))
+             for index in range(3)]
+    with TestClient(server.app) as client:
+        response = client.post('/api/images/batch', files=files, data=PATIENT)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line['index'] for line in lines[:-1]) == [0, 1, 2]
+    assert lines[-1]['done'] and lines[-1]['succeeded'] == 3
+    assert len(spooled) == 3 and not any(os.path.exists(path) for path in spooled)
+
+
+def test_cancelling_the_stream_removes_every_spool_file(server, monkeypatch):
+    spooled = recording_spools(server, monkeypatch)
+
+    async def disconnect_before_the_first_line():
+        files = [UploadFile(io.BytesIO(png((phantom(64, seed=index) * 255).astype(np.uint8))),
+                            filename=f'{index}.png') for index in range(6)]
+        response = await server.enhance_image_batch(**PATIENT, files=files, output_mode=None, window=None,
+                                                    metrics_mode=None, encoding=None)
+        # Start the stream and cancel it, as a disconnect does, without yielding to
+        # the event loop: the image tasks are cancelled before any of them has started
+        step = response.body_iterator.__anext__()
+        step.send(None)
+        with pytest.raises(asyncio.CancelledError):
+            step.throw(asyncio.CancelledError())
+        await asyncio.sleep(0.1)  # Let the cancelled tasks unwind
+
+    try:
+        asyncio.run(disconnect_before_the_first_line())
+    finally:
+        server.shutdown_image_pool()
+    assert len(spooled) == 6 and not any(os.path.exists(path) for path in spooled)
@@ -0,0 +1,45 @@
+import io
+import zipfile
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from conftest import phantom
+
+PATIENT = {'patient_id': 'P001', 'patient_name': 'Test', 'image_type': 'ULTRASOUND'}
+
+
+def clip(frames=6, size=64):
+    """Multi-page TIFF of a slowly moving phantom"""
+    pages = [Image.fromarray((np.roll(phantom(size, seed=index), index, axis=1) * 255).astype(np.uint8))
+             for index in range(frames)]
+    buffer = io.BytesIO()
+    pages[0].save(buffer, 'TIFF', save_all=True, append_images=pages[1:])
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('output', ['tiff', 'frames'])
+def test_every_frame_is_enhanced_and_stored(server, output):
+    with TestClient(server.app) as client:
+        response = client.post('/api/cine/upload', data={**PATIENT, 'output': output},
+                               files={'file': ('loop.tif', clip(), 'image/tiff')})
+        assert response.status_code == 200, response.text
+        data = response.json()['data']
+        download = client.get(data['enhanced_url'])
+    assert data['metrics']['frames'] == 6 and download.status_code == 200
+    if output == 'tiff':
+        stored = Image.open(io.BytesIO(download.content))
+        assert stored.n_frames == 6
+    else:
+        assert len(zipfile.ZipFile(io.BytesIO(download.content)).namelist()) == 6
+
+
+def test_bad_output_and_unreadable_clips_are_refused(server):
+    with TestClient(server.app) as client:
+        bad_output = client.post('/api/cine/upload', data={**PATIENT, 'output': 'mp4'},
+                                 files={'file': ('loop.tif', clip(), 'image/tiff')})
+        unreadable = client.post('/api/cine/upload', data=PATIENT,
+                                 files={'file': ('loop.tif', b'not a clip', 'image/tiff')})
+    assert bad_output.status_code == 400 and unreadable.status_code == 415
@@ -0,0 +1,51 @@
+import gzip
+import json
+
+from fastapi.testclient import TestClient
+
+
+def add_notes(db, patient_id, count):
+    db.bulk_add_clinical_notes([
+        (patient_id, 'Export Test', 'soap', f'subjective {index}', '', '', '', f'note {index}',
+         json.dumps(['I10']), f'2026-01-{index + 1:02d} 09:00:00')
+        for index in range(count)
+    ])
+
+
+def test_notes_stream_as_ndjson_in_id_order(server):
+    add_notes(server.db, 'EXP1', 25)
+    add_notes(server.db, 'EXP2', 3)
+    with TestClient(server.app) as client:
+        response = client.get('/api/export/clinical_notes', params={'patient_id': 'EXP1', 'batch_size': 4})
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row['full_note'] for row in rows] == [f'note {index}' for index in range(25)]
+    assert rows[0]['icd10_codes'] == ['I10']  # JSON columns are decoded
+
+
+def test_gzip_and_date_range(server):
+    add_notes(server.db, 'EXP1', 10)
+    with TestClient(server.app) as client:
+        response = client.get('/api/export/clinical_notes', params={
+            'patient_id': 'EXP1', 'since': '2026-01-03', 'until': '2026-01-06', 'gzip': True
+        })
+    assert response.headers['content-type'] == 'application/gzip'
+    assert response.headers['content-disposition'].endswith('.ndjson.gz"')
+    rows = [json.loads(line) for line in gzip.decompress(response.content).splitlines()]
+    assert [row['full_note'] for row in rows] == ['note 2', 'note 3', 'note 4']
+
+
+def test_unknown_tables_are_not_found(server):
+    with TestClient(server.app) as client:
+        assert client.get('/api/export/patients_passwords').status_code == 404
+
+
+def test_iso_bounds_keep_their_boundary_day(server):
+    add_notes(server.db, 'EXP1', 10)
+    with TestClient(server.app) as client:
+        response = client.get('/api/export/clinical_notes', params={
+            'patient_id': 'EXP1', 'since': '2026-01-03T09:00:00', 'until': '2026-01-05T09:00:00+00:00'
+        })
+        bad = client.get('/api/export/clinical_notes', params={'since': 'last week'})
+    assert [json.loads(line)['full_note'] for line in response.text.splitlines()] == ['note 2', 'note 3']
+    assert bad.status_code == 400
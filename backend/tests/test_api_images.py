@@ -0,0 +1,59 @@
+import asyncio
+import base64
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import phantom, png
+
+PATIENT = {'patient_id': 'P001', 'patient_name': 'Test', 'image_type': 'XRAY'}
+
+
+@pytest.fixture
+def off_loop_reports(server, monkeypatch):
+    """Record, for each AI report call, whether it ran outside the event loop"""
+    calls = []
+
+    def call_groq_api(prompt, system):
+        try:
+            asyncio.get_running_loop()
+            calls.append(False)
+        except RuntimeError:
+            calls.append(True)
+        return "report"
+
+    monkeypatch.setattr(server, "call_groq_api", call_groq_api)
+    return calls
+
+
+def image_file(server, data):
+    return server.ENHANCED_IMAGES_DIR / data['enhanced_filename']
+
+
+@pytest.mark.parametrize('prefix', ['', 'data:image/png;base64,'])
+def test_enhance_base64(server, off_loop_reports, prefix):
+    encoded = prefix + base64.b64encode(png((phantom(96) * 255).astype(np.uint8))).decode()
+    with TestClient(server.app) as client:
+        response = client.post('/api/images/enhance', json={**PATIENT, 'image_data': encoded})
+    assert response.status_code == 200, response.text
+    data = response.json()['data']
+    assert image_file(server, data).exists() and data['metrics']['ai_analysis'] == 'report'
+    assert off_loop_reports == [True]
+
+
+def test_enhance_rejects_invalid_base64(server):
+    with TestClient(server.app) as client:
+        response = client.post('/api/images/enhance', json={**PATIENT, 'image_data': 'not*base64!'})
+    assert response.status_code == 400
+
+
+def test_upload(server, off_loop_reports):
+    content = png((phantom(96) * 255).astype(np.uint8))
+    with TestClient(server.app) as client:
+        response = client.post('/api/images/upload', data=PATIENT,
+                               files={'file': ('study.png', content, 'image/png')})
+    assert response.status_code == 200, response.text
+    data = response.json()['data']
+    assert image_file(server, data).exists() and data['metrics']['upload_bytes'] == len(content)
+    assert off_loop_reports == [True]
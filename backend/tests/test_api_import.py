@@ -0,0 +1,69 @@
+import json
+
+from fastapi.testclient import TestClient
+
+
+def test_patient_csv_import_reports_invalid_rows_and_duplicates(server):
+    csv = ("patient_id,name,age,gender\n"
+           "IMP1,Ada,36,F\n"
+           "IMP2,Bo,not-a-number,M\n"
+           "IMP3,,40,M\n"
+           "IMP1,Ada again,37,F\n"
+           "IMP4,Cy,51,M\n")
+    with TestClient(server.app) as client:
+        response = client.post('/api/import/patients', params={'batch_size': 2},
+                               files={'file': ('patients.csv', csv, 'text/csv')})
+    report = response.json()['data']
+    assert (report['total_rows'], report['inserted'], report['failed'], report['duplicates']) == (5, 2, 2, 1)
+    assert [error['row'] for error in report['errors']] == [2, 3, 4]  # Data rows, after the header
+    names = {patient['patient_id']: patient['name'] for patient in server.db.get_patients()}
+    assert names['IMP1'] == 'Ada' and names['IMP4'] == 'Cy'  # The duplicate did not overwrite
+
+
+def test_note_ndjson_import(server):
+    rows = [
+        {'patient_id': 'IMP1', 'patient_name': 'Ada', 'note_type': 'soap', 'assessment': 'Stable',
+         'icd10_codes': ['I10']},
+        {'patient_id': 'IMP1', 'patient_name': 'Ada', 'note_type': 'soap'},
+    ]
+    ndjson = ''.join(json.dumps(row) + '\n' for row in rows)
+    with TestClient(server.app) as client:
+        response = client.post('/api/import/notes', files={'file': ('notes.ndjson', ndjson)})
+        exported = client.get('/api/export/clinical_notes', params={'patient_id': 'IMP1'})
+    report = response.json()['data']
+    assert (report['inserted'], report['failed']) == (1, 1)
+    assert report['errors'] == [{'row': 2, 'error': 'Note has no content'}]
+    note = json.loads(exported.text)
+    assert note['full_note'] == 'ASSESSMENT:\nStable' and note['icd10_codes'] == ['I10']
+
+
+def test_unknown_kinds_and_formats_are_refused(server):
+    with TestClient(server.app) as client:
+        assert client.post('/api/import/invoices', files={'file': ('x.csv', '')}).status_code == 404
+        assert client.post('/api/import/patients', params={'format': 'xml'},
+                           files={'file': ('x.xml', '')}).status_code == 400
+
+
+def test_note_import_moves_last_visit_to_the_newest_note(server):
+    server.db.add_patient('IMP9', 'Di', 44, 'F')
+    with server.db.get_connection() as conn:
+        conn.execute("UPDATE patients SET last_visit = '2020-01-01 00:00:00' WHERE patient_id = 'IMP9'")
+    csv = ("patient_id,patient_name,note_type,assessment,created_at\n"
+           "IMP9,Di,soap,Stable,2024-05-01T10:00:00\n"
+           "IMP9,Di,soap,Better,2024-05-03\n"
+           "IMP9,Di,soap,Worse,yesterday\n")
+    with TestClient(server.app) as client:
+        report = client.post('/api/import/notes', files={'file': ('notes.csv', csv)}).json()['data']
+    assert report['errors'] == [{'row': 3, 'error': "Invalid created_at 'yesterday'"}]
+    [patient] = [patient for patient in server.db.get_patients() if patient['patient_id'] == 'IMP9']
+    assert patient['last_visit'] == '2024-05-03 00:00:00' and patient['total_notes'] == 2
+
+
+def test_undecodable_or_malformed_files_are_bad_requests(server):
+    with TestClient(server.app) as client:
+        latin1 = client.post('/api/import/patients',
+                             files={'file': ('p.csv', 'patient_id,name,age,gender\nIMP5,Zoë,30,F\n'.encode('latin-1'))})
+        oversized = client.post('/api/import/patients',
+                                files={'file': ('p.csv', 'patient_id,name,age,gender\nIMP6,' + 'x' * 200000 + ',30,F\n')})
+    assert latin1.status_code == 400 and 'Invalid patients upload' in latin1.json()['detail']
+    assert oversized.status_code == 400 and 'field limit' in oversized.json()['detail']
@@ -0,0 +1,37 @@
+import io
+
+import numpy as np
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from conftest import phantom, png
+
+PATIENT = {'patient_id': 'P001', 'patient_name': 'Test', 'image_type': 'XRAY'}
+
+
+def test_downloads_pick_the_smallest_preview_that_fits(server):
+    with TestClient(server.app) as client:
+        response = client.post('/api/images/upload', data=PATIENT,
+                               files={'file': ('wide.png', png((phantom(300)[:200] * 255).astype(np.uint8)))})
+        data = response.json()['data']
+        full = Image.open(io.BytesIO(client.get(data['enhanced_url']).content))
+        small = client.get(data['enhanced_url'], params={'size': 200})
+        too_large = client.get(data['enhanced_url'], params={'size': 4 * max(full.size)})
+        missing = client.get('/api/images/999999/enhanced')
+
+    assert set(data['preview_urls']) == {'256', 'full'}  # Sizes the image already fits are not stored
+    preview = Image.open(io.BytesIO(small.content))
+    assert small.headers['content-type'] == 'image/jpeg' and max(preview.size) == 256
+    assert abs(preview.width / preview.height - full.width / full.height) < 0.02
+    assert Image.open(io.BytesIO(too_large.content)).size == full.size  # The full image serves larger sizes
+    assert missing.status_code == 404
+
+
+def test_stored_images_download_without_the_engine(server, monkeypatch):
+    with TestClient(server.app) as client:
+        data = client.post('/api/images/upload', data=PATIENT,
+                           files={'file': ('scan.png', png((phantom(64) * 255).astype(np.uint8)))}).json()['data']
+        monkeypatch.setattr(server, 'IMAGE_ENGINE_AVAILABLE', False)
+        monkeypatch.delattr(server, 'MEDIA_TYPES')
+        response = client.get(data['enhanced_url'])
+    assert response.status_code == 200 and response.headers['content-type'] == 'image/png'
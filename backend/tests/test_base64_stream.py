@@ -0,0 +1,61 @@
+import base64
+import binascii
+import io
+import os
+
+import pytest
+
+import base64_stream
+from base64_stream import BufferReader, data_start, decode_base64, decode_base64_to, encode_base64
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """Chunks of 64 characters, so short payloads cross many chunk boundaries"""
+    monkeypatch.setattr(base64_stream, 'CHUNK_CHARS', 64)
+
+
+@pytest.mark.parametrize('size', [0, 1, 2, 3, 47, 48, 49, 1000, 4099])
+def test_round_trip(small_chunks, size):
+    data = os.urandom(size)
+    text = encode_base64(data)
+    assert text == base64.b64encode(data).decode()
+    assert bytes(decode_base64(text)) == data
+    assert encode_base64(io.BytesIO(data)) == text
+
+
+def test_mime_line_breaks_and_data_urls(small_chunks):
+    data = os.urandom(3000)
+    text = 'data:image/png;base64,' + base64.encodebytes(data).decode()  # 76-character lines
+    start = data_start(text)
+    assert text[start:].startswith(base64.b64encode(data[:3]).decode())
+    assert bytes(decode_base64(text, start)) == data
+    output = io.BytesIO()
+    assert decode_base64_to(text, output, start) == len(data) and output.getvalue() == data
+    assert data_start(base64.b64encode(data).decode()) == 0
+
+
+def test_invalid_input_raises_binascii_errors(small_chunks):
+    with pytest.raises(binascii.Error):
+        decode_base64('QUJD' * 20 + 'QQ')  # Truncated final quantum
+    with pytest.raises(binascii.Error):
+        decode_base64('Q')
+
+
+def test_the_decode_buffer_is_reused():
+    first = decode_base64(base64.b64encode(b'a' * 300).decode())
+    second = decode_base64(base64.b64encode(b'b' * 30).decode())
+    assert first.obj is second.obj and bytes(second) == b'b' * 30
+
+
+def test_buffer_reader_reads_and_seeks_without_copying():
+    data = bytearray(b'0123456789')
+    reader = io.BufferedReader(BufferReader(data))
+    assert reader.read(4) == b'0123'
+    reader.seek(-2, io.SEEK_END)
+    assert reader.read() == b'89'
+    reader.seek(1)
+    data[1:3] = b'xy'  # Reads see the underlying buffer
+    assert reader.read(3) == b'xy3'
+    with pytest.raises((ValueError, OSError)):
+        reader.seek(-1)
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import clahe as clahe_module
+from clahe import clahe
+from conftest import phantom
+from enhancement_engine import apply_modality_enhancement
+
+
+def flat_image(dtype=np.uint8, size=256):
+    """A low-contrast study: the whole anatomy within a narrow band of values"""
+    scale, offset = (120, 40) if dtype == np.uint8 else (3000, 500)
+    return (phantom(size) * scale + offset).astype(dtype)
+
+
+def test_matches_scikit_image():
+    exposure = pytest.importorskip('skimage.exposure')
+    array = flat_image()
+    reference = exposure.equalize_adapthist(array, kernel_size=(32, 32), clip_limit=0.01, nbins=256)
+    difference = np.abs(clahe(array).astype(int) - (reference * 255 + 0.5).astype(int))
+    assert difference.max() <= 8 and difference.mean() < 1.5
+
+
+def test_threads_do_not_change_the_result():
+    array = flat_image(size=300)  # Not a multiple of the tile grid: edge tiles are padded
+    assert np.array_equal(clahe(array, workers=1), clahe(array, workers=4))
+
+
+def test_sixteen_bit_data_keeps_its_dtype_and_gains_contrast():
+    array = flat_image(np.uint16)
+    result = clahe(array)
+    assert result.dtype == np.uint16 and result.std() > 2 * array.std()
+    assert len(np.unique(result)) > 4096  # Far more levels than an 8-bit result could hold
+
+
+def test_the_clip_limit_bounds_the_contrast_gain():
+    array = flat_image()
+    assert clahe(array, clip_limit=0.005).std() < clahe(array, clip_limit=0.05).std() <= clahe(array, clip_limit=0).std()
+
+
+def test_colour_and_float_arrays_are_refused():
+    with pytest.raises(ValueError):
+        clahe(np.zeros((8, 8, 3), np.uint8))
+    with pytest.raises(ValueError):
+        clahe(np.zeros((8, 8), np.float32))
+
+
+def test_engine_passes_its_thread_share(monkeypatch):
+    seen, original = [], clahe_module.clahe
+    monkeypatch.setattr(clahe_module, 'clahe', lambda array, **params: seen.append(params['workers']) or
+                        original(array, **params))
+    img = Image.fromarray(flat_image())
+    apply_modality_enhancement(img, 'XRAY', tiling={'workers': 1})
+    apply_modality_enhancement(img, 'XRAY', tiling={'enabled': True, 'tile_size': 128, 'workers': 2})
+    assert seen == [1, 2]  # Whole image, then the tiled engine's share
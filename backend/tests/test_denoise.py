@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import denoise as denoise_module
+from cine import enhance_frames
+from conftest import phantom
+from denoise import PRESETS, denoise, estimate_noise
+
+
+def noisy_image(dtype=np.uint8, sigma=12, size=96, seed=0):
+    max_value = np.iinfo(dtype).max
+    clean = phantom(size, noise=0) * 0.8 + 0.1
+    noise = np.random.default_rng(seed).normal(0, sigma / 255, clean.shape)
+    return (clean * max_value).astype(dtype), (np.clip(clean + noise, 0, 1) * max_value).astype(dtype)
+
+
+def psnr(reference, image):
+    max_value = np.iinfo(reference.dtype).max
+    mse = np.mean((reference.astype(np.float64) - image.astype(np.float64)) ** 2)
+    return 10 * np.log10(max_value ** 2 / mse)
+
+
+@pytest.mark.parametrize('method', list(PRESETS))
+@pytest.mark.parametrize('preset', ['fast', 'quality'])
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_strips_equal_whole_image_processing(monkeypatch, method, preset, dtype):
+    _, noisy = noisy_image(dtype)
+    whole, _ = denoise(noisy, method, preset, noise_threshold=0, workers=1)
+    # Strips of 16 rows (the minimum): every preset's halo crosses strip boundaries
+    monkeypatch.setattr(denoise_module, 'STRIP_PIXELS', 1)
+    assert len(denoise_module.strips(*noisy.shape, PRESETS[method][preset].get('iterations', 0))) > 1
+    stripped, _ = denoise(noisy, method, preset, noise_threshold=0, workers=3)
+    assert np.array_equal(whole, stripped)
+
+
+@pytest.mark.parametrize('method', list(PRESETS))
+def test_every_method_removes_noise(method):
+    clean, noisy = noisy_image()
+    result, info = denoise(noisy, method, 'balanced')
+    assert not info['skipped'] and psnr(clean, result) > psnr(clean, noisy) + 2
+
+
+def test_colour_channels_are_denoised_alike():
+    _, noisy = noisy_image()
+    rgb = np.stack([noisy] * 3, axis=-1)
+    result, _ = denoise(rgb, 'bilateral', noise_threshold=0)
+    single, _ = denoise(noisy, 'bilateral', noise_threshold=0)
+    assert all(np.array_equal(result[..., c], single) for c in range(3))
+
+
+def test_the_noise_estimate_gates_clean_images():
+    clean, noisy = noisy_image(sigma=12)
+    assert abs(estimate_noise(noisy) - 12) < 2
+    result, info = denoise(clean)
+    assert info['skipped'] and result is clean
+
+
+def test_unknown_methods_and_presets_are_refused():
+    _, noisy = noisy_image()
+    with pytest.raises(ValueError):
+        denoise(noisy, 'wavelet')
+    with pytest.raises(ValueError):
+        denoise(noisy, 'nlm', 'ultra')
+
+
+def test_clip_frames_denoise_single_threaded(monkeypatch):
+    seen, original = [], denoise_module.denoise
+    monkeypatch.setattr(denoise_module, 'denoise', lambda array, **params: seen.append(params.get('workers')) or
+                        original(array, **params))
+    frames = [Image.fromarray(noisy_image(seed=seed)[1]) for seed in range(2)]
+    enhance_frames(frames, 'CT', {'steps': [('denoise', {'noise_threshold': 0})], 'mode': 'L'})
+    assert seen == [1, 1]
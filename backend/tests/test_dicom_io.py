@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from conftest import phantom, write_dicom
+from dicom_io import UnsupportedDicomError, read_dicom, render_windows
+
+
+def test_windows_render_from_one_decode(tmp_path):
+    path = tmp_path / 'ct.dcm'
+    write_dicom(path, (phantom(64) * 4000).astype(np.uint16), window=(2000, 1000))
+    values, info = read_dicom(str(path))
+    rendered = {name: (array, metrics) for name, array, metrics in render_windows(values, info, ['auto', 'full'])}
+    auto, metrics = rendered['auto']
+    assert auto.dtype == np.uint8 and metrics == {'preset': 'auto', 'center': 2000.0, 'width': 1000.0}
+    inside = (values > 1600) & (values < 2400)
+    assert 0 < auto[inside].min() and auto[inside].max() < 255
+    full = rendered['full'][0]
+    assert full.dtype == np.uint16 and full.min() == 0 and full.max() == 65535
+
+
+@pytest.mark.parametrize('planar', [False, True])
+def test_eight_bit_colour_is_passed_through_in_either_layout(tmp_path, planar):
+    rgb = (np.random.default_rng(0).random((32, 48, 3)) * 255).astype(np.uint8)
+    path = tmp_path / 'doppler.dcm'
+    write_dicom(path, rgb, planar=planar)
+    values, info = read_dicom(str(path))
+    [(name, array, _)] = render_windows(values, info, ['bone'])
+    assert name == 'color' and np.array_equal(array, rgb)
+
+
+def test_wider_colour_samples_are_refused_not_wrapped():
+    values = np.full((8, 8, 3), 1000, np.uint16)
+    with pytest.raises(UnsupportedDicomError, match='8 bits per sample'):
+        render_windows(values, {}, [])
+
+
+def test_sixteen_bit_colour_upload_is_rejected(server, tmp_path):
+    from fastapi.testclient import TestClient
+
+    path = tmp_path / 'rgb16.dcm'
+    write_dicom(path, np.full((16, 16, 3), 1000, np.uint16))
+    with TestClient(server.app) as client:
+        response = client.post('/api/images/upload', files={'file': ('rgb16.dcm', path.read_bytes())},
+                               data={'patient_id': 'P001', 'patient_name': 'Test', 'image_type': 'XRAY'})
+    assert response.status_code == 415
+
+
+def test_each_requested_window_is_stored_and_downloadable(server, tmp_path):
+    from fastapi.testclient import TestClient
+
+    path = tmp_path / 'ct.dcm'
+    write_dicom(path, (phantom(64) * 3000).astype(np.uint16))
+    with TestClient(server.app) as client:
+        response = client.post('/api/images/upload', files={'file': ('ct.dcm', path.read_bytes())},
+                               data={'patient_id': 'P001', 'patient_name': 'Test', 'image_type': 'CT',
+                                     'window': 'lung,bone'})
+        assert response.status_code == 200, response.text
+        url = response.json()['data']['enhanced_url']
+        primary, bone = client.get(url), client.get(url, params={'window': 'bone'})
+        brain = client.get(url, params={'window': 'brain'})
+    assert primary.status_code == bone.status_code == 200 and primary.content != bone.content
+    assert brain.status_code == 404
@@ -0,0 +1,45 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import phantom
+from encoders import encode_image, parse_encoding, resolve_encoding
+
+
+def test_specs_are_normalized():
+    assert parse_encoding(None) == {'format': 'png', 'level': 6, 'strategy': 'default'}
+    assert parse_encoding('PNG:1:RLE') == {'format': 'png', 'level': 1, 'strategy': 'rle'}
+    assert parse_encoding('jpg:90') == {'format': 'jpeg', 'level': 90, 'strategy': 'default'}
+    assert parse_encoding({'format': 'webp'}) == {'format': 'webp', 'level': 50, 'strategy': 'default'}
+
+
+@pytest.mark.parametrize('spec', ['gif', 'png:10', 'jpeg:0', 'png:fast', 'webp:50:rle', 'png:1:zstd', 'png:1:rle:x'])
+def test_invalid_specs_are_refused(spec):
+    with pytest.raises(ValueError):
+        parse_encoding(spec)
+
+
+def test_request_then_modality_then_default():
+    defaults = {'default': 'png:1', 'modalities': {'ultrasound': 'webp'}}
+    assert resolve_encoding('jpeg', 'ULTRASOUND', defaults)['format'] == 'jpeg'
+    assert resolve_encoding(None, 'ULTRASOUND', defaults)['format'] == 'webp'
+    assert resolve_encoding(None, 'CT', defaults) == {'format': 'png', 'level': 1, 'strategy': 'default'}
+
+
+@pytest.mark.parametrize('spec', ['png:1:rle', 'png:9', 'webp:0', 'webp:100'])
+def test_png_and_webp_are_lossless(spec):
+    img = Image.fromarray((phantom(64) * 255).astype(np.uint8))
+    data, metrics = encode_image(img, spec)
+    assert np.array_equal(np.asarray(Image.open(io.BytesIO(data)).convert('L')), np.asarray(img))
+    assert metrics['media_type'] == 'image/' + spec.split(':')[0]
+
+
+def test_sixteen_bit_data_keeps_its_depth_in_png_only():
+    img = Image.fromarray((phantom(64) * 60000).astype(np.uint16))
+    png, _ = encode_image(img, 'png')
+    assert np.array_equal(np.asarray(Image.open(io.BytesIO(png))), np.asarray(img))
+    webp, _ = encode_image(img, 'webp')
+    decoded = np.asarray(Image.open(io.BytesIO(webp)).convert('L'))
+    assert np.array_equal(decoded, np.asarray(img) >> 8)  # 8-bit formats keep the top byte
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import phantom
+from enhancement_engine import apply_modality_enhancement, to_working_image
+
+
+def gray(size=64):
+    return Image.fromarray((phantom(size) * 255).astype(np.uint8))
+
+
+def test_working_images_are_single_channel_unless_the_bands_differ():
+    assert to_working_image(gray().convert('RGB')).mode == 'L'
+    colour = np.stack([(phantom(64, seed) * 255).astype(np.uint8) for seed in range(3)], axis=-1)
+    assert to_working_image(Image.fromarray(colour)).mode == 'RGB'
+    sixteen = to_working_image(Image.fromarray((phantom(64) * 60000).astype(np.uint16)))
+    assert isinstance(sixteen, np.ndarray) and sixteen.dtype == np.uint16
+
+
+@pytest.mark.parametrize('modality', ['XRAY', 'CT', 'MRI', 'ULTRASOUND', 'DXA', 'OTHER'])
+def test_grayscale_studies_stay_single_channel(modality):
+    enhanced, _ = apply_modality_enhancement(to_working_image(gray()), modality)
+    assert enhanced.mode == 'L'
+    enhanced, _ = apply_modality_enhancement(to_working_image(gray()), modality, output_mode='RGB')
+    assert enhanced.mode == 'RGB'
+
+
+def test_sixteen_bit_studies_keep_their_depth():
+    array = (phantom(64) * 60000).astype(np.uint16)
+    enhanced, _ = apply_modality_enhancement(array, 'XRAY')
+    values = np.asarray(enhanced)
+    assert values.dtype == np.uint16 and len(np.unique(values)) > 256
+
@@ -0,0 +1,86 @@
+import base64
+import io
+import json
+
+import numpy as np
+from PIL import Image
+
+from conftest import phantom, png
+from image_features import describe, summarize
+
+
+def test_field_of_view_excludes_a_uniform_border():
+    framed = np.zeros((200, 300), np.uint8)
+    framed[40:160, 60:240] = (phantom(180, noise=0.02)[:120] * 255).astype(np.uint8)
+    features = summarize(Image.fromarray(framed))
+    left, top, right, bottom = features['field_of_view']['box']
+    assert abs(left - 60) <= 2 and abs(top - 40) <= 2 and abs(right - 240) <= 2 and abs(bottom - 160) <= 2
+    assert features['exposure']['clipped_black'] < 0.05  # The black frame is not counted as exposure
+    assert 'Field of view: 36% of the frame' in describe(features)
+
+
+def test_exposure_and_noise_labels():
+    dark = summarize(Image.fromarray((phantom(128) * 60).astype(np.uint8)))
+    assert dark['exposure']['label'] == 'underexposed'
+    rng = np.random.default_rng(0)
+    noisy = summarize(Image.fromarray(np.clip(phantom(128) * 255 + rng.normal(0, 25, (128, 128)), 0, 255)
+                                      .astype(np.uint8)))
+    assert noisy['noise']['label'] == 'high'
+    sixteen = summarize((phantom(128) * 65535).astype(np.uint16))
+    assert sixteen['bit_depth'] == 16 and sixteen['exposure']['label'] == 'normal'
+
+
+def test_batch_reports_describe_each_image(server):
+    from fastapi.testclient import TestClient
+
+    bright = (phantom(96, seed=1) * 255).astype(np.uint8)
+    dark = (phantom(96, seed=2) * 50).astype(np.uint8)
+    files = [('files', ('bright.png', png(bright), 'image/png')), ('files', ('dark.png', png(dark), 'image/png'))]
+    with TestClient(server.app) as client:
+        response = client.post('/api/images/batch', files=files,
+                               data={'patient_id': 'P001', 'patient_name': 'Test', 'image_type': 'XRAY'})
+        lines = [json.loads(line) for line in response.text.splitlines()]
+    results = {line['filename']: line for line in lines if 'filename' in line}
+    assert all(result['success'] for result in results.values())
+    assert len(server.prompts) == 2
+    labels = {name: result['data']['metrics']['features']['exposure']['label'] for name, result in results.items()}
+    assert labels['dark.png'] == 'underexposed' and labels['bright.png'] != 'underexposed'
+    assert sum('Exposure: underexposed' in prompt for prompt in server.prompts) == 1
+
+
+def test_the_upload_report_prompt_carries_the_summary(server):
+    from fastapi.testclient import TestClient
+
+    with TestClient(server.app) as client:
+        response = client.post('/api/images/upload',
+                               files={'file': ('dark.png', png((phantom(96) * 50).astype(np.uint8)))},
+                               data={'patient_id': 'P001', 'patient_name': 'Test', 'image_type': 'XRAY'})
+    features = response.json()['data']['metrics']['features']
+    [prompt] = server.prompts
+    assert describe(features) in prompt and 'Exposure: underexposed' in prompt
+
+
+class RecordingBedrock:
+    """Stands in for the bedrock-runtime client, keeping each prompt"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def invoke_model(self, modelId, body):
+        self.prompts.append(json.loads(body)['inputText'])
+        return {'body': io.BytesIO(json.dumps({'results': [{'outputText': 'analysis'}]}).encode())}
+
+
+def test_a_lambda_batch_reports_on_each_image(lambda_module, monkeypatch):
+    bedrock = RecordingBedrock()
+    monkeypatch.setattr(lambda_module, 'bedrock_runtime', bedrock)
+    images = [{'image_base64': base64.b64encode(png((phantom(96, seed) * scale).astype(np.uint8))).decode()}
+              for seed, scale in ((1, 255), (2, 50))]
+    response = lambda_module.lambda_handler({'images': images, 'image_type': 'xray'}, None)
+    body = json.loads(response['body'])
+    assert 'bedrock_analysis' not in body
+    assert [r['bedrock_analysis']['analysis'] for r in body['results']] == ['analysis', 'analysis']
+    assert len(bedrock.prompts) == 2
+    for result in body['results']:
+        assert sum(describe(result['metrics']['features']) in prompt for prompt in bedrock.prompts) == 1
+    assert sum('Exposure: underexposed' in prompt for prompt in bedrock.prompts) == 1
@@ -0,0 +1,39 @@
+import base64
+import io
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import phantom, png
+
+
+@pytest.fixture
+def handler(lambda_module):
+    return lambda_module.lambda_handler
+
+
+def payload(seed=0):
+    return base64.b64encode(png((phantom(96, seed) * 255).astype(np.uint8))).decode()
+
+
+def test_base64_round_trip(handler):
+    response = handler({'image_base64': payload(), 'image_type': 'xray', 'use_bedrock': False}, None)
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    enhanced = Image.open(io.BytesIO(base64.b64decode(body['enhanced_image'], validate=True)))
+    assert enhanced.mode == 'L' and 'error' not in body['metrics']
+
+
+def test_api_gateway_batch(handler):
+    images = [{'image_base64': payload(seed), 'image_type': 'ct'} for seed in range(2)]
+    response = handler({'body': json.dumps({'images': images, 'use_bedrock': False})}, None)
+    body = json.loads(response['body'])
+    assert response['statusCode'] == 200 and body['succeeded'] == 2
+    for result in body['results']:
+        Image.open(io.BytesIO(base64.b64decode(result['enhanced_image']))).verify()
+
+
+def test_missing_input_is_a_bad_request(handler):
+    assert handler({'image_type': 'xray'}, None)['statusCode'] == 400
@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import phantom, png
+
+moto = pytest.importorskip('moto')
+
+
+@pytest.fixture
+def s3(lambda_module, monkeypatch):
+    """An in-memory S3 (moto) with an 'uploads' bucket, wired into the Lambda"""
+    import boto3
+
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='uploads')
+        monkeypatch.setattr(lambda_module, 's3_client', client)
+        yield client
+
+
+def invoke(lambda_module, **body):
+    response = lambda_module.lambda_handler({'body': json.dumps(dict(body, use_bedrock=False))}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def test_results_and_previews_are_written_back_to_s3(lambda_module, s3, tmp_path):
+    s3.put_object(Bucket='uploads', Key='studies/chest.png', Body=png((phantom(600) * 255).astype(np.uint8)))
+    status, body = invoke(lambda_module, s3_bucket='uploads', s3_key='studies/chest.png', image_type='xray')
+    assert status == 200 and body['enhanced_image'] is None  # No pixels in the response
+    metrics = body['metrics']
+    assert metrics['enhanced_s3']['key'] == 'enhanced/studies/chest_enhanced.png'
+    assert metrics['enhanced_s3']['url'].startswith('https://')
+    path = tmp_path / 'enhanced.png'
+    s3.download_file('uploads', metrics['enhanced_s3']['key'], str(path))
+    assert Image.open(path).size[0] >= 600
+    assert metrics['thumbnail_s3'] == metrics['previews_s3']['256']
+    stored = {item['Key'] for item in s3.list_objects_v2(Bucket='uploads', Prefix='enhanced/')['Contents']}
+    assert stored == {reference['key'] for reference in [metrics['enhanced_s3'], *metrics['previews_s3'].values()]}
+
+
+def test_a_missing_object_is_not_found(lambda_module, s3):
+    status, body = invoke(lambda_module, s3_bucket='uploads', s3_key='studies/missing.png', image_type='xray')
+    assert status == 404 and not body['success']
@@ -0,0 +1,72 @@
+import base64
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from memory_budget import plan_memory, read_header, reduce_array
+from pipelines import get_pipeline
+from tiled_engine import MemoryBudgetExceeded
+
+STEPS = get_pipeline('XRAY')['steps']
+
+
+def header(side, mode):
+    return {'width': side, 'height': side, 'format': 'PNG', 'mode': mode}
+
+
+@pytest.mark.parametrize('budget, action, reduce', [
+    (400, 'none', 1),
+    (250, 'tiled', 1),
+    (150, 'grayscale', 1),
+    (100, 'preview', 2),
+])
+def test_colour_plan_escalates_as_the_budget_shrinks(budget, action, reduce):
+    plan = plan_memory(header(3000, 'RGB'), STEPS, budget)
+    assert (plan['action'], plan['reduce']) == (action, reduce)
+    assert plan['estimated_peak_mb'] <= budget
+    assert plan['mode'] == (None if action in ('none', 'tiled') else 'L')
+
+
+def test_more_budget_never_gives_a_worse_plan():
+    order = ['none', 'tiled', 'grayscale', 'preview']
+    actions = [plan_memory(header(3000, 'RGB'), STEPS, budget)['action'] for budget in range(400, 40, -10)]
+    assert [order.index(action) for action in actions] == sorted(order.index(action) for action in actions)
+
+
+def test_grayscale_image_skips_straight_to_a_preview():
+    plan = plan_memory(header(3000, 'L'), STEPS, 100)
+    assert plan['action'] == 'preview' and plan['mode'] is None
+
+
+def test_budget_too_small_for_any_preview():
+    with pytest.raises(MemoryBudgetExceeded):
+        plan_memory(header(2000, 'RGB'), STEPS, 10)
+
+
+def test_read_header_restores_the_position():
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30)).save(buffer, 'PNG')
+    buffer.seek(5)
+    assert read_header(buffer) == header(40, 'RGB') | {'height': 30}
+    assert buffer.tell() == 5
+
+
+def test_reduce_array_is_a_block_mean():
+    array = np.arange(36, dtype=np.uint16).reshape(6, 6)
+    reduced = reduce_array(array, 2)
+    assert reduced.dtype == np.uint16 and reduced.shape == (3, 3)
+    assert reduced[0, 0] == round((0 + 1 + 6 + 7) / 4)
+    assert reduce_array(np.zeros((5, 7, 3), np.uint8), 2).shape == (2, 3, 3)
+
+
+def test_lambda_returns_a_preview_over_budget(lambda_module):
+    rng = np.random.default_rng(0)
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (1024, 1024, 3), dtype=np.uint8)).save(buffer, 'PNG')
+    enhanced, metrics = lambda_module.enhance_image_by_modality(
+        base64.b64encode(buffer.getvalue()).decode(), 'XRAY', memory_budget_mb=20)
+    assert metrics['memory_plan']['action'] == 'preview' and metrics['memory_plan']['reduce'] == 2
+    image = Image.open(io.BytesIO(base64.b64decode(enhanced)))
+    assert image.size == (512, 512) and image.mode == 'L'
@@ -0,0 +1,37 @@
+import numpy as np
+
+from conftest import phantom, write_nifti
+from nifti_volume import enhance_volume, read_nifti_header
+from pipelines import configure_pipelines, get_pipeline
+
+
+def test_volume_slices_keep_their_size_when_the_pipeline_upscales(tmp_path):
+    configure_pipelines(stage_defaults={'upscale': {'enabled': True, 'scale_factor': 2}})
+    try:
+        assert get_pipeline('CT')['steps'][-1][0] == 'upscale'
+        volume = np.stack([phantom(64, seed) * 2000 - 1000 for seed in range(3)])[:, :48]
+        source, output = tmp_path / "ct.nii", tmp_path / "ct_enhanced.nii"
+        write_nifti(source, volume)
+        metrics = enhance_volume(str(source), str(output), 'CT', window='soft_tissue', workers=1)
+    finally:
+        configure_pipelines()
+
+    header = read_nifti_header(str(output))
+    assert (header['width'], header['height'], header['num_slices']) == (64, 48, 3)
+    assert metrics['slices'] == 3
+    data = np.fromfile(output, dtype=header['dtype'], offset=header['vox_offset'])
+    assert data.size == 64 * 48 * 3
+
+
+def test_volume_upload_through_the_configured_pool(server, tmp_path):
+    from fastapi.testclient import TestClient
+
+    volume = np.stack([phantom(64, seed) * 2000 - 1000 for seed in range(4)])
+    source = tmp_path / "upload.nii"
+    write_nifti(source, volume)
+    with TestClient(server.app) as client, open(source, 'rb') as f:
+        response = client.post('/api/volumes/upload',
+                               data={'patient_id': 'P001', 'patient_name': 'Test', 'image_type': 'CT'},
+                               files={'file': ('upload.nii', f, 'application/octet-stream')})
+    assert response.status_code == 200, response.text
+    assert response.json()['data']['metrics']['slices'] == 4
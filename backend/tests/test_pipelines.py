@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+
+from conftest import phantom
+from enhancement_engine import apply_modality_enhancement
+from pipelines import compile_pipeline, configure_pipelines, get_pipeline
+
+STAGES = [{'autocontrast': 2}, {'median': 3}, 'invert', {'brightness': 1.1}, {'contrast': 1.2}, {'sharpness': 1.0}]
+
+
+@pytest.fixture
+def configured():
+    """configure_pipelines for one test, restoring the built-in pipelines afterwards"""
+    yield configure_pipelines
+    configure_pipelines()
+
+
+def test_point_stages_fuse_and_move_ahead_of_rank_filters():
+    steps = compile_pipeline(STAGES, 'TEST')['steps']
+    assert steps == [
+        ('tone', [('autocontrast', 2.0), ('invert', None), ('brightness', 1.1)]),
+        ('median', 3),
+        ('tone', [('contrast', 1.2)]),  # Needs the filtered image's mean: stays after the median
+    ]  # The identity sharpness is dropped
+
+
+def test_the_compiled_plan_gives_the_stage_by_stage_result(configured):
+    img = Image.fromarray((phantom(96) * 180 + 30).astype(np.uint8))
+    configured({'test': STAGES})
+    compiled, _ = apply_modality_enhancement(img, 'TEST', tiling={'enabled': False})
+    reference = ImageOps.autocontrast(img, cutoff=2).filter(ImageFilter.MedianFilter(3))
+    reference = ImageEnhance.Brightness(ImageOps.invert(reference)).enhance(1.1)
+    reference = ImageEnhance.Contrast(reference).enhance(1.2)
+    assert np.array_equal(np.asarray(compiled), np.asarray(reference))
+
+
+def test_enabled_upscale_defaults_end_every_pipeline(configured):
+    configured({'test': ['invert']}, stage_defaults={'upscale': {'enabled': True, 'scale_factor': 3}})
+    name, param = get_pipeline('test')['steps'][-1]
+    assert name == 'upscale' and param['scale_factor'] == 3
+    assert get_pipeline('X-RAY') is get_pipeline('xray')  # Aliases share one compiled plan
+
+
+@pytest.mark.parametrize('stages, factors', [
+    (['invert', 'upscale'], [3.0]),  # Listed without a factor: the default's, once
+    (['invert', {'upscale': {'method': 'lanczos'}}], [3.0]),
+    (['invert', {'upscale': 1}], []),  # An explicit identity opts the pipeline out
+])
+def test_listed_upscale_stages_take_the_defaults(stages, factors):
+    defaults = {'upscale': {'enabled': True, 'scale_factor': 3}}
+    steps = compile_pipeline(stages, 'TEST', defaults)['steps']
+    assert [param['scale_factor'] for name, param in steps if name == 'upscale'] == factors
+
+
+@pytest.mark.parametrize('stages', [
+    ['blur'],
+    [{'median': 4}],
+    [{'kernel': 'emboss_more'}],
+    [{'upscale': 2}, 'invert'],
+    [{'denoise': {'method': 'nlm', 'preset': 'ultra'}}],
+    [{'contrast': 1.2, 'brightness': 1.1}],
+])
+def test_bad_definitions_fail_when_configured(configured, stages):
+    with pytest.raises(ValueError):
+        configured({'test': stages})
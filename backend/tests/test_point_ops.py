@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance, ImageOps
+
+from conftest import phantom
+from point_ops import apply_point_ops, apply_point_ops_array
+
+CHAIN = [('autocontrast', 2), ('invert', None), ('contrast', 1.5), ('brightness', 1.1)]
+
+
+def pil_chain(img):
+    img = ImageOps.autocontrast(img, cutoff=2)
+    img = ImageOps.invert(img)
+    img = ImageEnhance.Contrast(img).enhance(1.5)
+    return ImageEnhance.Brightness(img).enhance(1.1)
+
+
+def image(mode):
+    gray = Image.fromarray((phantom(128) * 200 + 20).astype(np.uint8))
+    return gray.convert(mode)
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB'])
+def test_the_fused_lut_matches_the_step_by_step_pil_chain(mode):
+    img = image(mode)
+    assert np.array_equal(np.asarray(apply_point_ops(img, CHAIN)), np.asarray(pil_chain(img)))
+
+
+def test_an_eight_bit_array_maps_like_the_pil_image():
+    img = image('L')
+    assert np.array_equal(apply_point_ops_array(np.asarray(img), CHAIN), np.asarray(apply_point_ops(img, CHAIN)))
+
+
+def test_sixteen_bit_data_keeps_its_precision():
+    array = (phantom(128) * 20000 + 1000).astype(np.uint16)
+    result = apply_point_ops_array(array, [('autocontrast', 0), ('invert', None)])
+    assert result.dtype == np.uint16 and result.min() == 0 and result.max() == 65535
+    assert len(np.unique(result)) == len(np.unique(array))  # Distinct levels are not merged
+    assert np.corrcoef(result.ravel(), array.ravel())[0, 1] < -0.99
+
+
+def test_no_ops_leave_the_input_alone():
+    img = image('L')
+    assert apply_point_ops(img, []) is img
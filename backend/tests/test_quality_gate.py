@@ -0,0 +1,37 @@
+import numpy as np
+from PIL import Image
+
+from conftest import phantom
+from quality_gate import DEFAULT_GATE, assess, gate, gate_steps
+
+
+def assessment(spread=0.5, noise=4.0, sharpness=100.0):
+    return {'spread': spread, 'noise': noise, 'sharpness': sharpness}
+
+
+def test_noisy_images_are_not_sharpened():
+    steps = [('sharpness', 1.5), ('kernel', 'SHARPEN'), ('denoise', {'method': 'diffusion', 'preset': 'fast'})]
+    kept, dropped, strengthened = gate_steps(steps, assessment(noise=30.0, sharpness=0.0), DEFAULT_GATE)
+    assert [name for name, _ in kept] == ['denoise']
+    assert dropped == ['sharpness', 'kernel'] and strengthened == ['denoise']
+
+
+def test_blurry_clean_images_get_stronger_sharpness():
+    kept, dropped, strengthened = gate_steps([('sharpness', 1.5)], assessment(noise=4.0, sharpness=5.0),
+                                             DEFAULT_GATE)
+    assert kept == [('sharpness', 1 + 0.5 * DEFAULT_GATE['strengthen'])] and strengthened == ['sharpness']
+
+
+def test_well_exposed_tone_steps_fuse_after_dropping():
+    steps = [('tone', [('contrast', 1.2)]), ('clahe', {}), ('tone', [('invert', None)])]
+    kept, dropped, _ = gate_steps(steps, assessment(spread=0.9), DEFAULT_GATE)
+    assert kept == [('tone', [('invert', None)])] and dropped == ['contrast', 'clahe']
+
+
+def test_noisy_image_end_to_end():
+    rng = np.random.default_rng(0)
+    noisy = Image.fromarray(np.clip(phantom(256) * 255 + rng.normal(0, 30, (256, 256)), 0, 255).astype(np.uint8))
+    measured = assess(noisy)
+    assert measured['noise'] >= DEFAULT_GATE['noisy']
+    steps, info = gate(noisy, [('sharpness', 1.5)], dict(DEFAULT_GATE))
+    assert steps == [] and 'sharpness' not in info['strengthened'] and info['decision'] == 'skip'
@@ -0,0 +1,57 @@
+import math
+
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance, ImageFilter
+
+from conftest import phantom
+from quality_metrics import MAX_PSNR, compute_quality_metrics
+
+
+def gray(size=512, seed=0):
+    return Image.fromarray((phantom(size, seed) * 200 + 20).astype(np.uint8))
+
+
+def test_identical_images_score_perfectly():
+    img = gray()
+    metrics = compute_quality_metrics(img, img.copy(), 'full')
+    assert metrics['psnr'] == MAX_PSNR and metrics['ssim'] == 1.0
+    assert metrics['contrast_improvement'] == metrics['sharpness_improvement'] == 0
+
+
+def test_psnr_follows_the_mean_squared_error():
+    img = gray()
+    shifted = Image.fromarray(np.asarray(img) + np.uint8(5))
+    assert compute_quality_metrics(img, shifted, 'full')['psnr'] == round(10 * math.log10(255 ** 2 / 25), 2)
+
+
+def test_contrast_and_sharpness_changes_have_the_right_sign():
+    img = gray()
+    stronger = compute_quality_metrics(img, ImageEnhance.Contrast(img).enhance(1.5), 'full')
+    blurred = compute_quality_metrics(img, img.filter(ImageFilter.GaussianBlur(2)), 'full')
+    assert stronger['contrast_improvement'] > 0 and blurred['sharpness_improvement'] < 0
+    assert blurred['ssim'] < 1
+
+
+@pytest.mark.parametrize('change', [
+    lambda img: ImageEnhance.Contrast(img).enhance(1.3),
+    lambda img: img.filter(ImageFilter.GaussianBlur(1)),
+    lambda img: img.filter(ImageFilter.SHARPEN),
+])
+def test_fast_mode_tracks_full_resolution(change):
+    img = gray(768)
+    enhanced = change(img)
+    fast = compute_quality_metrics(img, enhanced, 'fast')
+    full = compute_quality_metrics(img, enhanced, 'full')
+    assert fast['metrics_mode'] == 'fast' and abs(fast['psnr'] - full['psnr']) < 1.5
+    assert abs(fast['ssim'] - full['ssim']) < 0.03
+
+
+def test_upscaled_output_is_compared_on_the_input_grid():
+    img = gray(128)
+    metrics = compute_quality_metrics(img, img.resize((256, 256), Image.BICUBIC), 'full')
+    assert metrics['psnr'] > 30
+
+
+def test_off_mode_measures_nothing():
+    assert compute_quality_metrics(gray(), gray(), 'off') == {}
@@ -0,0 +1,49 @@
+import io
+import os
+
+import numpy as np
+
+from conftest import phantom, png
+from result_cache import DirectoryBacking, ResultCache, hash_source
+
+
+def test_the_key_hashes_the_file_the_same_way_from_bytes_path_and_file_object(tmp_path):
+    content = png((phantom(32) * 255).astype(np.uint8))
+    path = tmp_path / 'study.png'
+    path.write_bytes(content)
+    stream = io.BytesIO(b'xx' + content)
+    stream.seek(2)
+    assert hash_source(content) == hash_source(str(path)) == hash_source(stream)
+    assert stream.tell() == 2  # File objects are left where they were
+
+
+def test_the_key_changes_with_the_input_modality_params_and_version(tmp_path):
+    cache = ResultCache(str(tmp_path), 1 << 20, 1)
+    content = png((phantom(32) * 255).astype(np.uint8))
+    key = cache.key(content, 'xray', {'steps': [['sharpness', 1.5]]})
+    assert key == cache.key(content, 'XRAY', {'steps': [['sharpness', 1.5]]})
+    assert key != cache.key(content + b'\0', 'XRAY', {'steps': [['sharpness', 1.5]]})
+    assert key != cache.key(content, 'CT', {'steps': [['sharpness', 1.5]]})
+    assert key != cache.key(content, 'XRAY', {'steps': [['sharpness', 2.0]]})
+    assert key != ResultCache(str(tmp_path), 1 << 20, 2).key(content, 'XRAY', {'steps': [['sharpness', 1.5]]})
+
+
+def test_round_trip_and_least_recently_used_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), 350_000, 1)  # Room for three entries
+    for name in 'abc':
+        cache.put(name, {'psnr': 30}, {'.png': os.urandom(100_000)})
+        os.utime(cache.entry_path(name), (len(name), ord(name)))  # Distinct mtimes: a oldest
+    cache.get('a')  # Refreshes a, leaving b the oldest
+    cache.put('d', {}, {'.png': os.urandom(100_000)})
+    assert cache.get('b') is None and cache.get('a')[0] == {'psnr': 30} and cache.get('c')
+    assert len(cache.get('d')[1]['.png']) == 100_000
+
+
+def test_a_new_version_discards_old_entries_and_the_backing_store_fills_misses(tmp_path):
+    shared = DirectoryBacking(str(tmp_path / 'shared'))
+    first = ResultCache(str(tmp_path / 'one'), 1 << 20, 1, shared)
+    first.put('key', {'psnr': 30}, {'.png': b'image'})
+    second = ResultCache(str(tmp_path / 'two'), 1 << 20, 1, shared)
+    assert second.get('key') == ({'psnr': 30}, {'.png': b'image'})
+    ResultCache(str(tmp_path / 'one'), 1 << 20, 2)
+    assert os.listdir(tmp_path / 'one') == ['pipeline-2']
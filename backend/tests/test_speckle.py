@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from conftest import phantom
+from speckle import reduce_speckle
+
+LOOKS = 4  # Unit-mean gamma speckle with coefficient of variation 1 / sqrt(LOOKS)
+
+
+def speckled(dtype=np.uint8):
+    clean = (phantom(128, noise=0) * 150 + 50) * (np.iinfo(dtype).max / 255)
+    speckle = np.random.default_rng(0).gamma(LOOKS, 1 / LOOKS, clean.shape)
+    return clean, np.clip(clean * speckle, 0, np.iinfo(dtype).max).astype(dtype)
+
+
+def psnr(reference, image, max_value=255):
+    return 10 * np.log10(max_value ** 2 / np.mean((reference - image.astype(float)) ** 2))
+
+
+@pytest.mark.parametrize('method', ['lee', 'kuan'])
+def test_speckle_is_estimated_and_removed(method):
+    clean, noisy = speckled()
+    filtered, info = reduce_speckle(noisy, method)
+    assert abs(info['speckle'] - 1 / np.sqrt(LOOKS)) < 0.1
+    assert psnr(clean, filtered) > psnr(clean, noisy) + 10
+
+
+def test_sixteen_bit_speckle_reads_the_same():
+    clean, noisy = speckled(np.uint16)
+    filtered, info = reduce_speckle(noisy)
+    assert filtered.dtype == np.uint16 and abs(info['speckle'] - 1 / np.sqrt(LOOKS)) < 0.1
+    assert psnr(clean, filtered, 65535) > psnr(clean, noisy, 65535) + 10
+
+
+def test_edges_and_flat_regions_are_kept():
+    step = np.full((64, 64), 50, np.uint8)
+    step[:, 32:] = 200
+    assert np.array_equal(reduce_speckle(step)[0], step)
+
+
+def test_even_windows_are_refused():
+    with pytest.raises(ValueError):
+        reduce_speckle(np.zeros((16, 16), np.uint8), window=4)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+import super_resolution
+from conftest import phantom
+from super_resolution import upscale
+
+
+def line_art(size=256):
+    """Sharp diagonal lines and a ring on a dark background"""
+    img = Image.new('L', (size, size), 40)
+    draw = ImageDraw.Draw(img)
+    for index in range(12):
+        draw.line([(10 + index * 20, 0), (60 + index * 15, size - 1)], fill=220, width=3)
+    draw.ellipse([60, 60, 200, 200], outline=180, width=4)
+    return np.asarray(img)
+
+
+def psnr(reference, image):
+    return 10 * np.log10(255 ** 2 / np.mean((reference.astype(float) - image) ** 2))
+
+
+def test_edge_directed_beats_bicubic_on_edges():
+    reference = line_art()
+    small = Image.fromarray(reference).resize((128, 128), Image.BOX)
+    upscaled, info = upscale(np.asarray(small), 2)
+    assert upscaled.shape == reference.shape and not info['skipped']
+    assert psnr(reference, upscaled) > psnr(reference, np.asarray(small.resize((256, 256), Image.BICUBIC)))
+
+
+def test_strips_equal_whole_image_processing(monkeypatch):
+    array = (phantom(96) * 255).astype(np.uint8)
+    whole, _ = upscale(array, 2, workers=1)
+    monkeypatch.setattr(super_resolution, 'STRIP_PIXELS', 256)
+    assert np.array_equal(whole, upscale(array, 2, workers=3)[0])
+
+
+@pytest.mark.parametrize('shape, dtype', [((40, 60), np.uint16), ((40, 60, 3), np.uint8)])
+def test_any_factor_depth_and_channel_count(shape, dtype):
+    array = (np.random.default_rng(0).random(shape) * np.iinfo(dtype).max).astype(dtype)
+    upscaled, info = upscale(array, 3)
+    assert upscaled.dtype == dtype and upscaled.shape == (120, 180) + shape[2:]
+    assert info['size'] == [180, 120]
+
+
+def test_outputs_over_the_caps_are_skipped():
+    array = np.zeros((100, 100), np.uint8)
+    skipped, info = upscale(array, 4, max_megapixels=0.1)
+    assert skipped is array and info['skipped'] and 'MP' in info['reason']
+    assert upscale(array, 2, max_memory_mb=0.01)[1]['skipped']
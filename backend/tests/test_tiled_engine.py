@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import phantom
+from enhancement_engine import apply_modality_enhancement
+from pipelines import get_pipeline
+from tiled_engine import (MB, WHOLE_IMAGE_WORKING_BYTES, MemoryBudgetExceeded, plan_tiles,
+                          tiling_plan)
+
+MODALITIES = ['XRAY', 'CT', 'MRI', 'ULTRASOUND', 'DXA', 'OTHER']
+
+
+def image(kind, size=600):
+    values = phantom(size) * 0.8 + 0.08
+    if kind == 'uint16':
+        return (values * 65535).astype(np.uint16)
+    gray = Image.fromarray((values * 255).astype(np.uint8))
+    return gray.convert(kind)
+
+
+@pytest.mark.parametrize('modality', MODALITIES)
+@pytest.mark.parametrize('kind', ['L', 'RGB', 'uint16'])
+@pytest.mark.parametrize('tiling', [
+    {'enabled': True, 'tile_size': 200, 'workers': 2},
+    # A cap with no room for the filtered intermediate: tone statistics are recomputed
+    {'enabled': True, 'max_memory_mb': 2.5, 'workers': 2},
+], ids=['tile_size', 'memory_cap'])
+def test_tiled_output_equals_whole_image_output(modality, kind, tiling):
+    img = image(kind)
+    if 'max_memory_mb' in tiling:
+        # On top of what the untiled CLAHE, denoise or speckle steps hold
+        steps = get_pipeline(modality)['steps']
+        whole_step = max((WHOLE_IMAGE_WORKING_BYTES.get(step[0], 0) for step in steps), default=0)
+        tiling = dict(tiling, max_memory_mb=tiling['max_memory_mb'] + 600 * 600 * whole_step / MB)
+    whole, _ = apply_modality_enhancement(img, modality, tiling={'enabled': False})
+    tiled, metrics = apply_modality_enhancement(img, modality, tiling=tiling)
+    assert metrics['tiling']['tiles'] > 1
+    assert np.array_equal(np.asarray(whole), np.asarray(tiled))
+
+
+def test_small_images_are_not_tiled_by_default():
+    assert tiling_plan(image('L', 256), get_pipeline('XRAY')['steps']) is None
+
+
+def test_a_cap_below_the_input_and_output_is_refused():
+    with pytest.raises(MemoryBudgetExceeded):
+        tiling_plan(image('L'), get_pipeline('XRAY')['steps'], {'max_memory_mb': 0.5})
+
+
+def test_planned_peak_stays_under_the_cap():
+    # CLAHE runs untiled, so its working memory comes out of the tiles' share
+    for cap in range(160, 300, 20):
+        plan = plan_tiles(3000, 3000, 4, 16, get_pipeline('XRAY')['steps'], {'max_memory_mb': cap})
+        assert plan['estimated_peak_mb'] <= cap
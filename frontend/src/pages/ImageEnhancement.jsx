@@ -74,7 +74,7 @@ export default function ImageEnhancement() {
       
       if (result.success) {
         // Enhanced image from API
-        setEnhancedImage(result.enhanced_image ? `data:image/png;base64,${result.enhanced_image}` : selectedImage)
+        setEnhancedImage(result.enhanced_image ? `data:${result.metrics?.media_type || 'image/png'};base64,${result.enhanced_image}` : selectedImage)
         
         // Set metrics - handle both response formats
         const metricsData = result.metrics || result.data?.metrics || {
@@ -185,11 +185,12 @@ export default function ImageEnhancement() {
                     '& .MuiSvgIcon-root': { color: 'white' }
                   }}
                 >
-                  <MenuItem value="xray">🩻 X-Ray (Inverted + 50% Contrast + 100% Sharpness)</MenuItem>
+                  <MenuItem value="xray">🩻 X-Ray (CLAHE + Inverted + 50% Contrast + 100% Sharpness)</MenuItem>
                   <MenuItem value="ct">💿 CT Scan (Grayscale + Edge Enhancement + 40% Contrast)</MenuItem>
                   <MenuItem value="mri">🧠 MRI (60% Contrast + Noise Reduction + 50% Sharpness)</MenuItem>
                   <MenuItem value="ultrasound">📡 Ultrasound (Speckle Reduction + 30% Contrast)</MenuItem>
                   <MenuItem value="dxa">🦴 DXA (70% Contrast + 120% Sharpness)</MenuItem>
+                  <MenuItem value="mammography">🎀 Mammography (CLAHE + 50% Sharpness)</MenuItem>
                 </Select>
               </FormControl>
               
@@ -212,6 +213,7 @@ export default function ImageEnhancement() {
                   {modality === 'mri' && '• Maximum contrast • Noise filtering • Brightness optimized'}
                   {modality === 'ultrasound' && '• Speckle noise removed • Smoothed • Enhanced visibility'}
                   {modality === 'dxa' && '• Extreme contrast • Maximum sharpness • Bone optimized'}
+                  {modality === 'mammography' && '• Adaptive local contrast • Dense tissue detail • Calcifications sharpened'}
                 </Typography>
               </Box>
 